@@ -0,0 +1,158 @@
+"""Tick-to-screen latency, CPU per 1000 ticks and memory growth of the full app.
+
+Starts core.fake_gateway in --probe mode in a subprocess, runs the real
+core.ib_client + TUI against it on a headless urwid screen, and measures on
+every drawn frame how old the LAST tick on screen is.
+
+    python benchmarks/end_to_end.py [--seconds 60] [--tick-rate 500] [--tbt-rate 0]
+"""
+import argparse
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np
+import urwid
+
+
+class HeadlessScreen(urwid.display.BaseScreen):
+    """Renders every canvas fully, like a terminal screen would, but writes nothing."""
+    def __init__(self, cols=160, rows=48, on_draw=None):
+        super().__init__()
+        self.size = (cols, rows)
+        self.on_draw = on_draw
+        self.frames = 0
+
+    def get_cols_rows(self):
+        return self.size
+
+    def hook_event_loop(self, event_loop, callback):
+        pass
+
+    def unhook_event_loop(self, event_loop):
+        pass
+
+    def draw_screen(self, size, canvas):
+        for _row in canvas.content():
+            pass
+        self.frames += 1
+        if self.on_draw is not None:
+            self.on_draw()
+
+    def clear(self):
+        pass
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f"fake gateway didn't listen on {port}")
+
+
+def rss_kib():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * resource.getpagesize() // 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--tick-rate', type=float, default=500.0, help="LAST ticks/s per subscribed contract")
+    parser.add_argument('--tbt-rate', type=float, default=0.0)
+    parser.add_argument('--warmup', type=float, default=3.0, help="Seconds excluded from the statistics")
+    args = parser.parse_args()
+
+    port = free_port()
+    gateway = subprocess.Popen([sys.executable, '-m', 'core.fake_gateway', '--port', str(port), '--probe',
+                                '--tick-rate', str(args.tick_rate), '--tbt-rate', str(args.tbt_rate)], cwd=ROOT)
+    try:
+        wait_for_port(port)
+        os.environ.update(IB_HOST='127.0.0.1', IB_PORT=str(port))
+        for name in ('EMAIL_HOST', 'EMAIL_PORT', 'EMAIL_FROM', 'EMAIL_TO', 'EMAIL_SUBJECT', 'EMAIL_USER', 'EMAIL_PASSWORD'):
+            os.environ.setdefault(name, '127.0.0.1' if name == 'EMAIL_HOST' else '1' if name == 'EMAIL_PORT' else 'bench')
+        os.chdir(tempfile.mkdtemp(prefix='hydra-e2e-'))  # Keep ./log out of the repo
+        run(args)
+    finally:
+        gateway.terminate()
+        gateway.wait()
+
+
+def run(args):
+    from main import TUI
+    from core.ib_client import tickers
+
+    latencies = []
+    measuring = [False]
+    last_seen = {}
+
+    def on_draw():
+        if not measuring[0]:
+            return
+        now_us = time.monotonic_ns() // 1000
+        for name, ticker in tickers.items():
+            stamp = ticker.lastSize
+            if stamp and stamp == stamp and last_seen.get(name) != stamp:  # Each tick counted once, on its first frame
+                last_seen[name] = stamp
+                latencies.append(now_us - stamp)
+
+    screen = HeadlessScreen(on_draw=on_draw)
+    app = TUI()
+    app.draw_initial_layout()
+    app.bind_async_loop(screen=screen)
+    from core.ib_client import ib
+
+    ticks = [0]
+
+    def count_ticks(pending):
+        if measuring[0]:
+            ticks[0] += sum(len(ticker.ticks) + len(ticker.tickByTicks) for ticker in pending)
+
+    ib.pendingTickersEvent += count_ticks
+    marks = {}
+
+    def start_measuring(loop, user_data=None):
+        measuring[0] = True
+        marks.update(cpu=time.process_time(), rss=rss_kib(), frames=screen.frames)
+
+    def stop(loop, user_data=None):
+        marks.update(cpu=time.process_time() - marks['cpu'], rss=rss_kib() - marks['rss'],
+                     frames=screen.frames - marks['frames'])
+        measuring[0] = False
+        raise urwid.ExitMainLoop()
+
+    app.loop.set_alarm_in(args.warmup, start_measuring)
+    app.loop.set_alarm_in(args.warmup + args.seconds, stop)
+    app.start()
+
+    from core.ib_client import graceful_shutdown
+    graceful_shutdown()
+
+    lat = np.array(latencies, dtype=np.float64) / 1000.0
+    print(f"{args.seconds:.0f}s at {args.tick_rate:.0f} ticks/s/contract: {ticks[0]} ticks, {marks['frames']} frames")
+    if len(lat):
+        p50, p90, p99, p999 = np.percentile(lat, [50, 90, 99, 99.9])
+        print(f"  tick-to-screen ms: p50 {p50:.2f}  p90 {p90:.2f}  p99 {p99:.2f}  p99.9 {p999:.2f}  max {lat.max():.2f}")
+    print(f"  CPU: {marks['cpu']:.2f}s, {marks['cpu'] * 1000 / max(ticks[0], 1) * 1000:.1f} ms per 1000 ticks")
+    print(f"  RSS: {marks['rss'] / 1024:+.1f} MiB over the run")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""How long does a log call block the event loop?
+
+Compares the old synchronous file handler (append, re-read, rewrite past
+500 lines) with the queued logger in core/logger.py. Runs in a temporary
+directory so ./log is not touched.
+
+    python benchmarks/log_call.py [calls]
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1e6
+    return f"p50 {pick(0.50):8.1f} us   p99 {pick(0.99):8.1f} us   max {samples[-1] * 1e6:8.1f} us"
+
+
+def legacy_emit(formatter, record):
+    """The pre-queue file_handler_emit, verbatim apart from error handling."""
+    log_entry = formatter.format(record)
+    with open("./log/hydra.log", "a", encoding="utf-8") as f:
+        f.write(log_entry + "\n")
+    with open("./log/hydra.log", "r", encoding="utf-8") as f:
+        lines = f.readlines()
+    if len(lines) > 500:
+        with open("./log/hydra.log", "w", encoding="utf-8") as f:
+            f.writelines(lines[-500:])
+
+
+def main(calls=5000):
+    os.chdir(tempfile.mkdtemp(prefix="hydra-bench-"))
+    for var in ("EMAIL_HOST", "EMAIL_FROM", "EMAIL_TO", "EMAIL_SUBJECT", "EMAIL_USER", "EMAIL_PASSWORD"):
+        os.environ.setdefault(var, "bench")
+    os.environ.setdefault("EMAIL_PORT", "25")
+
+    import logging
+    from core.logger import logger, log
+
+    record = log.makeRecord(log.name, logging.INFO, __file__, 0, "tick %s @ %.2f", ("MESM5", 5321.25), None)
+    before = []
+    for _ in range(calls):
+        t0 = time.perf_counter()
+        legacy_emit(logger.formatter, record)
+        before.append(time.perf_counter() - t0)
+
+    after = []
+    for i in range(calls):
+        t0 = time.perf_counter()
+        log.info("tick %s @ %.2f", "MESM5", 5321.25)
+        after.append(time.perf_counter() - t0)
+    logger.writer.stop()
+
+    print(f"{calls} INFO calls on the loop thread")
+    print(f"  before (sync file handler): {percentiles(before)}")
+    print(f"  after  (queued writer):     {percentiles(after)}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
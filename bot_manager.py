@@ -1,11 +1,27 @@
-from bot import Bot
+from bots import Bot
 
 
 class BotManager:
-    def __init__(self, tui=None):
+    def __init__(self, tui=None, hub=None, runner=None):
         self.bots = []
         # Storing a reference to TUI (optional, but useful if bots need to send messages back)
         self.tui = tui
+        # Bots created here share one connection and one market data subscription per contract
+        self.hub = hub
+        # Optional core.bot_runner.ProcessBotRunner, for bots that run in their own process
+        self.runner = runner
+
+    def create_bot(self, codename, report_to_tui, **kwargs):
+        bot = Bot(codename, report_to_tui, hub=self.hub, **kwargs)
+        self.add_bot(bot)
+        return bot
+
+    def spawn_bot(self, codename, symbol, client_id=0):
+        """Run a Bot on `symbol` in a worker process, fed by the runner's shared-memory feed."""
+        self.runner.start_bot(codename, symbol, client_id)
+
+    def stop_spawned_bot(self, codename):
+        self.runner.stop_bot(codename)
 
     def add_bot(self, bot):
         self.bots.append(bot)
@@ -2,32 +2,48 @@ import os
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
-import talib
-
-from logger import logger, log
-from ib_async import IB, contract, util
+from core.bar_store import BarStore
+from core.event_manager import event_manager
+from core.indicators import IndicatorEngine
+from core.logger import logger, log
+from core.market_data_hub import MarketDataHub
+from core.metrics import metrics
+from ib_async import IB, contract
 
 
 class Bot:
-    def __init__(self, codename, report_to_tui, ip=os.getenv('IB_HOST'), port=os.getenv('IB_PORT'), client_id=0):
+    def __init__(self, codename, report_to_tui, ip=os.getenv('IB_HOST'), port=os.getenv('IB_PORT'), client_id=0, ib=None, hub=None, contract_cache=None, aggregator=None, orders=None):
         self.codename = codename
         self.callback = report_to_tui
         self.ip = ip
         self.port = port
         self.client_id = client_id
-        self.ib = IB()
+        # Bots sharing a MarketDataHub share its connection and one subscription per contract
+        self.owns_connection = hub is None and ib is None
+        self.ib = hub.ib if hub is not None else ib or IB()  # core.replay.ReplayIB stands in for offline runs
+        self.hub = hub or MarketDataHub(self.ib)
+        self.subscriptions = []
+        self.contract_cache = contract_cache  # Optional core.contract_cache.ContractCache
+        self.aggregator = aggregator  # Optional core.bar_aggregator.BarAggregator: bars built from the shared tick stream
+        self.orders = orders  # Optional core.order_manager.OrderManager: risk-checked order entry on the shared connection
+        self.indicators = IndicatorEngine(fast=12, slow=26, signal=9)
+        self.bar_stores = {}  # conId -> BarStore
 
     def connect(self):
+        if not self.owns_connection:
+            return
         self.ib.connect(self.ip, self.port, clientId=self.client_id)
         self.ib.errorEvent += logger.OnIBErrorEvent  # catch IB TWS errors
 
     def disconnect(self):
         log.debug("STOPPING")
-        self.ib.cancelTickByTickData(self.ticker.contract, 'Last')
-        self.bars.updateEvent -= self.onPendingBars
-        self.ib.cancelHistoricalData(self.bars)
-        self.ib.sleep(2)
-        self.ib.disconnect()
+        for subscription in self.subscriptions:
+            subscription.cancel()  # The hub cancels at IB once no other bot needs it
+        self.subscriptions.clear()
+        event_manager.unsubscribe('signals', self.onSignals)
+        if self.owns_connection:
+            self.ib.sleep(2)
+            self.ib.disconnect()
         log.debug(f"{self.codename} disconnected")
 
     def display_time(self):
@@ -38,39 +54,73 @@ class Bot:
     def qualify(self, contract_to_qualify: str):
         if contract_to_qualify.upper() in ['ES', 'NQ', 'RTY', 'MES', 'MNQ', 'M2K']:
             c = contract.ContFuture(symbol=contract_to_qualify.upper(), exchange='CME')
-            contract_obj = self.ib.qualifyContracts(c)[0]
+            if self.contract_cache is not None:
+                contract_obj = self.contract_cache.qualify_blocking(self.ib, [c])[0]
+            else:
+                contract_obj = self.ib.qualifyContracts(c)[0]
             return contract_obj
 
     def start_ticker(self, qualified_contract):
-        self.ticker = self.ib.reqTickByTickData(qualified_contract, 'Last')
-        self.ib.pendingTickersEvent += self.onPendingTickByTick
+        subscription = self.hub.subscribe_tick_by_tick(qualified_contract, self.onTickByTick, filter=lambda ticker: ticker.tickByTicks)
+        self.subscriptions.append(subscription)
+        self.ticker = subscription.ticker
 
-    def onPendingTickByTick(self, ticker):
-        t = f"[{self.ticker.contract.symbol}] {self.ticker.tickByTicks[0].price:.2f}  x  {self.ticker.tickByTicks[0].size}"
+    def onTickByTick(self, ticker):
+        t = f"[{ticker.contract.symbol}] {ticker.tickByTicks[0].price:.2f}  x  {ticker.tickByTicks[0].size}"
+        t0 = metrics.now()
         self.callback(self.client_id, 'ticker', t)
+        metrics.since('bot_callback', t0)
 
     def stop_ticker(self, qualified_contract):
-        self.ib.cancelTickByTickData(qualified_contract, 'Last')
-
-    def start_bars(self, qualified_contract):
-        self.bars = self.ib.reqHistoricalData(
-                                qualified_contract,
-                                endDateTime='',
-                                durationStr='49500 S',
-                                barSizeSetting='5 mins',
-                                whatToShow='TRADES',
-                                useRTH=False,
-                                formatDate=2,  # 1 for tws local tz, 2 for UTC
-                                keepUpToDate=True)
-        self.bars.updateEvent += self.onPendingBars
+        for subscription in [s for s in self.subscriptions if s.key[:2] == ('tick_by_tick', qualified_contract.conId)]:
+            subscription.cancel()
+            self.subscriptions.remove(subscription)
+
+    def start_bars(self, qualified_contract, capacity=2048):
+        if self.aggregator is not None:
+            subscription = self.aggregator.subscribe(qualified_contract, self.onPendingBars, bar_size='5 mins', duration='49500 S',
+                                                     on_reseed=self.onBarsReseeded)
+        else:
+            subscription = self.hub.subscribe_bars(qualified_contract, self.onPendingBars, bar_size='5 mins', duration='49500 S')
+        self.subscriptions.append(subscription)
+        self.bars = subscription.bars  # Shared with other bots; the hub (or aggregator) bounds its length
+        store = BarStore(capacity, extra_columns=IndicatorEngine.COLUMNS)
+        self.bar_stores[qualified_contract.conId] = store
+        self.indicators.seed(qualified_contract.conId, store, self.bars)
 
     def onPendingBars(self, bars, hasNewBar):
-        df = util.df(bars)
-        df['date'] = df['date'].dt.tz_convert("America/New_York")
-        df['average'] = df['average'].round(2)
-        df['close'] = df['close'].round(3)
-        df['MACD-green'] = talib.EMA(df['close'], timeperiod=12) - talib.EMA(df['close'], timeperiod=26).round(6)
-        df['MACD-EMA-9-red'] = talib.EMA(df['MACD-green'], timeperiod=9).round(6)
-        dftail = df.tail(8)
-        self.callback(self.client_id, 'bars', str(dftail))
+        con_id = bars.contract.conId
+        t0 = metrics.now()
+        self.indicators.on_bar_update(con_id, self.bar_stores[con_id], bars, hasNewBar)
+        metrics.since('indicators', t0)
+        t0 = metrics.now()
+        self.callback(self.client_id, 'bars', self.format_bars(con_id))
+        metrics.since('bot_callback', t0)
+
+    def onBarsReseeded(self, bars):
+        """The aggregator corrected bars against IB's: rebuild the BarStore and MACD from scratch."""
+        con_id = bars.contract.conId
+        old = self.bar_stores[con_id]
+        store = self.bar_stores[con_id] = BarStore(old.capacity, extra_columns=old.extra_columns)
+        self.indicators.seed(con_id, store, bars)
+        self.callback(self.client_id, 'bars', self.format_bars(con_id))
+
+    def start_signals(self):
+        """Receive the scanner's top crossovers (core.scanner.Signal list) after every scan of the shared bars."""
+        event_manager.subscribe('signals', self.onSignals)
+
+    def onSignals(self, signals):
+        t = "  ".join(f"{s.symbol} {s.kind}{'+' if s.direction > 0 else '-'} {s.score:.2f}" for s in signals)
+        self.callback(self.client_id, 'signals', t)
+
+    def format_bars(self, con_id, rows=8):
+        """Render the last few bars with their MACD values as a text table."""
+        ny = ZoneInfo("America/New_York")
+        store = self.bar_stores[con_id]
+        columns = [store.tail(name, rows) for name in ('time', 'open', 'high', 'low', 'close', 'volume', 'average', 'macd', 'signal')]
+        lines = [f"{'date':<25} {'open':>10} {'high':>10} {'low':>10} {'close':>10} {'volume':>8} {'average':>10} {'MACD-green':>11} {'MACD-EMA-9-red':>14}"]
+        for ts, o, h, l, c, v, a, macd, signal in zip(*columns):
+            lines.append(f"{str(datetime.fromtimestamp(ts, ny)):<25} {o:>10.2f} {h:>10.2f} {l:>10.2f} "
+                         f"{c:>10.3f} {v:>8.0f} {a:>10.2f} {macd:>11.6f} {signal:>14.6f}")
+        return "\n".join(lines)
 
@@ -0,0 +1,50 @@
+from collections import defaultdict
+
+
+class AccountStore:
+    """AccountValues indexed by (account, tag, currency) and kept current by ib events.
+
+    Feed it from ib.accountValueEvent / ib.accountSummaryEvent. Lookups are a
+    single dict access, and subscribers are only called for the tags they
+    registered for, and only when the value actually changed.
+    """
+    def __init__(self):
+        self.values = {}  # (account, tag, currency) -> AccountValue
+        self.subscribers = defaultdict(list)  # tag -> [callback(AccountValue)]
+
+    def load(self, account_values):
+        """Bulk-load a snapshot (e.g. ib.accountSummary() once at startup)."""
+        for account_value in account_values:
+            self.on_account_value(account_value)
+
+    def on_account_value(self, account_value):
+        key = (account_value.account, account_value.tag, account_value.currency)
+        previous = self.values.get(key)
+        self.values[key] = account_value
+        if previous is None or previous.value != account_value.value:
+            for callback in self.subscribers.get(account_value.tag, ()):
+                callback(account_value)
+
+    def get(self, account, tag, currency=''):
+        """Return the AccountValue for the key, or None if IB hasn't sent it."""
+        return self.values.get((account, tag, currency))
+
+    def value(self, account, tag, currency='', default=None):
+        """Return the value as a float, or `default` if missing or non-numeric."""
+        account_value = self.values.get((account, tag, currency))
+        try:
+            return float(account_value.value)
+        except (AttributeError, ValueError):
+            return default
+
+    def accounts(self):
+        return sorted({account for account, _, _ in self.values})
+
+    def subscribe(self, tags, callback):
+        for tag in tags:
+            self.subscribers[tag].append(callback)
+
+    def unsubscribe(self, tags, callback):
+        for tag in tags:
+            if callback in self.subscribers.get(tag, ()):
+                self.subscribers[tag].remove(callback)
@@ -0,0 +1,158 @@
+import logging
+import queue
+import random
+import smtplib
+import threading
+import time
+from email.message import EmailMessage
+
+
+class AlertDispatcher:
+    """Send critical alerts by email from a background worker.
+
+    At most one digest is sent per `window` seconds: the first alert after a
+    quiet period goes out immediately, anything arriving while the window is
+    closed is collected, identical messages are counted instead of repeated,
+    and the batch goes out as one email when the window reopens. The SMTP
+    connection is kept open between digests and failed sends are retried
+    with jittered exponential backoff.
+    """
+    def __init__(self, host, port, fromaddr, toaddrs, subject, credentials=None, secure=None,
+                 window=60.0, max_queue=1000, max_retries=5, backoff=1.0, max_backoff=60.0, timeout=10.0):
+        self.host = host
+        self.port = port
+        self.fromaddr = fromaddr
+        self.toaddrs = [toaddrs] if isinstance(toaddrs, str) else list(toaddrs)
+        self.subject = subject
+        self.credentials = credentials
+        self.secure = secure  # None for plain SMTP, a (possibly empty) tuple for STARTTLS like SMTPHandler
+        self.window = window
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.stats = {'queued': 0, 'dropped': 0, 'deduplicated': 0, 'digests': 0, 'sent': 0, 'retries': 0, 'failed': 0}
+        self._smtp = None
+        self._last_sent = float('-inf')
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hydra-alerts", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=30.0):
+        """Send whatever is pending, then close the connection."""
+        self._stopping.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def submit(self, key, text):
+        """Queue an alert without blocking. `key` identifies duplicates, `text` is what gets sent."""
+        try:
+            self.queue.put_nowait((key, text))
+            self.stats['queued'] += 1
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            return False
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _run(self):
+        while True:
+            try:
+                key, text = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    break
+                continue
+            pending = {key: [text, 1]}
+            send_at = self._last_sent + self.window
+            while not self._stopping.is_set():
+                remaining = send_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    key, text = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                self._collect(pending, key, text)
+            try:
+                while True:
+                    self._collect(pending, *self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            self._deliver(pending)
+        self._close()
+
+    def _collect(self, pending, key, text):
+        if key in pending:
+            pending[key][1] += 1
+            self.stats['deduplicated'] += 1
+        else:
+            pending[key] = [text, 1]
+
+    def _deliver(self, pending):
+        msg = EmailMessage()
+        msg['From'] = self.fromaddr
+        msg['To'] = ','.join(self.toaddrs)
+        total = sum(count for _, count in pending.values())
+        msg['Subject'] = self.subject if total == 1 else f"{self.subject} ({total} alerts)"
+        msg.set_content("\n".join(text if count == 1 else f"[x{count}] {text}" for text, count in pending.values()))
+        self._last_sent = time.monotonic()
+        self.stats['digests'] += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._connection().send_message(msg)
+                self.stats['sent'] += 1
+                return
+            except (smtplib.SMTPException, OSError):
+                self._close()
+                if attempt == self.max_retries:
+                    break
+                self.stats['retries'] += 1
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        self.stats['failed'] += 1
+
+    def _connection(self):
+        """Reuse the open SMTP session if the server still answers, else open a new one."""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._close()
+        smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.secure is not None:
+            smtp.ehlo()
+            smtp.starttls(*self.secure)
+            smtp.ehlo()
+        if self.credentials:
+            smtp.login(*self.credentials)
+        self._smtp = smtp
+        return smtp
+
+    def _close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+class AlertHandler(logging.Handler):
+    """Logging handler that hands records to an AlertDispatcher instead of sending inline."""
+    def __init__(self, dispatcher, level=logging.CRITICAL):
+        super().__init__(level)
+        self.dispatcher = dispatcher
+
+    def emit(self, record):
+        try:
+            self.dispatcher.submit(record.getMessage(), self.format(record))
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,301 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from datetime import time as dt_time
+from zoneinfo import ZoneInfo
+
+from ib_async import BarData, BarDataList, util
+
+from core.bar_cache import bar_seconds, duration_str
+from core.bar_store import _epoch
+from core.market_data_hub import Subscription
+from core.metrics import metrics
+
+
+# Bar sizes reqHistoricalData accepts: only these can be seeded from, and reconciled against, IB
+IB_BAR_SIZES = {'5 secs', '10 secs', '15 secs', '30 secs', '1 min', '2 mins', '3 mins', '5 mins', '10 mins', '15 mins',
+                '20 mins', '30 mins', '1 hour', '2 hours', '3 hours', '4 hours', '8 hours', '1 day'}
+ACTIVITY_UNITS = ('ticks', 'volume', 'range')
+# Longest durationStr IB accepts per bar size, in seconds (its "valid duration and bar size" table)
+MAX_DURATION = {'5 secs': 3600, '10 secs': 14400, '15 secs': 14400, '30 secs': 28800, '1 min': 86400, '2 mins': 2 * 86400,
+                '3 mins': 7 * 86400, '5 mins': 7 * 86400, '10 mins': 7 * 86400, '15 mins': 7 * 86400, '20 mins': 7 * 86400,
+                '30 mins': 30 * 86400, '1 hour': 30 * 86400, '2 hours': 30 * 86400, '3 hours': 30 * 86400,
+                '4 hours': 30 * 86400, '8 hours': 30 * 86400, '1 day': 365 * 86400}
+
+
+class _Series:
+    """One locally built bar series: '5 secs' / '1 min' style time bars, or '<n> ticks' / '<n> volume' / '<n> range'."""
+    def __init__(self, contract, bar_size):
+        count, unit = bar_size.split()
+        self.contract = contract
+        self.bar_size = bar_size
+        self.kind = unit if unit in ACTIVITY_UNITS else 'time'
+        self.size = float(count)
+        self.step = bar_seconds(bar_size) if self.kind == 'time' else None
+        self.start = 0  # Epoch second the newest time bar starts at
+        self.bars = BarDataList()
+        self.bars.contract = contract
+        self.bars.barSizeSetting = bar_size
+        self.bars.keepUpToDate = True
+
+
+class BarAggregator:
+    """Bars of any size built locally from one shared tick-by-tick stream per contract.
+
+    Consumers get the same (bars, has_new_bar) callbacks as
+    MarketDataHub.subscribe_bars, but any number of bar sizes and bots cost a
+    single tick subscription and no historical data pacing. Time bars close
+    on a timer at the boundary, not on the next trade, and trades are
+    bucketed by receive time. The bar left forming after a close has no
+    trades until its first one, which also dates it, so a halt or weekend
+    leaves a gap rather than a run of flat zero-volume bars; '<n> ticks' and '<n> volume' bars close on the
+    trade that fills them, '<n> range' bars on the trade that breaks the
+    range. Series that IB also serves can be seeded from (cached) history,
+    and are reconciled against IB's bars after every session close; a
+    consumer's `on_reseed(bars)` is then called to rebuild whatever it
+    derived from the bars that changed.
+    """
+    def __init__(self, hub, clock=time.time, session_close=dt_time(17, 0), session_tz='America/New_York',
+                 bar_history=2048, tick_type='Last'):
+        self.hub = hub
+        self.ib = hub.ib
+        self.clock = clock  # Epoch seconds
+        self.session_close = session_close
+        self.session_tz = ZoneInfo(session_tz)
+        self.bar_history = bar_history
+        self.tick_type = tick_type
+        self.series = {}  # key -> _Series
+        self.bars = {}  # key -> BarDataList, for Subscription.bars
+        self.consumers = {}  # key -> [Subscription]
+        self.by_contract = {}  # conId -> [_Series]
+        self.feeds = {}  # conId -> hub tick-by-tick Subscription
+        self._timers = {}  # bar seconds -> TimerHandle of the next boundary
+        self._task = None
+
+    def subscribe(self, contract, consumer, bar_size='5 mins', filter=None, duration=None, on_reseed=None):
+        """consumer(bars, has_new_bar) on every update; `duration` of IB history seeds a new IB-sized series."""
+        key = ('agg', contract.conId, bar_size)
+        if key not in self.series and duration and bar_size in IB_BAR_SIZES:
+            return util.run(self.subscribe_async(contract, consumer, bar_size, filter, duration, on_reseed))
+        if key not in self.series:
+            self._add_series(key, contract, bar_size)
+        return self._join(key, consumer, filter, on_reseed)
+
+    async def subscribe_async(self, contract, consumer, bar_size='5 mins', filter=None, duration=None, on_reseed=None):
+        """subscribe() for coroutines."""
+        key = ('agg', contract.conId, bar_size)
+        if key not in self.series:
+            history = None
+            if duration and bar_size in IB_BAR_SIZES:
+                history = await self.hub.history(contract, bar_size, duration)
+            if key not in self.series:  # Unless another subscriber got there while we waited
+                self._add_series(key, contract, bar_size, history)
+        return self._join(key, consumer, filter, on_reseed)
+
+    def unsubscribe(self, subscription):
+        consumers = self.consumers.get(subscription.key)
+        if not subscription.active or consumers is None:
+            return
+        subscription.active = False
+        consumers.remove(subscription)
+        if not consumers:
+            self._release(subscription.key)
+
+    def on_ticker(self, con_id, ticker):
+        now = self.clock()
+        for series in self.by_contract.get(con_id, ()):
+            updated = False
+            for tick in ticker.tickByTicks:
+                if self._add_trade(series, tick.price, tick.size, now):
+                    self._emit(series, True)
+                    updated = False
+                else:
+                    updated = True
+            if updated:
+                self._emit(series, False)
+
+    async def reconcile(self):
+        """Overwrite completed local bars that differ from IB's and reseed their consumers; returns how many did."""
+        fixed = 0
+        for key, series in list(self.series.items()):
+            bars = series.bars
+            if series.bar_size not in IB_BAR_SIZES or len(bars) < 2:
+                continue
+            official = await self._official_bars(series, _epoch(bars[0].date))
+            changed = 0
+            for i, bar in enumerate(bars[:-1]):
+                ib_bar = official.get(_epoch(bar.date))
+                if ib_bar is not None and (bar.open, bar.high, bar.low, bar.close, bar.volume) != (ib_bar.open, ib_bar.high, ib_bar.low, ib_bar.close, ib_bar.volume):
+                    bars[i] = ib_bar
+                    changed += 1
+            if changed and key in self.series:
+                self._reseed(key, series)
+            fixed += changed
+        if fixed:
+            logging.getLogger("HYDRA_logger").info(f"Reconciled {fixed} locally built bars against IB history")
+        return fixed
+
+    async def _official_bars(self, series, start):
+        """IB's bars from epoch `start` to now by start time, in requests no longer than IB allows for the bar size."""
+        scheduler = self.hub.scheduler
+        request = scheduler.request if scheduler is not None else self.ib.reqHistoricalDataAsync
+        official = {}
+        end = self.clock()
+        while end > start:
+            span = min(MAX_DURATION[series.bar_size], end - start + series.step)
+            history = await request(series.contract, endDateTime=datetime.fromtimestamp(end, timezone.utc),
+                                    durationStr=duration_str(span), barSizeSetting=series.bar_size, whatToShow='TRADES',
+                                    useRTH=False, formatDate=2, keepUpToDate=False)
+            for bar in history:
+                official.setdefault(_epoch(bar.date), bar)  # The newer request's bar wins where chunks overlap
+            end -= span
+        return official
+
+    def start(self):
+        """Reconcile after every session close in the background on the running ib loop."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def close(self):
+        """Stop, drop every series and release the tick streams."""
+        self.stop()
+        for key in list(self.consumers):
+            for subscription in self.consumers[key]:
+                subscription.active = False
+            self._release(key)
+
+    async def _run(self):
+        while True:
+            now = datetime.now(self.session_tz)
+            close = datetime.combine(now.date(), self.session_close, self.session_tz)
+            if close <= now:
+                close += timedelta(days=1)
+            await asyncio.sleep((close - now).total_seconds() + 60)  # Give IB a minute to finalize the session's bars
+            if not self.ib.isConnected():
+                continue
+            try:
+                await self.reconcile()
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logging.getLogger("HYDRA_logger").warning(f"Bar reconciliation failed, retrying next session: {e!r}")
+            except Exception:
+                logging.getLogger("HYDRA_logger").exception("Bar reconciliation failed, retrying next session")
+
+    def _add_series(self, key, contract, bar_size, history=None):
+        series = self.series[key] = _Series(contract, bar_size)
+        self.bars[key] = series.bars
+        if history:
+            series.bars.extend(history[-self.bar_history:])
+            series.start = _epoch(history[-1].date)
+        self.by_contract.setdefault(contract.conId, []).append(series)
+        if contract.conId not in self.feeds:
+            self.feeds[contract.conId] = self.hub.subscribe_tick_by_tick(
+                contract, lambda ticker, con_id=contract.conId: self.on_ticker(con_id, ticker),
+                filter=lambda ticker: ticker.tickByTicks, tick_type=self.tick_type)
+        if series.step is not None and series.step not in self._timers:
+            self._schedule(series.step, (self.clock() // series.step + 1) * series.step)
+
+    def _join(self, key, consumer, filter, on_reseed=None):
+        subscription = Subscription(self, key, consumer, filter, on_reseed)
+        self.consumers.setdefault(key, []).append(subscription)
+        return subscription
+
+    def _release(self, key):
+        del self.consumers[key]
+        series = self.series.pop(key)
+        del self.bars[key]
+        con_id = series.contract.conId
+        self.by_contract[con_id].remove(series)
+        if not self.by_contract[con_id]:
+            del self.by_contract[con_id]
+            self.feeds.pop(con_id).cancel()
+        if series.step is not None and not any(s.step == series.step for s in self.series.values()):
+            self._timers.pop(series.step).cancel()
+
+    def _schedule(self, step, boundary):
+        self._timers[step] = asyncio.get_event_loop().call_later(max(0.0, boundary - self.clock()), self._on_boundary, step, boundary)
+
+    def _on_boundary(self, step, boundary):
+        if self.clock() < boundary:  # Timers may fire a hair early
+            self._schedule(step, boundary)
+            return
+        for series in list(self.series.values()):
+            if series.step == step and series.bars and series.start < boundary and _traded(series.bars[-1]):
+                series.start = int(boundary)
+                self._open_empty_bar(series, datetime.fromtimestamp(boundary, timezone.utc))
+                self._emit(series, True)
+        if metrics.enabled:
+            metrics.record_since('bar_close', boundary)  # Boundary to every consumer called
+        self._schedule(step, boundary + step)
+
+    def _add_trade(self, series, price, size, now):
+        """Apply one trade; True if it closed a bar (a new one is forming)."""
+        bars = series.bars
+        new_bar = False
+        if series.kind == 'time':
+            start = int(now // series.step * series.step)
+            if not bars or start > series.start:
+                series.start = start
+                if bars and not _traded(bars[-1]):
+                    bars[-1].date = datetime.fromtimestamp(start, timezone.utc)  # The first trade since the last close
+                else:  # A trade beat the boundary timer
+                    self._open_empty_bar(series, datetime.fromtimestamp(start, timezone.utc))
+                    new_bar = len(bars) > 1
+        elif not bars:
+            self._open_empty_bar(series, datetime.fromtimestamp(now, timezone.utc))
+        elif series.kind == 'range' and bars[-1].barCount and max(bars[-1].high, price) - min(bars[-1].low, price) > series.size:
+            self._open_empty_bar(series, datetime.fromtimestamp(now, timezone.utc))
+            new_bar = True
+        bar = bars[-1]
+        if not bar.barCount:
+            bar.open = bar.high = bar.low = bar.close = bar.average = price
+            if series.kind != 'time':
+                bar.date = datetime.fromtimestamp(now, timezone.utc)
+        else:
+            if price > bar.high:
+                bar.high = price
+            if price < bar.low:
+                bar.low = price
+            bar.close = price
+        if size > 0:
+            bar.average = (bar.average * bar.volume + price * size) / (bar.volume + size)
+            bar.volume += size
+        bar.barCount += 1
+        if (series.kind == 'ticks' and bar.barCount >= series.size) or (series.kind == 'volume' and bar.volume >= series.size):
+            self._open_empty_bar(series, datetime.fromtimestamp(now, timezone.utc))
+            new_bar = True
+        return new_bar
+
+    def _open_empty_bar(self, series, date):
+        """Start a bar with no trades yet, flat at the last close until its first trade."""
+        last = series.bars[-1].close if series.bars else 0.0
+        series.bars.append(BarData(date=date, open=last, high=last, low=last, close=last, volume=0, average=last, barCount=0))
+
+    def _reseed(self, key, series):
+        for subscription in list(self.consumers.get(key, ())):
+            if subscription.on_reseed is None:
+                continue
+            try:
+                subscription.on_reseed(series.bars)
+            except Exception:
+                logging.getLogger("HYDRA_logger").exception(f"Bar consumer {subscription.on_reseed!r} failed to reseed {key}")
+
+    def _emit(self, series, has_new_bar):
+        key = ('agg', series.contract.conId, series.bar_size)
+        for subscription in list(self.consumers.get(key, ())):
+            try:
+                if subscription.filter is None or subscription.filter(series.bars, has_new_bar):
+                    subscription.consumer(series.bars, has_new_bar)
+            except Exception:
+                logging.getLogger("HYDRA_logger").exception(f"Bar consumer {subscription.consumer!r} failed on {key}")
+        if has_new_bar and len(series.bars) > self.bar_history:
+            del series.bars[:-self.bar_history]  # Consumers keep their own history; this only bounds the shared list
+
+
+def _traded(bar):
+    return bar.barCount > 0 or bar.volume > 0
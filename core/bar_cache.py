@@ -0,0 +1,130 @@
+import math
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from ib_async import BarData
+
+from core.bar_store import _epoch
+
+
+DURATION_UNITS = {'S': 1, 'D': 86400, 'W': 7 * 86400, 'M': 31 * 86400, 'Y': 366 * 86400}  # Upper bounds, so windows are never short
+
+
+class BarCache:
+    """Completed historical bars on disk, one .npz of columns per (conId, barSize, whatToShow, useRTH).
+
+    missing_duration() says how much IB still has to send: the time since the
+    newest cached bar, or the whole window on a cold start. store() only
+    queues bars; flush() merges them into the columns and rewrites the file
+    atomically. Bars lost to a crash between flushes are simply backfilled
+    again on the next start. At most `max_bars` bars are kept per series.
+    """
+    COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'average')
+
+    def __init__(self, directory, max_bars=20_000):
+        self.directory = directory
+        self.max_bars = max_bars
+        self.series = {}  # key -> {'time': int64 epochs, <COLUMNS>: float64, 'barCount': int64}, oldest first
+        self.pending = {}  # key -> [BarData] not merged yet
+
+    def path(self, key):
+        con_id, bar_size, what_to_show, use_rth = key
+        return os.path.join(self.directory, f"{con_id}-{bar_size.replace(' ', '')}-{what_to_show}-{'rth' if use_rth else 'all'}.npz")
+
+    def load(self, key):
+        """The series for `key`, read from disk on first use; pending bars are merged in."""
+        if key not in self.series:
+            try:
+                with np.load(self.path(key)) as data:
+                    self.series[key] = {name: data[name] for name in data.files}
+            except (OSError, ValueError, KeyError):
+                self.series[key] = _empty()  # No cache yet, or a damaged one: backfill from scratch
+        if self.pending.get(key):
+            self._merge(key, self.pending.pop(key))
+        return self.series[key]
+
+    def bars(self, key, start=None, end=None):
+        """Cached bars with start <= time < end (epoch seconds), as BarData."""
+        series = self.load(key)
+        times = series['time']
+        lo = 0 if start is None else int(np.searchsorted(times, start, 'left'))
+        hi = len(times) if end is None else int(np.searchsorted(times, end, 'left'))
+        daily = bar_seconds(key[1]) >= 86400
+        columns = [series[name][lo:hi].tolist() for name in ('time',) + self.COLUMNS + ('barCount',)]
+        return [BarData(date=_date(t, daily), open=o, high=h, low=l, close=c, volume=v, average=a, barCount=n)
+                for t, o, h, l, c, v, a, n in zip(*columns)]
+
+    def missing_duration(self, key, duration, now=None):
+        """IB durationStr covering what the cache lacks of the last `duration` (from the newest cached bar on)."""
+        now = time.time() if now is None else now
+        times = self.load(key)['time']
+        window = duration_seconds(duration)
+        if not len(times) or now - times[-1] >= window:
+            return duration
+        return duration_str(max(now - times[-1], bar_seconds(key[1])))  # Re-fetches the newest cached bar, in case it was revised
+
+    def store(self, key, bars):
+        """Queue completed bars for the next flush(); a bar replaces any cached bar with the same start time."""
+        if bars:
+            self.pending.setdefault(key, []).extend(bars)
+
+    def flush(self, key=None):
+        """Write pending bars of `key`, or of every series, to disk."""
+        for key in [key] if key is not None else list(self.pending):
+            if not self.pending.get(key):
+                continue
+            series = self.load(key)
+            directory = os.path.dirname(self.path(key))
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp = f"{self.path(key)}.tmp"
+            with open(tmp, 'wb') as f:
+                np.savez(f, **series)
+            os.replace(tmp, self.path(key))  # Never leave a half-written cache behind
+
+    def _merge(self, key, bars):
+        new = {'time': np.array([_epoch(bar.date) for bar in bars], dtype=np.int64)}
+        for name in self.COLUMNS:
+            new[name] = np.array([getattr(bar, name) for bar in bars], dtype=np.float64)
+        new['barCount'] = np.array([bar.barCount for bar in bars], dtype=np.int64)
+        # Bars arrive in order, but a series can be stored twice (backfill, then live), so dedupe by time, last wins
+        _, last = np.unique(new['time'][::-1], return_index=True)
+        keep = len(bars) - 1 - last
+        old = self.series[key]
+        old_keep = ~np.isin(old['time'], new['time'])
+        merged = {name: np.concatenate((old[name][old_keep], new[name][keep])) for name in old}
+        order = np.argsort(merged['time'], kind='stable')[-self.max_bars:]
+        self.series[key] = {name: column[order] for name, column in merged.items()}
+
+
+def bar_seconds(bar_size_setting):
+    """'5 secs' / '1 min' / '5 mins' / '1 hour' / '1 day' -> seconds."""
+    count, unit = bar_size_setting.split()
+    seconds = {'sec': 1, 'min': 60, 'hour': 3600, 'day': 86400}[unit.rstrip('s')]
+    return int(count) * seconds
+
+
+def duration_seconds(duration):
+    """'49500 S' / '2 D' / '1 W' -> seconds."""
+    count, unit = duration.split()
+    return int(count) * DURATION_UNITS[unit.upper()]
+
+
+def duration_str(seconds):
+    """Seconds -> the shortest IB durationStr covering them ('S' only goes up to a day)."""
+    seconds = int(math.ceil(seconds))
+    return f"{seconds} S" if seconds <= 86400 else f"{math.ceil(seconds / 86400)} D"
+
+
+def _empty():
+    series = {'time': np.zeros(0, dtype=np.int64), 'barCount': np.zeros(0, dtype=np.int64)}
+    for name in BarCache.COLUMNS:
+        series[name] = np.zeros(0, dtype=np.float64)
+    return series
+
+
+def _date(epoch, daily):
+    d = datetime.fromtimestamp(epoch, timezone.utc)
+    return d.date() if daily else d
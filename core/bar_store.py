@@ -0,0 +1,68 @@
+from datetime import datetime, time, timezone
+
+import numpy as np
+
+
+class BarStore:
+    """Fixed-capacity ring of bars held in preallocated NumPy columns.
+
+    Every row is written twice, at i and i + capacity, so the newest n rows
+    are always one contiguous slice: tail() returns views, never copies, and
+    keepUpToDate updates write in place without allocating arrays. Memory is
+    fixed at construction no matter how long the session runs.
+    """
+    BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'average')
+
+    def __init__(self, capacity=2048, extra_columns=()):
+        self.capacity = capacity
+        self.columns = {'time': np.zeros(2 * capacity, dtype=np.int64)}  # Epoch seconds, UTC
+        for name in self.BAR_COLUMNS + tuple(extra_columns):
+            self.columns[name] = np.full(2 * capacity, np.nan)
+        self.extra_columns = tuple(extra_columns)
+        self.count = 0  # Rows ever appended, may exceed capacity
+        self._last = -1  # Ring index of the newest row
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def nbytes(self):
+        return sum(col.nbytes for col in self.columns.values())
+
+    def append_bar(self, bar):
+        """Start a new row for `bar`, overwriting the oldest once full."""
+        self._last = (self._last + 1) % self.capacity
+        self.count += 1
+        for name in self.extra_columns:
+            self.set_last(name, np.nan)
+        self.update_bar(bar)
+
+    def update_bar(self, bar):
+        """Overwrite the newest row with the latest values of the forming bar."""
+        self.set_last('time', _epoch(bar.date))
+        self.set_last('open', bar.open)
+        self.set_last('high', bar.high)
+        self.set_last('low', bar.low)
+        self.set_last('close', bar.close)
+        self.set_last('volume', bar.volume)
+        self.set_last('average', bar.average)
+
+    def set_last(self, name, value):
+        column = self.columns[name]
+        column[self._last] = value
+        column[self._last + self.capacity] = value
+
+    def last(self, name):
+        return self.columns[name][self._last]
+
+    def tail(self, name, n=None):
+        """Zero-copy view of the newest `n` values of a column, oldest first."""
+        n = len(self) if n is None else min(n, len(self))
+        end = self._last + self.capacity + 1
+        return self.columns[name][end - n:end]
+
+
+def _epoch(d):
+    """Bar dates are datetimes for intraday bars and dates for daily ones."""
+    if not isinstance(d, datetime):
+        d = datetime.combine(d, time(), timezone.utc)
+    return int(d.timestamp())
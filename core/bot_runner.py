@@ -0,0 +1,419 @@
+"""Run bots in worker processes, fed from shared memory.
+
+The parent keeps the only IB connection. ShmFeed copies ticks and bar
+updates from the MarketDataHub into shared-memory rings. Each worker runs an
+unmodified Bot on a ShmIB that reads those rings, so a slow or crashing
+strategy only takes its own process down. Order intents, bot callbacks and
+log records come back to the parent on a multiprocessing queue; order status
+goes out on a queue per worker. Workers log through the parent, so one
+process writes the log files and sends alerts.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler
+
+import numpy as np
+from eventkit import Event
+from ib_async import BarData, BarDataList, ContFuture, Order, Ticker, TickAttribLast, TickByTickAllLast, util
+
+from core.order_manager import OrderRejected
+from core.shm_ring import ShmRing
+from core.tick_recorder import TICK_BY_TICK, TICK_DTYPE
+
+
+BAR_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('volume', '<f8'),
+    ('average', '<f8'),
+    ('bar_count', '<i8'),
+    ('con_id', '<i4'),
+    ('kind', '<i4'),
+])
+# Bar record kinds, mirroring ib_async's keepUpToDate updateEvent(bars, hasNewBar)
+BAR_UPDATE = 0  # The forming bar changed
+BAR_NEW = 1  # A new bar started
+BAR_FINAL = 2  # Final values of the bar before a BAR_NEW; no event of its own
+
+
+class ShmFeed:
+    """Parent side: ticks and bars of every contract a worker trades, written once into shared rings."""
+    def __init__(self, hub, tick_capacity=1 << 16, bar_capacity=1 << 12):
+        self.hub = hub
+        self.ticks = ShmRing(TICK_DTYPE, tick_capacity)
+        self.bars = ShmRing(BAR_DTYPE, bar_capacity)
+        self.subscriptions = {}  # conId -> hub Subscriptions
+        self.users = {}  # conId -> workers reading it
+        self.last_prices = {}  # conId -> latest trade price, the reference for workers' market orders
+
+    def add(self, contract):
+        """Start feeding `contract`; returns its bars so far, for seeding a worker."""
+        con_id = contract.conId
+        if con_id not in self.subscriptions:
+            self.subscriptions[con_id] = [
+                self.hub.subscribe_tick_by_tick(contract, self.on_ticker, filter=lambda ticker: ticker.tickByTicks),
+                self.hub.subscribe_bars(contract, self.on_bars),
+            ]
+            self.users[con_id] = 0
+        self.users[con_id] += 1
+        return [_bar_tuple(bar) for bar in self.subscriptions[con_id][1].bars]
+
+    def remove(self, contract):
+        con_id = contract.conId
+        self.users[con_id] -= 1
+        if not self.users[con_id]:
+            for subscription in self.subscriptions.pop(con_id):
+                subscription.cancel()
+            del self.users[con_id]
+
+    def on_ticker(self, ticker):
+        con_id = ticker.contract.conId
+        recv_ns = time.time_ns()
+        for tick in ticker.tickByTicks:
+            if hasattr(tick, 'price'):  # Last / AllLast
+                self.ticks.append((recv_ns, int(tick.time.timestamp() * 1_000_000_000), tick.price, tick.size,
+                                   con_id, TICK_BY_TICK + tick.tickType))
+                self.last_prices[con_id] = tick.price
+
+    def on_bars(self, bars, has_new_bar):
+        con_id = bars.contract.conId
+        if has_new_bar and len(bars) >= 2:
+            self.bars.append(_bar_tuple(bars[-2]) + (con_id, BAR_FINAL))
+        self.bars.append(_bar_tuple(bars[-1]) + (con_id, BAR_NEW if has_new_bar else BAR_UPDATE))
+
+    def close(self):
+        for con_id in list(self.subscriptions):
+            for subscription in self.subscriptions.pop(con_id):
+                subscription.cancel()
+        self.users.clear()
+        self.ticks.close()
+        self.bars.close()
+
+
+class ShmIB:
+    """Worker side: enough of ib_async.IB for Bot, fed from ShmFeed's rings.
+
+    Bot callbacks are conflated per widget and sent to the parent at most
+    once per poll, so a chatty bot doesn't flood the queue.
+    """
+    IDLE_SLEEP = 0.0005  # Grows linearly to 10x while nothing arrives
+
+    def __init__(self, codename, contracts, seed_bars, tick_ring, bar_ring, to_parent, from_parent):
+        self.codename = codename
+        self.contracts = contracts  # symbol -> qualified Contract
+        self.seed_bars = seed_bars  # conId -> [(time, open, high, low, close, volume, average, bar_count)]
+        self.tick_ring = tick_ring
+        self.bar_ring = bar_ring
+        self.to_parent = to_parent
+        self.from_parent = from_parent
+        self.running = True
+        self.lost = 0  # Records overwritten before we read them
+        self.pendingTickersEvent = Event('pendingTickersEvent')
+        self.orderStatusEvent = Event('orderStatusEvent')
+        self.errorEvent = Event('errorEvent')
+        self._tickers = {}  # conId -> Ticker
+        self._bars = {}  # conId -> BarDataList
+        self._reports = {}  # (client_id, widget) -> latest text
+        self._orders = 0
+        self._tick_cursor = tick_ring.cursor()
+        self._bar_cursor = bar_ring.cursor()
+
+    # ib_async.IB interface used by Bot
+    def connect(self, *args, **kwargs):
+        return self
+
+    def disconnect(self):
+        pass
+
+    def isConnected(self):
+        return True
+
+    def sleep(self, secs=0.02):
+        return True
+
+    def reqCurrentTime(self):
+        return datetime.now(timezone.utc)
+
+    def qualifyContracts(self, *contracts):
+        return [self.contracts[c.localSymbol or c.symbol] for c in contracts]
+
+    def ticker(self, contract):
+        return self._ticker(contract)
+
+    def reqMktData(self, contract, *args, **kwargs):
+        return self._ticker(contract)
+
+    def reqTickByTickData(self, contract, tickType='Last', *args, **kwargs):
+        return self._ticker(contract)
+
+    def cancelMktData(self, contract):
+        self._tickers.pop(contract.conId, None)
+
+    def cancelTickByTickData(self, contract, tickType='Last'):
+        self._tickers.pop(contract.conId, None)
+
+    def reqHistoricalData(self, contract, *args, **kwargs):
+        bars = BarDataList()
+        bars.contract = contract
+        bars.keepUpToDate = True
+        for t, o, h, l, c, v, a, n in self.seed_bars.get(contract.conId, ()):
+            bars.append(BarData(date=datetime.fromtimestamp(t, timezone.utc), open=o, high=h, low=l, close=c,
+                                volume=v, average=a, barCount=n))
+        self._bars[contract.conId] = bars
+        return bars
+
+    def cancelHistoricalData(self, bars):
+        self._bars.pop(bars.contract.conId, None)
+
+    def placeOrder(self, contract, order):
+        """Send the order intent to the parent; status comes back on orderStatusEvent(orderRef, status, filled, remaining, avgFillPrice)."""
+        self._orders += 1
+        order.orderRef = order.orderRef or f"{self.codename}-{self._orders}"
+        self.to_parent.put(('order', self.codename, order.orderRef, order.action, order.totalQuantity,
+                            order.orderType, order.lmtPrice, order.auxPrice, order.tif))
+        return order.orderRef
+
+    def cancelOrder(self, order_ref):
+        self.to_parent.put(('cancel', self.codename, order_ref))
+
+    # Worker loop
+    def report(self, client_id, widget, text):
+        self._reports[(client_id, widget)] = text
+
+    def run(self):
+        idle = 0
+        while self.running:
+            if self.poll():
+                idle = 0
+            else:
+                idle = min(idle + 1, 10)
+                time.sleep(self.IDLE_SLEEP * idle)
+
+    def poll(self):
+        """Handle everything that arrived since the last poll; returns whether anything did."""
+        busy = self._poll_parent()
+        ticks, self._tick_cursor, lost = self.tick_ring.read(self._tick_cursor)
+        bars, self._bar_cursor, lost_bars = self.bar_ring.read(self._bar_cursor)
+        self.lost += lost + lost_bars
+        if len(ticks):
+            for recv_ns, exch_ns, price, size, con_id, tick_type in ticks[np.isin(ticks['con_id'], list(self._tickers))].tolist():
+                self._on_tick(con_id, tick_type, price, size, exch_ns or recv_ns)
+        if len(bars):
+            for record in bars[np.isin(bars['con_id'], list(self._bars))].tolist():
+                self._on_bar(*record)
+        for (client_id, widget), text in self._reports.items():
+            self.to_parent.put(('callback', self.codename, client_id, widget, text))
+        self._reports.clear()
+        return busy or bool(len(ticks) or len(bars))
+
+    def _poll_parent(self):
+        busy = False
+        while True:
+            try:
+                message = self.from_parent.get_nowait()
+            except queue.Empty:
+                return busy
+            busy = True
+            if message[0] == 'stop':
+                self.running = False
+            elif message[0] == 'order_status':
+                self.orderStatusEvent.emit(*message[1:])
+
+    def _on_tick(self, con_id, tick_type, price, size, ts_ns):
+        ticker = self._tickers[con_id]
+        when = datetime.fromtimestamp(ts_ns / 1e9, timezone.utc)
+        ticker.time = when
+        ticker.last = price
+        ticker.lastSize = size
+        ticker.tickByTicks = [TickByTickAllLast(tick_type - TICK_BY_TICK, when, price, size, TickAttribLast(), '', '')]
+        self.pendingTickersEvent.emit({ticker})
+
+    def _on_bar(self, t, o, h, l, c, v, a, n, con_id, kind):
+        bars = self._bars[con_id]
+        bar = BarData(date=datetime.fromtimestamp(t, timezone.utc), open=o, high=h, low=l, close=c, volume=v, average=a, barCount=n)
+        if kind == BAR_NEW:
+            bars.append(bar)
+        elif bars:
+            bars[-1] = bar
+        else:
+            bars.append(bar)
+        if kind != BAR_FINAL:
+            bars.updateEvent.emit(bars, kind == BAR_NEW)
+
+    def _ticker(self, contract):
+        ticker = self._tickers.get(contract.conId)
+        if ticker is None:
+            ticker = self._tickers[contract.conId] = Ticker(contract=contract)
+        return ticker
+
+
+class ProcessBotRunner:
+    """Start Bots in worker processes, relay their callbacks and order intents.
+
+    `report_to_tui(client_id, widget, text)` is called on the parent's event
+    loop, like an in-process Bot's callback. A worker that dies is logged and
+    its feed released; the others keep running.
+    """
+    def __init__(self, hub, report_to_tui, start_method='spawn', contract_cache=None, orders=None):
+        self.hub = hub
+        self.contract_cache = contract_cache
+        self.orders = orders  # Optional core.order_manager.OrderManager: workers' orders are risk-checked there
+        self.ib = hub.ib
+        self.callback = report_to_tui
+        self.feed = ShmFeed(hub)
+        self.context = multiprocessing.get_context(start_method)  # Never fork the IB connection
+        self.to_parent = self.context.Queue()
+        self.workers = {}  # codename -> _Worker
+        self.loop = util.getLoop()
+        self._relay_thread = threading.Thread(target=self._relay, name='bot-runner-relay', daemon=True)
+        self._relay_thread.start()
+
+    def start_bot(self, codename, symbol, client_id=0):
+        request = ContFuture(symbol=symbol.upper(), exchange='CME')
+        if self.contract_cache is not None:
+            contract = self.contract_cache.qualify_blocking(self.ib, [request])[0]
+        else:
+            contract = self.ib.qualifyContracts(request)[0]
+        seed_bars = self.feed.add(contract)
+        inbox = self.context.Queue()
+        process = self.context.Process(
+            target=_run_worker, name=f'bot-{codename}', daemon=True,
+            args=(codename, client_id, symbol.upper(), contract, {contract.conId: seed_bars},
+                  self.feed.ticks.name, self.feed.bars.name, self.to_parent, inbox))
+        process.start()
+        self.workers[codename] = _Worker(process, inbox, contract)
+
+    def stop_bot(self, codename, timeout=5.0):
+        worker = self.workers.pop(codename, None)
+        if worker is None:
+            return
+        worker.inbox.put(('stop',))
+        worker.process.join(timeout)
+        if worker.process.is_alive():
+            worker.process.terminate()
+            worker.process.join()
+        self._release(worker)
+
+    def close(self):
+        for codename in list(self.workers):
+            self.stop_bot(codename)
+        self.to_parent.put(None)
+        self._relay_thread.join()
+        self.feed.close()
+
+    def _relay(self):
+        """Runs in a thread: hand queue messages to the event loop, check on workers every second."""
+        checked = time.monotonic()
+        while True:
+            try:
+                message = self.to_parent.get(timeout=1.0)
+            except queue.Empty:
+                message = ()
+            if message is None:
+                return
+            if message:
+                self.loop.call_soon_threadsafe(self._dispatch, message)
+            if time.monotonic() - checked >= 1.0:
+                checked = time.monotonic()
+                self.loop.call_soon_threadsafe(self._check_workers)
+
+    def _dispatch(self, message):
+        kind, codename = message[0], message[1]
+        worker = self.workers.get(codename)
+        if kind == 'callback':
+            self.callback(*message[2:])
+        elif kind == 'log':
+            record = message[2]
+            logging.getLogger(record.name).handle(record)  # Through the parent's file, console and alert handlers
+        elif kind == 'order' and worker is not None:
+            order_ref, action, quantity, order_type, lmt_price, aux_price, tif = message[2:]
+            if self.orders is not None:
+                try:
+                    trade = self.orders.order(worker.contract, action, quantity,
+                                              limit=lmt_price if order_type in ('LMT', 'STP LMT') else None,
+                                              stop=aux_price if order_type in ('STP', 'STP LMT') else None,
+                                              ref_price=self.feed.last_prices.get(worker.contract.conId), tif=tif, orderRef=order_ref)
+                except OrderRejected:
+                    worker.inbox.put(('order_status', order_ref, 'Rejected', 0.0, quantity, 0.0))
+                    return
+            else:
+                order = Order(action=action, totalQuantity=quantity, orderType=order_type, lmtPrice=lmt_price,
+                              auxPrice=aux_price, tif=tif, orderRef=order_ref)
+                trade = self.ib.placeOrder(worker.contract, order)
+            worker.trades[order_ref] = trade
+            trade.statusEvent += worker.on_status
+        elif kind == 'cancel' and worker is not None:
+            trade = worker.trades.get(message[2])
+            if trade is not None:
+                self.ib.cancelOrder(trade.order)
+
+    def _check_workers(self):
+        for codename, worker in list(self.workers.items()):
+            if not worker.process.is_alive():
+                logging.getLogger("HYDRA_logger").error(f"Bot '{codename}' exited with code {worker.process.exitcode}")
+                del self.workers[codename]
+                self._release(worker)
+
+    def _release(self, worker):
+        self.feed.remove(worker.contract)
+        for trade in worker.trades.values():
+            trade.statusEvent -= worker.on_status
+
+
+class _Worker:
+    def __init__(self, process, inbox, contract):
+        self.process = process
+        self.inbox = inbox
+        self.contract = contract
+        self.trades = {}  # orderRef -> Trade
+
+    def on_status(self, trade):
+        status = trade.orderStatus
+        self.inbox.put(('order_status', trade.order.orderRef, status.status, status.filled, status.remaining, status.avgFillPrice))
+
+
+class _ParentLogHandler(QueueHandler):
+    """Worker side: send log records to the parent, tagged with the bot's codename."""
+    def __init__(self, codename, to_parent):
+        super().__init__(to_parent)
+        self.codename = codename
+
+    def prepare(self, record):
+        record = super().prepare(record)  # Message merged with its args and traceback, so it pickles
+        record.msg = f"[{self.codename}] {record.msg}"
+        return record
+
+    def enqueue(self, record):
+        self.queue.put(('log', self.codename, record))
+
+
+def _run_worker(codename, client_id, symbol, contract, seed_bars, tick_ring_name, bar_ring_name, to_parent, from_parent):
+    log = logging.getLogger("HYDRA_logger")
+    log.handlers[:] = [_ParentLogHandler(codename, to_parent)]  # Replaces a forked parent's handlers too
+    log.propagate = False
+    from bots import Bot  # Imported in the worker; the parent never needs it
+
+    tick_ring = ShmRing(TICK_DTYPE, name=tick_ring_name)
+    bar_ring = ShmRing(BAR_DTYPE, name=bar_ring_name)
+    ib = ShmIB(codename, {symbol: contract}, seed_bars, tick_ring, bar_ring, to_parent, from_parent)
+    bot = Bot(codename, ib.report, client_id=client_id, ib=ib)
+    try:
+        qualified = bot.qualify(symbol)
+        bot.start_ticker(qualified)
+        bot.start_bars(qualified)
+        ib.run()
+    finally:
+        bot.disconnect()
+        tick_ring.close()
+        bar_ring.close()
+
+
+def _bar_tuple(bar):
+    return (int(bar.date.timestamp()), bar.open, bar.high, bar.low, bar.close, bar.volume, bar.average, bar.barCount)
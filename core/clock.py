@@ -0,0 +1,64 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+
+class SyncedClock:
+    """Local monotonic clock, periodically corrected against IB server time.
+
+    Reading the time is a local computation; the server is only asked every
+    `resync_interval` seconds instead of on every frame.
+    """
+    def __init__(self, resync_interval=300.0):
+        self.resync_interval = resync_interval
+        self.offset = time.time() - time.monotonic()  # Until the first sync, trust the system clock
+        self.last_sync = None
+        self._task = None
+
+    def now(self, tz=None):
+        """Return the current (server-corrected) time as an aware datetime."""
+        return datetime.fromtimestamp(time.monotonic() + self.offset, tz or timezone.utc)
+
+    def timestamp(self):
+        """now() as epoch seconds, without building a datetime."""
+        return time.monotonic() + self.offset
+
+    def sync(self, server_time, sent_at=None, received_at=None):
+        """Correct the offset from a reqCurrentTime() reply.
+
+        IB reports whole seconds, so the offset is only moved when the local
+        estimate is at least a second away from the server.
+        """
+        received_at = time.monotonic() if received_at is None else received_at
+        sent_at = received_at if sent_at is None else sent_at
+        midpoint = (sent_at + received_at) / 2
+        estimate = midpoint + self.offset
+        server_ts = server_time.timestamp()
+        if not server_ts <= estimate < server_ts + 1:
+            self.offset = server_ts + 0.5 - midpoint
+        self.last_sync = received_at
+
+    async def resync(self, ib):
+        """Ask IB for its time once and correct the offset."""
+        sent_at = time.monotonic()
+        server_time = await ib.reqCurrentTimeAsync()
+        self.sync(server_time, sent_at, time.monotonic())
+
+    def start(self, ib):
+        """Keep the clock synced in the background on the running ib loop."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._resync_forever(ib))
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _resync_forever(self, ib):
+        while True:
+            if ib.isConnected():
+                try:
+                    await self.resync(ib)
+                except (ConnectionError, asyncio.TimeoutError):
+                    pass  # Keep the local estimate and try again next interval
+            await asyncio.sleep(self.resync_interval)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import random
+import time
+
+from core.metrics import metrics
+
+
+CONNECTIVITY_LOST = 1100  # TWS lost its connection to IB; our socket to TWS is still up
+RESTORED_DATA_LOST = 1101  # ...restored, but market data subscriptions were dropped
+RESTORED_DATA_KEPT = 1102  # ...restored with subscriptions intact
+
+
+class ConnectionSupervisor:
+    """Keeps `ib` connected and puts back what a dropped connection lost.
+
+    Connecting retries with full-jitter exponential backoff (a random delay up
+    to base_delay * 2**attempt, capped at max_delay), sleeping in between, so
+    a dead TWS costs no CPU. When the socket drops, or TWS reports its own
+    link to IB restored without the data (1101), the supervisor reconnects
+    if needed and awaits `restore()` to resubscribe and resync. Recovery time
+    runs from the drop until restore() returns.
+    """
+    def __init__(self, ib, connect, restore, base_delay=1.0, max_delay=60.0):
+        self.ib = ib
+        self._connect = connect  # async (): open the connection
+        self.restore = restore  # async (): resubscribe and resync after a reconnect
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.status = 'disconnected'  # 'connecting', 'connected', 'reconnecting', 'resyncing', 'tws offline'
+        self.attempts = 0  # In the current outage
+        self.down_since = None  # monotonic time of the drop
+        self.last_recovery = None  # Seconds from the last drop until restored
+        self.recoveries = 0
+        self.listeners = []  # callback(supervisor) on every status change
+        self._task = None
+        self._stopped = False
+        ib.disconnectedEvent += self.on_disconnected
+        ib.errorEvent += self.on_error
+
+    async def connect(self):
+        """Connect, retrying with backoff until it works."""
+        self.attempts = 0
+        while True:
+            self.attempts += 1
+            self._set_status('connecting' if self.down_since is None else 'reconnecting')
+            try:
+                await self._connect()
+                self._set_status('connected' if self.down_since is None else 'resyncing')
+                return
+            except (ConnectionError, OSError, asyncio.TimeoutError) as e:
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (self.attempts - 1)))
+                logging.getLogger("HYDRA_logger").warning(f"IB connect attempt {self.attempts} failed ({e!r}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    def stop(self):
+        """Before a deliberate disconnect: stop reconnecting."""
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self.ib.disconnectedEvent -= self.on_disconnected
+        self.ib.errorEvent -= self.on_error
+
+    def on_disconnected(self):
+        if self._stopped or self.status in ('connecting', 'reconnecting'):
+            return  # A failed attempt tearing down; connect() is already retrying
+        self._outage("IB connection lost, reconnecting")
+
+    def on_error(self, req_id, error_code, error_string, contract):
+        if self._stopped:
+            return
+        if error_code == CONNECTIVITY_LOST and self.status == 'connected':
+            self.down_since = time.monotonic()
+            self._set_status('tws offline')
+        elif error_code == RESTORED_DATA_LOST and self.ib.isConnected() and self._task is None:
+            self._outage("TWS reconnected to IB without market data, resubscribing")
+        elif error_code == RESTORED_DATA_KEPT and self.status == 'tws offline':
+            self._recovered()
+
+    def _outage(self, message):
+        logging.getLogger("HYDRA_logger").warning(message)
+        if self.down_since is None:
+            self.down_since = time.monotonic()
+        self._set_status('resyncing' if self.ib.isConnected() else 'reconnecting')
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._recover())
+
+    async def _recover(self):
+        try:
+            while True:
+                if not self.ib.isConnected():
+                    await self.connect()
+                try:
+                    await self.restore()
+                    break
+                except (ConnectionError, asyncio.TimeoutError) as e:
+                    logging.getLogger("HYDRA_logger").warning(f"Resync after reconnect failed ({e!r}), starting over")
+                except Exception:
+                    logging.getLogger("HYDRA_logger").exception("Resync after reconnect failed, continuing with what was restored")
+                    break
+        finally:
+            self._task = None
+        self._recovered()
+
+    def _recovered(self):
+        if self.down_since is not None:
+            self.last_recovery = time.monotonic() - self.down_since
+            self.recoveries += 1
+            self.down_since = None
+            if metrics.enabled:
+                metrics.record('recovery', self.last_recovery * 1_000_000_000)
+            logging.getLogger("HYDRA_logger").info(f"IB session restored in {self.last_recovery:.2f}s")
+        self._set_status('connected')
+
+    def _set_status(self, status):
+        self.status = status
+        for callback in self.listeners:
+            callback(self)
@@ -0,0 +1,132 @@
+import logging
+
+import numpy as np
+
+
+class ConsoleBuffer:
+    """The last `capacity` log records for the TUI console, kept compact and formatted only when shown.
+
+    A record is a few NumPy slots (time, level, source, line) and its
+    message string; once full, each append overwrites the oldest. Records
+    are addressed by sequence number (0 for the first ever appended), which
+    stays valid until the record is overwritten, so a scrolled-back view
+    doesn't move while new records arrive. The sequence numbers passing the
+    last level/source filter asked for are kept as a sorted index, extended
+    with NumPy over only the records appended since, so stepping between
+    filtered records is a binary search however sparse the matches are.
+    """
+    def __init__(self, formatter, capacity=100_000):
+        self.formatter = formatter
+        self.capacity = capacity
+        self.created = np.zeros(capacity)
+        self.levels = np.zeros(capacity, dtype=np.uint8)
+        self.source_ids = np.zeros(capacity, dtype=np.int32)
+        self.lines = np.zeros(capacity, dtype=np.int32)
+        self.messages = [None] * capacity
+        self.sources = []  # source id -> filename
+        self.end = 0  # Sequence number the next record gets
+        self._source_ids = {}
+        self._filter = None  # (level, sources) the index is for
+        self._index = np.zeros(0, dtype=np.int64)  # Held sequence numbers passing _filter, ascending
+        self._indexed = 0  # Sequence number the index has looked up to
+
+    @property
+    def start(self):
+        """Sequence number of the oldest record still held."""
+        return max(0, self.end - self.capacity)
+
+    def __len__(self):
+        return self.end - self.start
+
+    def append(self, record):
+        source = self._source_ids.get(record.filename)
+        if source is None:
+            source = self._source_ids[record.filename] = len(self.sources)
+            self.sources.append(record.filename)
+        message = record.getMessage()
+        if record.exc_info:
+            message += "\n" + self.formatter.formatException(record.exc_info)
+        i = self.end % self.capacity
+        self.created[i] = record.created
+        self.levels[i] = record.levelno
+        self.source_ids[i] = source
+        self.lines[i] = record.lineno
+        self.messages[i] = message
+        self.end += 1
+
+    def format(self, seq):
+        """The record as the log file formats it."""
+        i = seq % self.capacity
+        created = float(self.created[i])
+        return self.formatter.format(logging.makeLogRecord({
+            'created': created, 'msecs': (created - int(created)) * 1000, 'levelno': int(self.levels[i]),
+            'levelname': logging.getLevelName(int(self.levels[i])), 'filename': self.sources[self.source_ids[i]],
+            'lineno': int(self.lines[i]), 'msg': self.messages[i],
+        }))
+
+    def message(self, seq):
+        return self.messages[seq % self.capacity]
+
+    def tail(self, n):
+        """The newest `n` records, formatted, oldest first."""
+        return [self.format(seq) for seq in range(max(self.start, self.end - n), self.end)]
+
+    def sources_matching(self, text):
+        """Source ids whose filename contains `text` (case-insensitive)."""
+        text = text.lower()
+        return [source for source, name in enumerate(self.sources) if text in name.lower()]
+
+    def find(self, seq, step, level=0, sources=None):
+        """The first held record at or after (`step` 1) / before (`step` -1) `seq` passing the filters, or None."""
+        if level <= 0 and sources is None:
+            seq = max(seq, self.start) if step > 0 else min(seq, self.end - 1)
+            return seq if self.start <= seq < self.end else None
+        seqs = self._filtered(level, sources)
+        if step > 0:
+            i = np.searchsorted(seqs, seq, 'left')
+            return int(seqs[i]) if i < len(seqs) else None
+        i = np.searchsorted(seqs, seq, 'right') - 1
+        return int(seqs[i]) if i >= 0 else None
+
+    def search(self, text, seq, step, level=0, sources=None):
+        """The nearest record from `seq` towards `step` passing the filters whose message contains `text` (case-insensitive), or None."""
+        text = text.lower()
+        for seqs in self._matching(seq, step, level, sources):
+            for seq in seqs.tolist():
+                if text in self.messages[seq % self.capacity].lower():
+                    return seq
+        return None
+
+    def _filtered(self, level, sources):
+        """Held sequence numbers passing the filters, ascending; only records new since the last call are looked at."""
+        key = (level, None if sources is None else tuple(sources))
+        if key != self._filter:
+            self._filter, self._index, self._indexed = key, self._index[:0], 0
+        start, end = self.start, self.end
+        if self._indexed < end:
+            seqs = np.arange(max(self._indexed, start), end)
+            slots = seqs % self.capacity
+            match = self.levels[slots] >= level
+            if sources is not None:
+                match &= np.isin(self.source_ids[slots], sources)
+            if match.any():
+                self._index = np.concatenate((self._index, seqs[match]))
+            self._indexed = end
+        if len(self._index) and self._index[0] < start:  # Overwritten since
+            self._index = self._index[np.searchsorted(self._index, start):]
+        return self._index
+
+    def _matching(self, seq, step, level, sources, chunk=4096):
+        """Sequence numbers passing the filters from `seq` towards `step`, one non-empty array per chunk."""
+        start, end = self.start, self.end
+        seq = max(seq, start) if step > 0 else min(seq, end - 1)
+        while start <= seq < end:
+            stop = min(end, seq + chunk) if step > 0 else max(start - 1, seq - chunk)
+            seqs = np.arange(seq, stop, step)
+            slots = seqs % self.capacity
+            match = self.levels[slots] >= level
+            if sources is not None:
+                match &= np.isin(self.source_ids[slots], sources)
+            if match.any():
+                yield seqs[match]
+            seq = stop
@@ -0,0 +1,105 @@
+import json
+import os
+import time
+from datetime import datetime
+
+from ib_async import Contract, util
+
+
+class ContractCache:
+    """Qualified contracts on disk, keyed by request (secType:localSymbol-or-symbol:exchange) and conId.
+
+    A hit costs no round-trip to IB. Entries are dropped once the contract has
+    expired (lastTradeDateOrContractMonth in the past, so a ContFuture request
+    re-qualifies to the new front month after a roll) or are older than
+    `max_age` seconds. Misses are qualified in a single batch.
+    """
+    def __init__(self, path, max_age=7 * 86400):
+        self.path = path
+        self.max_age = max_age
+        self.entries = {}  # request key -> {'contract': fields, 'cached_at': epoch}
+        self.by_con_id = {}  # conId -> request key
+        self.hits = 0
+        self.misses = 0
+        try:
+            with open(path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}  # No cache yet, or a damaged one: start over
+        for key, entry in list(self.entries.items()):
+            if self._stale(entry):
+                del self.entries[key]
+            else:
+                self.by_con_id[entry['contract']['conId']] = key
+
+    def get(self, key):
+        """Cached contract for a request key, conId or unqualified Contract; None on a miss."""
+        if isinstance(key, Contract):
+            key = key.conId or request_key(key)
+        if isinstance(key, int):
+            key = self.by_con_id.get(key)
+        entry = self.entries.get(key)
+        if entry is None or self._stale(entry):
+            return None
+        return Contract.create(**entry['contract'])
+
+    def put(self, key, qualified):
+        """Cache `qualified` under a request key (see request_key) and its conId."""
+        fields = {name: value for name, value in util.dataclassNonDefaults(qualified).items()
+                  if isinstance(value, (str, int, float, bool))}
+        self.entries[key] = {'contract': fields, 'cached_at': time.time()}
+        self.by_con_id[qualified.conId] = key
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)  # Never leave a half-written cache behind
+
+    async def qualify(self, ib, contracts):
+        """Qualified contracts in order (None where IB has no unique match), one batched request for the misses."""
+        results, misses = self._lookup(contracts)
+        if misses:
+            qualified = await ib.qualifyContractsAsync(*[contracts[i] for i in misses])
+            self._merge(results, misses, qualified)
+        return results
+
+    def qualify_blocking(self, ib, contracts):
+        """qualify() for synchronous callers like Bot.qualify."""
+        results, misses = self._lookup(contracts)
+        if misses:
+            qualified = ib.qualifyContracts(*[contracts[i] for i in misses])
+            self._merge(results, misses, qualified)
+        return results
+
+    def _lookup(self, contracts):
+        results = [self.get(c) for c in contracts]
+        # Keyed now: ib_async qualifies the request objects in place
+        misses = {i: request_key(c) for i, c in enumerate(contracts) if results[i] is None}
+        self.hits += len(contracts) - len(misses)
+        self.misses += len(misses)
+        return results, misses
+
+    def _merge(self, results, misses, qualified):
+        for (i, key), contract in zip(misses.items(), qualified):
+            if isinstance(contract, Contract) and contract.conId:
+                results[i] = contract
+                self.put(key, contract)
+        self.save()
+
+    def _stale(self, entry):
+        if time.time() - entry['cached_at'] > self.max_age:
+            return True
+        expiry = entry['contract'].get('lastTradeDateOrContractMonth', '')
+        today = datetime.now().strftime('%Y%m%d')
+        return bool(expiry) and expiry[:8] < today[:len(expiry[:8])]
+
+
+def request_key(contract):
+    """How a contract is asked for, before qualification."""
+    if contract.conId:
+        return str(contract.conId)
+    return f"{contract.secType}:{contract.localSymbol or contract.symbol}:{contract.exchange}"
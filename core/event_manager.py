@@ -1,20 +1,232 @@
-from collections import defaultdict
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
 
 
-class EventManager:
+# Queueing policies
+KEEP_ALL = 'keep_all'  # Every event is delivered (orders, fills) up to maxsize queued; beyond it new ones are dropped and logged.
+CONFLATE = 'conflate'  # Only the latest payload per key is kept (market data).
+DROP_OLDEST = 'drop_oldest'  # Bounded FIFO; the oldest event is dropped when full.
+
+KEEP_ALL_MAXSIZE = 100_000  # Default bound of a KEEP_ALL queue: minutes of fills even if the loop stalls
+
+
+class TopicMetrics:
+    """Counters and dispatch latency for one topic."""
     def __init__(self):
-        self.subscribers = defaultdict(list)
+        self.published = 0
+        self.dispatched = 0
+        self.conflated = 0
+        self.dropped = 0
+        self.handler_errors = 0
+        self.max_depth = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def as_dict(self, depth):
+        return {
+            'depth': depth,
+            'max_depth': self.max_depth,
+            'published': self.published,
+            'dispatched': self.dispatched,
+            'conflated': self.conflated,
+            'dropped': self.dropped,
+            'handler_errors': self.handler_errors,
+            'last_latency': self.last_latency,
+            'max_latency': self.max_latency,
+            'avg_latency': self.total_latency / self.dispatched if self.dispatched else 0.0,
+        }
+
+
+class Topic:
+    """Per-topic queue, policy and prioritized handler list."""
+    def __init__(self, policy=KEEP_ALL, maxsize=None):
+        self.policy = policy
+        self.maxsize = KEEP_ALL_MAXSIZE if maxsize is None and policy == KEEP_ALL else maxsize
+        self.queue = OrderedDict() if policy == CONFLATE else deque()
+        self.handlers = []  # Sorted (-priority, seq, handler)
+        self.metrics = TopicMetrics()
+        self.scheduled = False
+        self.overflowing = False  # A KEEP_ALL queue is full and dropping; logged once per episode
+
+    def put(self, payload, key, published_at):
+        """Queue the event; False if a full KEEP_ALL queue dropped it."""
+        if self.policy == CONFLATE:
+            if key in self.queue:
+                self.metrics.conflated += 1
+                # Keep the original timestamp so latency shows how long the key waited
+                self.queue[key] = (payload, self.queue[key][1])
+                return True
+            self.queue[key] = (payload, published_at)
+        else:
+            if self.maxsize is not None and len(self.queue) >= self.maxsize:
+                self.metrics.dropped += 1
+                if self.policy == KEEP_ALL:
+                    return False  # Keep what's queued in order; the newest is lost
+                self.queue.popleft()
+            self.queue.append((payload, published_at))
+        self.metrics.max_depth = max(self.metrics.max_depth, len(self.queue))
+        return True
+
+    def pop(self):
+        if self.policy == CONFLATE:
+            return self.queue.popitem(last=False)[1]
+        return self.queue.popleft()
+
+
+class EventManager:
+    """Asyncio event bus with per-topic queues, handler priorities and conflation.
 
-    def subscribe(self, event_name, handler):
-        self.subscribers[event_name].append(handler)
+    publish() never calls handlers on the publisher's stack: it enqueues and
+    schedules a drain on the event loop. It may be called from any thread:
+    off the loop's thread events go through a bounded inbox that the loop
+    empties (one call_soon_threadsafe wakeup per batch), so topic queues are
+    only ever touched on the loop. Handlers run in priority
+    order (higher first); an exception in one is logged and doesn't stop the
+    others. Handlers may be coroutine functions. A drain pass handles at most `batch` events
+    before yielding back to the loop, so one busy topic can't starve the rest.
+    """
+    def __init__(self, loop=None, batch=256, inbox_maxsize=KEEP_ALL_MAXSIZE):
+        self.loop = loop
+        self._thread = threading.get_ident() if loop is not None else None  # The loop's thread
+        self.batch = batch
+        self.inbox = deque()  # (event_name, payload, key) published from other threads
+        self.inbox_maxsize = inbox_maxsize
+        self.inbox_dropped = 0
+        self._inbox_logged = 0
+        self._waking = False
+        self.topics = {}
+        self.subscribers = defaultdict(list)  # Topic name -> handlers, in dispatch order
+        self._seq = 0
+
+    def bind(self, loop=None):
+        """Dispatch on `loop` (default: the running one), which runs on the calling thread.
+
+        Without it the manager binds to the first loop it sees running a
+        publish; until then every publish goes through the inbox.
+        """
+        self.loop = loop or asyncio.get_running_loop()
+        self._thread = threading.get_ident()
+        if self.inbox and not self._waking:
+            self._waking = True
+            self.loop.call_soon_threadsafe(self._take_inbox)
+
+    def configure(self, event_name, policy=KEEP_ALL, maxsize=None):
+        """Set the queueing policy of a topic (before events are published on it).
+
+        `maxsize` bounds DROP_OLDEST and KEEP_ALL (default KEEP_ALL_MAXSIZE); CONFLATE is bounded by its keys.
+        """
+        topic = self._topic(event_name)
+        topic.policy = policy
+        topic.maxsize = KEEP_ALL_MAXSIZE if maxsize is None and policy == KEEP_ALL else maxsize
+        topic.queue = OrderedDict() if policy == CONFLATE else deque()
+        return topic
+
+    def subscribe(self, event_name, handler, priority=0):
+        topic = self._topic(event_name)
+        self._seq += 1
+        bisect.insort(topic.handlers, (-priority, self._seq, handler), key=lambda entry: entry[:2])
+        self.subscribers[event_name] = [entry[2] for entry in topic.handlers]
 
     def unsubscribe(self, event_name, handler):
-        if handler in self.subscribers[event_name]:
-            self.subscribers[event_name].remove(handler)
+        topic = self._topic(event_name)
+        topic.handlers = [entry for entry in topic.handlers if entry[2] != handler]
+        self.subscribers[event_name] = [entry[2] for entry in topic.handlers]
+
+    def publish(self, event_name, payload, key=None):
+        """Queue `payload`; `key` selects what gets conflated on CONFLATE topics."""
+        loop = self._get_loop()
+        if threading.get_ident() != self._thread:
+            self._publish_threadsafe(loop, event_name, payload, key)
+            return
+        topic = self._topic(event_name)
+        topic.metrics.published += 1
+        if not topic.put(payload, payload if key is None else key, time.perf_counter()):
+            if not topic.overflowing:
+                topic.overflowing = True
+                logging.getLogger("HYDRA_logger").error(f"Event queue '{event_name}' is full ({topic.maxsize}), dropping new events")
+        elif not topic.scheduled:
+            topic.scheduled = True
+            loop.call_soon(self._drain, event_name, topic)
+
+    def _publish_threadsafe(self, loop, event_name, payload, key):
+        if len(self.inbox) >= self.inbox_maxsize:
+            self.inbox_dropped += 1  # Logged from the loop: logging here would publish again
+            return
+        self.inbox.append((event_name, payload, key))
+        if loop is None:
+            return  # bind() wakes the loop
+        if not self._waking and not loop.is_closed():  # After shutdown there's nobody left to tell
+            self._waking = True
+            loop.call_soon_threadsafe(self._take_inbox)
+
+    def _take_inbox(self):
+        self._waking = False  # Before emptying, so an event appended meanwhile is either taken here or wakes us again
+        while self.inbox:
+            self.publish(*self.inbox.popleft())
+        if self.inbox_dropped != self._inbox_logged:
+            logging.getLogger("HYDRA_logger").error(f"Event inbox full, {self.inbox_dropped - self._inbox_logged} events from other threads dropped")
+            self._inbox_logged = self.inbox_dropped
+
+    def metrics(self, event_name=None):
+        """Queue depth, counters and latency for one topic, or all of them."""
+        if event_name is not None:
+            topic = self._topic(event_name)
+            return topic.metrics.as_dict(len(topic.queue))
+        return {name: topic.metrics.as_dict(len(topic.queue)) for name, topic in self.topics.items()}
+
+    def _drain(self, event_name, topic):
+        for _ in range(self.batch):
+            if not topic.queue:
+                break
+            payload, published_at = topic.pop()
+            latency = time.perf_counter() - published_at
+            metrics = topic.metrics
+            metrics.dispatched += 1
+            metrics.last_latency = latency
+            metrics.total_latency += latency
+            metrics.max_latency = max(metrics.max_latency, latency)
+            for _, _, handler in list(topic.handlers):
+                try:
+                    result = handler(payload)
+                    if asyncio.iscoroutine(result):
+                        task = self._get_loop().create_task(result)
+                        task.add_done_callback(lambda t, m=metrics, n=event_name: self._task_done(t, m, n))
+                except Exception:
+                    metrics.handler_errors += 1
+                    logging.getLogger("HYDRA_logger").exception(f"Event handler {handler!r} failed on '{event_name}'")
+        if topic.queue:
+            self._get_loop().call_soon(self._drain, event_name, topic)
+        else:
+            topic.scheduled = False
+            if topic.overflowing:
+                topic.overflowing = False
+                logging.getLogger("HYDRA_logger").warning(f"Event queue '{event_name}' caught up, {topic.metrics.dropped} events dropped so far")
+
+    def _task_done(self, task, metrics, event_name):
+        if not task.cancelled() and task.exception() is not None:
+            metrics.handler_errors += 1
+            logging.getLogger("HYDRA_logger").error(f"Async event handler failed on '{event_name}': {task.exception()!r}")
+
+    def _topic(self, event_name):
+        topic = self.topics.get(event_name)
+        if topic is None:
+            topic = self.topics[event_name] = Topic()
+        return topic
 
-    def publish(self, event_name, payload):
-        for each_event in self.subscribers[event_name]:
-            each_event(payload)
+    def _get_loop(self):
+        if self._thread is None:
+            try:
+                self.bind(asyncio.get_running_loop())
+            except RuntimeError:  # Not on a running loop, so this needn't be the loop's thread
+                if self.loop is None and threading.current_thread() is threading.main_thread():
+                    self.loop = asyncio.get_event_loop()  # The one that will run here; bound once it does
+        return self.loop
 
 
 event_manager = EventManager()
+event_manager.configure('state_changed', policy=CONFLATE)
@@ -0,0 +1,340 @@
+"""A local stand-in for TWS/IB Gateway, for benchmarks and offline development.
+
+Speaks enough of the TWS API socket protocol for ib_async to connect,
+qualify contracts, and receive synthetic market data, tick-by-tick data,
+historical (keepUpToDate) bars and account values at configurable rates.
+
+    python -m core.fake_gateway --port 7497 --tick-rate 200
+
+In --probe mode the size of every LAST tick carries the time.monotonic_ns()
+it was sent at, in microseconds, so a client on the same machine can measure
+tick-to-screen latency.
+"""
+import argparse
+import asyncio
+import random
+import struct
+import time
+from datetime import datetime, timezone
+
+
+SERVER_VERSION = 176
+
+def quarterly_futures(root, con_id, price, multiplier, count=2, today=None):
+    """The next `count` quarterly contracts of `root` (third Friday of Mar/Jun/Sep/Dec), in CONTRACTS' format."""
+    today = today or datetime.now(timezone.utc).date()
+    contracts = {}
+    year, month = today.year, (today.month - 1) // 3 * 3 + 3
+    while len(contracts) < count:
+        first = datetime(year, month, 1)
+        expiry = first.replace(day=1 + (4 - first.weekday()) % 7 + 14)  # Third Friday
+        if expiry.date() >= today:
+            local_symbol = f"{root}{'HMUZ'[month // 3 - 1]}{year % 10}"
+            contracts[local_symbol] = dict(conId=con_id + len(contracts), symbol=root, secType='FUT',
+                                           lastTradeDate=expiry.strftime('%Y%m%d'), multiplier=multiplier, exchange='CME',
+                                           currency='USD', tradingClass=root, minTick=0.25, price=price)
+        year, month = (year + 1, 3) if month == 12 else (year, month + 3)
+    return contracts
+
+
+# Front and next quarter of each root, so front-month lookups work whatever today's date
+CONTRACTS = {**quarterly_futures('MES', 620730920, 5300.0, '5'), **quarterly_futures('MNQ', 620730945, 18500.0, '2')}
+
+
+class FakeGateway:
+    """asyncio TCP server answering ib_async like TWS would, with synthetic data.
+
+    Rates are per subscription per second. `contracts` maps localSymbol to the
+    contract fields in CONTRACTS' format.
+    """
+    def __init__(self, host='127.0.0.1', port=0, contracts=None, tick_rate=50.0, tbt_rate=50.0,
+                 bar_update_interval=5.0, account_rate=1.0, accounts=('DU0000001',), probe=False):
+        self.host = host
+        self.port = port
+        self.contracts = dict(contracts or CONTRACTS)
+        self.tick_rate = tick_rate
+        self.tbt_rate = tbt_rate
+        self.bar_update_interval = bar_update_interval
+        self.account_rate = account_rate
+        self.accounts = list(accounts)
+        self.probe = probe
+        self.messages_sent = 0
+        self._server = None
+        self._sessions = set()
+        self._prices = {c['conId']: c['price'] for c in self.contracts.values()}
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            for task in list(self._sessions):
+                task.cancel()
+            await self._server.wait_closed()
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def _session(self, reader, writer):
+        session = _Session(self, reader, writer)
+        task = asyncio.current_task()
+        self._sessions.add(task)
+        try:
+            await session.run()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass  # Client went away, or the gateway is stopping
+        finally:
+            self._sessions.discard(task)
+            session.close()
+
+    def next_price(self, con_id, tick):
+        if self.probe:
+            price = self._prices[con_id] + tick  # Strictly moving, so every tick is a visible change
+        else:
+            price = self._prices[con_id] + random.choice((-tick, 0.0, tick))
+        self._prices[con_id] = price
+        return price
+
+    def find(self, fields):
+        """Match the 12 serialized contract fields of a request against the universe."""
+        con_id, symbol, sec_type, last_trade, _strike, _right, _mult, exchange, _pex, currency, local_symbol, _tc = fields
+        for name, c in self.contracts.items():
+            if con_id not in ('', '0') and int(con_id) == c['conId']:
+                return name, c
+            if local_symbol and local_symbol == name:
+                return name, c
+        for name, c in sorted(self.contracts.items(), key=lambda item: item[1]['lastTradeDate']):
+            if symbol and symbol == c['symbol']:  # ContFuture / plain symbol: front month
+                return name, c
+        return None, None
+
+    def find_all(self, fields):
+        """Like find(), but a FUT request by symbol alone lists every month, as TWS does."""
+        con_id, symbol, sec_type, last_trade = fields[:4]
+        local_symbol = fields[10]
+        if sec_type == 'FUT' and symbol and not (con_id not in ('', '0') or local_symbol or last_trade):
+            return [(name, c) for name, c in self.contracts.items() if c['symbol'] == symbol]
+        name, c = self.find(fields)
+        return [] if c is None else [(name, c)]
+
+
+class _Session:
+    """One client connection: decodes requests and runs its subscriptions."""
+    def __init__(self, gateway, reader, writer):
+        self.gateway = gateway
+        self.reader = reader
+        self.writer = writer
+        self.tasks = {}  # reqId -> streaming task
+
+    async def run(self):
+        assert await self.reader.readexactly(4) == b'API\0'
+        await self._read()  # "v157..178"
+        now = datetime.now(timezone.utc).strftime('%Y%m%d %H:%M:%S UTC')
+        self._write_raw(f"{SERVER_VERSION}\0{now}\0")
+        while True:
+            fields = await self._read()
+            self._handle(fields)
+            await self.writer.drain()
+
+    def close(self):
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+        self.writer.close()
+
+    async def _read(self):
+        size = struct.unpack('>I', await self.reader.readexactly(4))[0]
+        return (await self.reader.readexactly(size)).decode().split('\0')[:-1]
+
+    def _write_raw(self, text):
+        data = text.encode()
+        self.writer.write(struct.pack('>I', len(data)) + data)
+        self.gateway.messages_sent += 1
+
+    def send(self, *fields):
+        self._write_raw(''.join(f"{f}\0" for f in fields))
+
+    def _handle(self, fields):
+        msg_id = int(fields[0])
+        gw = self.gateway
+        if msg_id == 71:  # startApi
+            self.send(15, 1, ','.join(gw.accounts))
+            self.send(9, 1, 1)
+        elif msg_id == 49:  # reqCurrentTime
+            self.send(49, 1, int(time.time()))
+        elif msg_id == 61:  # reqPositions
+            self.send(62, 1)
+        elif msg_id == 5:  # reqOpenOrders
+            self.send(53, 1)
+        elif msg_id == 99:  # reqCompletedOrders
+            self.send(102)
+        elif msg_id == 7:  # reqExecutions
+            self.send(55, 1, fields[2])
+        elif msg_id == 6:  # reqAccountUpdates
+            account = fields[3] or gw.accounts[0]
+            for tag, value, currency in self._account_values():
+                self.send(6, 2, tag, value, currency, account)
+            self.send(54, 1, account)
+        elif msg_id == 76:  # reqAccountUpdatesMulti
+            req_id, account = fields[2], fields[3]
+            for tag, value, currency in self._account_values():
+                self.send(73, 1, req_id, account, '', tag, value, currency)
+            self.send(74, 1, req_id)
+        elif msg_id == 62:  # reqAccountSummary
+            req_id = int(fields[2])
+            self._account_summary(req_id)
+            self.send(64, 1, req_id)
+            self._stream(req_id, gw.account_rate, lambda: self._account_summary(req_id))
+        elif msg_id == 9:  # reqContractDetails
+            self._contract_details(int(fields[2]), fields[3:15])
+        elif msg_id == 1:  # reqMktData
+            if fields[17] == '1':  # snapshot: one tick, then tickSnapshotEnd
+                self._snapshot(int(fields[2]), fields[3:15])
+            else:
+                self._subscribe(int(fields[2]), fields[3:15], gw.tick_rate, self._mkt_tick)
+        elif msg_id == 97:  # reqTickByTickData
+            self._subscribe(int(fields[1]), fields[2:14], gw.tbt_rate, self._tbt_tick)
+        elif msg_id == 20:  # reqHistoricalData
+            self._historical(int(fields[1]), fields[2:14], fields[15:])
+        elif msg_id in (2, 25, 63):  # cancelMktData / cancelHistoricalData / cancelAccountSummary
+            self._cancel(int(fields[2]))
+        elif msg_id == 98:  # cancelTickByTickData
+            self._cancel(int(fields[1]))
+
+    def _contract_details(self, req_id, contract_fields):
+        matches = self.gateway.find_all(contract_fields)
+        if not matches:
+            self.send(4, 2, req_id, 200, "No security definition has been found for the request", '')
+            return
+        for name, c in matches:
+            self._contract_data(req_id, name, c)
+        self.send(52, 1, req_id)
+
+    def _contract_data(self, req_id, name, c):
+        self.send(10, req_id, c['symbol'], c['secType'], c['lastTradeDate'], 0.0, '', c['exchange'], c['currency'],
+                  name, c['tradingClass'], c['tradingClass'], c['conId'], c['minTick'], c['multiplier'],
+                  'LMT,MKT,STP', c['exchange'], 1, 0, c['symbol'], '', c['lastTradeDate'][:6], '', '', '',
+                  'US/Central', '', '', '', '', 0, 1, c['symbol'], 'IND', '', c['lastTradeDate'], '', 1, 1, 1)
+
+    def _subscribe(self, req_id, contract_fields, rate, tick):
+        _, c = self.gateway.find(contract_fields)
+        if c is None:
+            self.send(4, 2, req_id, 200, "No security definition has been found for the request", '')
+            return
+        self._stream(req_id, rate, lambda: tick(req_id, c))
+
+    def _snapshot(self, req_id, contract_fields):
+        _, c = self.gateway.find(contract_fields)
+        if c is None:
+            self.send(4, 2, req_id, 200, "No security definition has been found for the request", '')
+            return
+        self._mkt_tick(req_id, c)
+        self.send(57, 1, req_id)
+
+    def _mkt_tick(self, req_id, c):
+        price = self.gateway.next_price(c['conId'], c['minTick'])
+        size = time.monotonic_ns() // 1000 if self.gateway.probe else random.randint(1, 20)
+        self.send(1, 6, req_id, 4, price, size, 0)  # LAST price + size
+
+    def _tbt_tick(self, req_id, c):
+        price = self.gateway.next_price(c['conId'], c['minTick'])
+        size = time.monotonic_ns() // 1000 if self.gateway.probe else random.randint(1, 20)
+        self.send(99, req_id, 1, int(time.time()), price, size, 0, c['exchange'], '')
+
+    def _historical(self, req_id, contract_fields, options):
+        _, c = self.gateway.find(contract_fields)
+        if c is None:
+            self.send(4, 2, req_id, 162, "Historical Market Data Service error message:No data", '')
+            return
+        _end, bar_size, duration, _rth, _what, format_date, keep_up_to_date = options[:7]
+        step = _seconds(bar_size)
+        count = min(5000, max(1, _seconds(duration) // step))
+        now = int(time.time()) // step * step
+        price = c['price']
+        fields = []
+        for i in range(count, -1, -1):  # The last bar is the one still forming
+            o = price
+            price = round(price + random.choice((-1, 0, 1)) * c['minTick'] * 4, 2)
+            fields += [_bar_date(now - i * step, format_date), o, max(o, price), min(o, price), price,
+                       random.randint(100, 1000), round((o + price) / 2, 2), random.randint(10, 100)]
+        start, end = _bar_date(now - count * step, '1'), _bar_date(now, '1')
+        self.send(17, req_id, start, end, count + 1, *fields)
+        if keep_up_to_date == '1':
+            def update():
+                bar_start = int(time.time()) // step * step
+                p = self.gateway.next_price(c['conId'], c['minTick'])
+                self.send(90, req_id, random.randint(10, 100), _bar_date(bar_start, format_date), p, p, p, p, p, random.randint(1, 50))
+            self._stream(req_id, 1 / self.gateway.bar_update_interval, update)
+
+    def _account_values(self):
+        return [('NetLiquidation', f"{100000 + random.random() * 1000:.2f}", 'USD'),
+                ('NetLiquidationByCurrency', f"{100000 + random.random() * 1000:.4f}", 'BASE'),
+                ('AvailableFunds', f"{80000 + random.random() * 1000:.2f}", 'USD')]
+
+    def _account_summary(self, req_id):
+        for tag, value, currency in self._account_values():
+            account = 'All' if currency == 'BASE' else self.gateway.accounts[0]
+            self.send(63, 1, req_id, account, tag, value, currency)
+
+    def _stream(self, req_id, rate, emit):
+        if rate and rate > 0:
+            self._cancel(req_id)
+            self.tasks[req_id] = asyncio.ensure_future(self._pace(rate, emit))
+
+    def _cancel(self, req_id):
+        task = self.tasks.pop(req_id, None)
+        if task is not None:
+            task.cancel()
+
+    async def _pace(self, rate, emit):
+        """Call emit() `rate` times a second, in bursts when the rate beats the loop's timer resolution."""
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        sent = 0
+        while True:
+            due = int((loop.time() - start) * rate) - sent
+            for _ in range(due):
+                emit()
+            sent += due
+            await self.writer.drain()
+            await asyncio.sleep(max(0.001, 1 / rate))
+
+
+def _seconds(text):
+    """'5 mins' / '49500 S' / '1 D' -> seconds."""
+    count, unit = text.split()
+    unit = unit.lower().rstrip('s') or 's'
+    return int(count) * {'s': 1, 'sec': 1, 'min': 60, 'hour': 3600, 'd': 86400, 'day': 86400, 'w': 604800, 'week': 604800}[unit]
+
+
+def _bar_date(epoch, format_date):
+    if format_date == '2':
+        return str(epoch)
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime('%Y%m%d %H:%M:%S UTC')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake TWS/IB Gateway with synthetic data.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7497)
+    parser.add_argument('--tick-rate', type=float, default=50.0, help="reqMktData ticks/s per subscription")
+    parser.add_argument('--tbt-rate', type=float, default=50.0, help="reqTickByTickData ticks/s per subscription")
+    parser.add_argument('--bar-update-interval', type=float, default=5.0, help="Seconds between keepUpToDate updates")
+    parser.add_argument('--account-rate', type=float, default=1.0, help="Account summary updates/s")
+    parser.add_argument('--probe', action='store_true', help="Stamp LAST sizes with send time for latency probes")
+    args = parser.parse_args()
+    gateway = FakeGateway(args.host, args.port, tick_rate=args.tick_rate, tbt_rate=args.tbt_rate,
+                          bar_update_interval=args.bar_update_interval, account_rate=args.account_rate, probe=args.probe)
+    try:
+        asyncio.run(gateway.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
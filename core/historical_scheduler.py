@@ -0,0 +1,80 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+
+class HistoricalScheduler:
+    """Runs reqHistoricalData requests concurrently while staying inside IB's pacing rules.
+
+    IB rejects (error 162, "pacing violation") a request identical to one made
+    within 15 s, a sixth request for the same contract, exchange and
+    whatToShow within 2 s, and a 61st request within any 10 minutes; it also
+    caps requests in flight. request() waits only as long as the first rule
+    it would break, and requests are released in the order they were made.
+    """
+    def __init__(self, ib, max_in_flight=50, window=600.0, window_limit=60, burst_window=2.0, burst_limit=5,
+                 identical_interval=15.0):
+        self.ib = ib
+        self.max_in_flight = max_in_flight
+        self.window = window
+        self.window_limit = window_limit
+        self.burst_window = burst_window
+        self.burst_limit = burst_limit
+        self.identical_interval = identical_interval
+        self.sent = deque()  # monotonic send times within `window`
+        self.sent_by_contract = {}  # (conId, exchange, whatToShow) -> deque of send times within `burst_window`
+        self.sent_by_request = {}  # request parameters -> last send time
+        self.requests = 0
+        self.waited = 0.0  # Seconds spent waiting for pacing, in total
+        self._in_flight = None
+        self._turn = None
+
+    async def request(self, contract, **kwargs):
+        """ib.reqHistoricalDataAsync(contract, **kwargs), as soon as pacing allows."""
+        if self._turn is None:  # Created here so they bind to the running loop
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+            self._turn = asyncio.Lock()
+        async with self._in_flight:
+            async with self._turn:
+                await self._wait_turn(contract, kwargs)
+            return await self.ib.reqHistoricalDataAsync(contract, **kwargs)
+
+    def stats(self):
+        return {'requests': self.requests, 'waited': self.waited, 'last_10_min': len(self.sent)}
+
+    async def _wait_turn(self, contract, kwargs):
+        contract_key = (contract.conId, contract.exchange, kwargs.get('whatToShow'))
+        request_key = (contract.conId, contract.exchange) + tuple(sorted((k, str(v)) for k, v in kwargs.items()))
+        while True:
+            now = time.monotonic()
+            delay = self._delay(now, contract_key, request_key)
+            if delay <= 0:
+                break
+            if delay >= 1:
+                logging.getLogger("HYDRA_logger").info(f"Historical data pacing: waiting {delay:.1f}s for {contract.localSymbol or contract.symbol}")
+            self.waited += delay
+            await asyncio.sleep(delay)
+        self.sent.append(now)
+        self.sent_by_contract.setdefault(contract_key, deque()).append(now)
+        self.sent_by_request[request_key] = now
+        self.requests += 1
+
+    def _delay(self, now, contract_key, request_key):
+        while self.sent and now - self.sent[0] >= self.window:
+            self.sent.popleft()
+        for key, times in list(self.sent_by_contract.items()):
+            while times and now - times[0] >= self.burst_window:
+                times.popleft()
+            if not times:
+                del self.sent_by_contract[key]
+        self.sent_by_request = {k: t for k, t in self.sent_by_request.items() if now - t < self.identical_interval}
+        delay = 0.0
+        if request_key in self.sent_by_request:
+            delay = self.sent_by_request[request_key] + self.identical_interval - now
+        burst = self.sent_by_contract.get(contract_key, ())
+        if len(burst) >= self.burst_limit:
+            delay = max(delay, burst[-self.burst_limit] + self.burst_window - now)
+        if len(self.sent) >= self.window_limit:
+            delay = max(delay, self.sent[-self.window_limit] + self.window - now)
+        return delay
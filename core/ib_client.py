@@ -1,92 +1,241 @@
+import asyncio
 import os
+import time
 
-from ib_async import Contract, Future, IB, util
-from core.event_manager import event_manager
+from ib_async import Contract, IB, util
+from core.account_store import AccountStore
+from core.bar_aggregator import BarAggregator
+from core.bar_cache import BarCache
+from core.clock import SyncedClock
+from core.connection_supervisor import ConnectionSupervisor
+from core.contract_cache import ContractCache
+from core.event_manager import CONFLATE, KEEP_ALL, event_manager
+from core.historical_scheduler import HistoricalScheduler
+from core.line_budget import LineBudgetManager
+from core.market_data_hub import MarketDataHub
+from core.metrics import metrics
+from core.order_manager import OrderManager
+from core.position_table import PositionTable
+from core.scanner import Scanner
+from core.tick_recorder import TickRecorder
+from core.trade_journal import TradeJournal
 
 
+# Nothing here touches the network: start_session() connects once the TUI is up
 util.patchAsyncio()
 ib = IB()
-ib.connect(os.getenv('IB_HOST'), os.getenv('IB_PORT'), clientId=0)
+metrics.instrument_ib(ib)
 
 state = {}
 
-# Contracts and Tickers
-state['assets'] = ['MESM5', 'MNQM5']
-contracts = {}
-for asset in state['assets']:
-    if asset.startswith(('MES', 'ES', 'MNQ', 'NQ', 'MYM', 'YM', 'M2K', 'RTY', 'CL', 'GC')):
-        contract = Future(localSymbol=asset, exchange='CME', currency='USD')
-        qualified = ib.qualifyContracts(contract)
-        contracts[asset] = qualified[0]
-    else:
-        raise Exception("Qualify asset class manually:")
-        # Fill manually
-        #contract = Stock(localSymbol=asset, exchange='', currency='USD')
-    qualified = ib.qualifyContracts(contract)
-    contracts[asset] = qualified[0]
-
-tickers = {}
-for c in contracts:
-    ib.reqMktData(contracts[c], '233', False, False, [])
-    # https://ib-insync.readthedocs.io/api.html#ib_insync.ib.IB.reqMktData
-    tickers[c] = ib.ticker(contracts[c])
-ib.sleep(1.0)
-
-# Positions
+# Clock: synced against IB on connect, then periodically in the background
+clock = SyncedClock(resync_interval=float(os.getenv('IB_CLOCK_SYNC_INTERVAL', 300)))
+state['clock'] = clock
+
+# Contracts and Tickers: the desk's own futures, by root; each follows its front month through rollovers
+state['assets'] = ['MES', 'MNQ']
+state['mes_last'] = state['mnq_last'] = float('nan')
+contracts = {}  # root -> current front-month Contract
+contract_cache = ContractCache(os.getenv('IB_CONTRACT_CACHE', './cache/contracts.json'))
+state['contract_cache'] = contract_cache
+
+# Bridge ib_async events onto the event bus; subscribers never touch ib directly.
+# Market data is conflated per contract, orders and fills are all kept.
+event_manager.configure('ticker', policy=CONFLATE)
+event_manager.configure('positions_diff', policy=KEEP_ALL)
+event_manager.configure('order', policy=KEEP_ALL)
+event_manager.configure('fill', policy=KEEP_ALL)
+event_manager.configure('signals', policy=CONFLATE)
+
+def publish_ticker(ticker):
+    metrics.mark('tickers', ib.wrapper.time)  # When the first not-yet-shown tick came off the socket
+    event_manager.publish('ticker', ticker, key=ticker.contract.conId)
+
+# Market data: one subscription per contract, shared with any bots given state['hub']
+# Bars backfill only what ./cache/bars lacks, paced to IB's historical data limits
+hub = MarketDataHub(ib, bar_cache=BarCache(os.getenv('IB_BAR_CACHE', './cache/bars')), scheduler=HistoricalScheduler(ib))
+state['hub'] = hub
+# Bars of any size built from the tick stream, for bots given state['aggregator']
+aggregator = BarAggregator(hub, clock=clock.timestamp)
+state['aggregator'] = aggregator
+# Crossovers across every scanned contract, one batched pass per bar close of the hub's shared bars; bots subscribe to 'signals'
+scanner = Scanner(hub, bar_size=os.getenv('HYDRA_SCAN_BAR_SIZE', '5 mins'), duration=os.getenv('HYDRA_SCAN_DURATION', '49500 S'),
+                  top_n=int(os.getenv('HYDRA_SCAN_TOP_N', 10)))
+state['scanner'] = scanner
+# Watched symbols: streamed within IB's market data lines, snapshot-polled beyond them
+lines = LineBudgetManager(hub, budget=int(os.getenv('IB_MARKET_DATA_LINES', 100)), generic_ticks='233',
+                          snapshot_interval=float(os.getenv('IB_SNAPSHOT_INTERVAL', 10)),
+                          snapshot_lines=int(os.getenv('IB_SNAPSHOT_LINES', 5)), contract_cache=contract_cache)
+state['lines'] = lines
+watches = {}  # root -> front-month Watch
+tickers = {}  # root -> Ticker, once it has data
+
+# Accounts: seeded on connect, then pushed by accountValueEvent/accountSummaryEvent
+accounts = AccountStore()
+state['accounts'] = accounts
+
+# Positions: rows kept sorted and updated from portfolio/position events
+positions = PositionTable()
+state['positions'] = positions
+
+# Orders: templates per qualified contract, risk-checked against a book kept from order/fill events
+orders = OrderManager(ib, max_position=float(os.getenv('IB_MAX_POSITION', 10)),
+                      max_notional=float(os.getenv('IB_MAX_NOTIONAL', 1_000_000)),
+                      max_orders_per_second=int(os.getenv('IB_MAX_ORDERS_PER_SECOND', 10)))
+state['orders'] = orders
+
+# Fills and commissions journaled to SQLite off the event loop; state['journal'].session has today's totals
+journal = TradeJournal(os.getenv('IB_TRADE_JOURNAL', './log/trades.db'), expected_price=orders.expected_price)
+state['journal'] = journal
+
+def mark_dirty(*keys):
+    """Tell listeners (the TUI) which parts of state changed."""
+    event_manager.publish('state_changed', keys)
+
+def on_position_diffs(diffs):
+    event_manager.publish('positions_diff', diffs)
+    mark_dirty('positions')
 
 def update_state():
+    """Fill state from ib's local caches (no sleeping, no server round-trips)."""
     try:
-        ib.sleep(0.1)
-        state['system_time'] = ib.reqCurrentTime()
-        state['account_summary'] = ib.accountSummary()
-        state['mes_last'] = tickers['MESM5'].last
-        state['mnq_last'] = tickers['MNQM5'].last
-        state['portfolio'] = ib.portfolio()
-        state['positions'] = ib.positions()
-        state['debug'] = populate_pos_data()
-        #populate_pos_data()
+        state['mes_last'] = last_price('MES')
+        state['mnq_last'] = last_price('MNQ')
+        for item in ib.portfolio():
+            positions.on_portfolio_item(item)
+        mark_dirty('tickers', 'positions')
     except RuntimeError as e:
         if "Event loop stopped before Future completed" in str(e):
             pass  # Event loop is already stopping, ignore this error.
         else:
             raise  # For any other runtime error, re-raise.
-    except ConnectionError as e:
-        if "Not connected" in str(e):
-            pass  # Keep retrying anyway
-        else:
-            raise
-
-ib.pendingTickersEvent += update_state
-
-def populate_pos_data():
-    pos = ib.portfolio()
-    data = []
-    current_owned = []
-    for p in pos:
-        row = []
-        row.append(p.contract.localSymbol)
-        current_owned.append(p.contract.localSymbol)
-        row.append(str(p.position))
-        row.append(str(round((p.averageCost / float(multiplier)), 2)))
-        row.append(str(round(p.marketPrice, 2)))
-        row.append(str(int(round(p.unrealizedPNL, 0))))
-        row.append(str(int(round(p.realizedPNL, 0))))
-        data.append(row)
-    for asset in state['assets']:
-        if asset not in current_owned:
-            data.append([asset, '0', '0.00', 'FIXME', '0', '0'])
-
-    # sort alphabetically, except the header
-    sorted_rows = sorted(data, key=lambda sublist: sublist[0])
-    pos_data = [['localSymbol', 'position', 'averageCost', 'marketPrice', 'unrealizedPNL', 'realizedPNL']]
-    for each_row in sorted_rows:
-        pos_data.append(each_row)
-    return pos_data
+
+# Tick recording: every tick on the connection, bots' included, goes to disk before conflation (set TICK_RECORD_DIR to enable)
+recorder = TickRecorder(os.getenv('TICK_RECORD_DIR')) if os.getenv('TICK_RECORD_DIR') else None
+
+def on_pending_tickers(pending):
+    for ticker in pending:
+        recorder.record_ticker(ticker)
+
+def on_order_status(trade):
+    event_manager.publish('order', trade)
+
+def on_exec_details(trade, fill):
+    event_manager.publish('fill', fill)
+
+def last_price(root):
+    ticker = tickers.get(root)
+    return ticker.last if ticker is not None else float('nan')
+
+def on_ticker(ticker):
+    t0 = metrics.now()
+    for root, watch in watches.items():
+        if watch.contract.conId == ticker.contract.conId:
+            tickers[root] = ticker
+    state['mes_last'] = last_price('MES')
+    state['mnq_last'] = last_price('MNQ')
+    mark_dirty('tickers')
+    metrics.since('update_state', t0)
+
+def on_roll(root, old_contract, new_contract):
+    """A desk symbol rolled to its next month: trade, book and scan the new contract from now on."""
+    contracts[root] = new_contract
+    tickers.pop(root, None)  # The old month's last price no longer applies
+    positions.add_contract(new_contract)
+    orders.add_contract(new_contract)
+    scanner.remove(old_contract)
+    asyncio.ensure_future(scanner.add_async([new_contract]))
+    mark_dirty('tickers', 'positions')
+
+def on_signals(signals):
+    event_manager.publish('signals', signals, key='top')
+    mark_dirty('scanner')
+
+def on_account_value(account_value):
+    mark_dirty('account')
+
+positions.listeners.append(on_position_diffs)
+scanner.listeners.append(on_signals)
+if recorder is not None:
+    ib.pendingTickersEvent += on_pending_tickers
+ib.orderStatusEvent += on_order_status
+ib.execDetailsEvent += on_exec_details
+ib.execDetailsEvent += journal.on_exec_details
+ib.commissionReportEvent += journal.on_commission_report
+journal.listeners.append(lambda journal: mark_dirty('journal'))
+event_manager.subscribe('ticker', on_ticker, priority=10)
+ib.accountValueEvent += accounts.on_account_value
+ib.accountSummaryEvent += accounts.on_account_value
+accounts.subscribe(['NetLiquidationByCurrency'], on_account_value)
+ib.updatePortfolioEvent += positions.on_portfolio_item
+ib.positionEvent += positions.on_position
+
+async def connect():
+    await ib.connectAsync(os.getenv('IB_HOST'), os.getenv('IB_PORT'), clientId=0)
+
+async def resync_session():
+    """After a reconnect: every hub subscription again, then account and portfolio state in one pass."""
+    await clock.resync(ib)
+    await hub.resubscribe()
+    accounts.load(await ib.accountSummaryAsync())
+    accounts.load(ib.accountValues())
+    positions.sync(ib.portfolio(), ib.positions())
+    orders.sync(ib.positions(), ib.openTrades())
+    journal.backfill(ib.fills(), ib.trades())  # Fills during the outage
+    update_state()
+    mark_dirty('clock', 'account')
+
+# Connection: retried with backoff, and restored with resync_session() whenever it drops
+supervisor = ConnectionSupervisor(ib, connect, resync_session, base_delay=float(os.getenv('IB_RECONNECT_DELAY', 1)),
+                                  max_delay=float(os.getenv('IB_RECONNECT_MAX_DELAY', 60)))
+supervisor.listeners.append(lambda supervisor: mark_dirty('connection'))
+state['connection'] = supervisor
+
+async def start_session():
+    """Connect (retrying until TWS answers), qualify (cached, one batch), subscribe and seed state. Returns the seconds it took."""
+    started = time.perf_counter()
+    await supervisor.connect()
+    await clock.resync(ib)
+    journal.open()
+    journal.backfill(ib.fills(), ib.trades())
+    # The desk's own symbols outrank bots'; the line manager rolls them before expiry
+    front_months = await asyncio.gather(*(lines.watch_front_month(
+        root, publish_ticker, priority=10, on_roll=lambda old, new, root=root: on_roll(root, old, new)) for root in state['assets']))
+    for root, watch in zip(state['assets'], front_months):
+        watches[root] = watch
+        contracts[root] = watch.contract
+        positions.add_contract(watch.contract)
+        orders.add_contract(watch.contract)
+    lines.start()
+    aggregator.start()
+    await scanner.add_async(contracts.values())
+    accounts.load(await ib.accountSummaryAsync())
+    accounts.load(ib.accountValues())
+    update_state()
+    clock.start(ib)
+    mark_dirty('clock', 'account', 'journal', 'scanner')
+    return time.perf_counter() - started
 
 def graceful_shutdown():
-        ib.pendingTickersEvent -= update_state
-        for c in contracts:
-            ib.cancelMktData(contracts[c])
+        supervisor.stop()
+        clock.stop()
+        ib.pendingTickersEvent -= on_pending_tickers
+        ib.orderStatusEvent -= on_order_status
+        ib.execDetailsEvent -= on_exec_details
+        ib.execDetailsEvent -= journal.on_exec_details
+        ib.commissionReportEvent -= journal.on_commission_report
+        ib.accountValueEvent -= accounts.on_account_value
+        ib.accountSummaryEvent -= accounts.on_account_value
+        ib.updatePortfolioEvent -= positions.on_portfolio_item
+        ib.positionEvent -= positions.on_position
+        orders.close()
+        lines.stop()
+        scanner.close()
+        aggregator.close()
+        hub.close()
         ib.sleep(0.5)
         ib.disconnect()
+        journal.close()
+        if recorder is not None:
+            recorder.close()
 
@@ -0,0 +1,98 @@
+import math
+
+
+NaN = float('nan')
+
+
+class StreamingEMA:
+    """Exponential moving average updated in O(1) per sample.
+
+    Matches talib.EMA: the first value is the SMA of the first `period`
+    samples, earlier outputs are NaN, and k = 2 / (period + 1).
+    peek() evaluates a still-forming sample without changing state; push()
+    commits a finished sample.
+    """
+    def __init__(self, period):
+        self.period = period
+        self.k = 2.0 / (period + 1)
+        self.count = 0
+        self.seed_sum = 0.0
+        self.value = NaN  # Last committed value
+
+    def peek(self, x):
+        if self.count >= self.period:
+            return self.value + self.k * (x - self.value)
+        if self.count + 1 == self.period:
+            return (self.seed_sum + x) / self.period
+        return NaN
+
+    def push(self, x):
+        self.value = self.peek(x)
+        if self.count < self.period:
+            self.seed_sum += x
+        self.count += 1
+        return self.value
+
+
+class StreamingMACD:
+    """MACD line, signal line and histogram built from three StreamingEMAs.
+
+    The signal EMA only starts once the MACD line exists, like talib.EMA
+    skipping the leading NaNs of its input.
+    """
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.ema_fast = StreamingEMA(fast)
+        self.ema_slow = StreamingEMA(slow)
+        self.ema_signal = StreamingEMA(signal)
+
+    def update(self, close, final=False):
+        """Return (macd, signal, histogram) for `close`; commit it when `final`."""
+        if final:
+            macd = self.ema_fast.push(close) - self.ema_slow.push(close)
+            signal = self.ema_signal.push(macd) if not math.isnan(macd) else NaN
+        else:
+            macd = self.ema_fast.peek(close) - self.ema_slow.peek(close)
+            signal = self.ema_signal.peek(macd) if not math.isnan(macd) else NaN
+        return macd, signal, macd - signal
+
+
+class IndicatorEngine:
+    """Per-contract MACD state that writes its output into a BarStore.
+
+    Seeded once from the historical backfill, then each update costs O(1):
+    the forming bar is evaluated with peek, and a bar is committed when
+    ib_async reports hasNewBar. Results land in the store's 'macd',
+    'signal' and 'hist' columns, next to the bar they belong to.
+    """
+    COLUMNS = ('macd', 'signal', 'hist')
+
+    def __init__(self, fast=12, slow=26, signal=9):
+        self.params = (fast, slow, signal)
+        self.macd = {}  # conId -> StreamingMACD
+
+    def seed(self, con_id, store, bars):
+        """Load the backfill into `store`, committing every bar but the forming one."""
+        self.macd[con_id] = StreamingMACD(*self.params)
+        for bar in bars[:-1]:
+            store.append_bar(bar)
+            self._write(store, self.macd[con_id].update(bar.close, final=True))
+        if bars:
+            store.append_bar(bars[-1])
+            self._write(store, self.macd[con_id].update(bars[-1].close))
+
+    def on_bar_update(self, con_id, store, bars, has_new_bar):
+        """Apply a keepUpToDate update to `store` in place."""
+        if con_id not in self.macd:
+            self.seed(con_id, store, bars)
+            return
+        if has_new_bar and len(bars) >= 2:
+            store.update_bar(bars[-2])  # The previously forming bar is now final
+            self._write(store, self.macd[con_id].update(bars[-2].close, final=True))
+            store.append_bar(bars[-1])
+        else:
+            store.update_bar(bars[-1])
+        self._write(store, self.macd[con_id].update(bars[-1].close))
+
+    def _write(self, store, values):
+        for name, value in zip(self.COLUMNS, values):
+            store.set_last(name, value)
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from ib_async import Future
+
+
+MAX_TICKERS_ERROR = 101  # "Max number of tickers has been reached"
+
+
+class Watch:
+    """One consumer's interest in a symbol. cancel() to stop watching."""
+    def __init__(self, manager, entry, consumer, priority, on_roll):
+        self.manager = manager
+        self.entry = entry
+        self.consumer = consumer
+        self.priority = priority
+        self.on_roll = on_roll  # on_roll(old_contract, new_contract) after a front-month roll
+
+    @property
+    def contract(self):
+        return self.entry.contract
+
+    @property
+    def streaming(self):
+        return self.entry.subscription is not None
+
+    def cancel(self):
+        self.manager.unwatch(self)
+
+
+class _Entry:
+    def __init__(self, contract):
+        self.contract = contract
+        self.watches = []
+        self.subscription = None  # MarketDataHub Subscription while streaming
+        self.roll = None  # (root, exchange, roll_days) for front-month watches
+
+    def demand(self):
+        return sum(watch.priority + 1 for watch in self.watches)
+
+
+class LineBudgetManager:
+    """Runtime watch list that stays within IB's concurrent market data lines.
+
+    Symbols are ranked by demand, the summed priorities of their watchers.
+    The top ones stream through the MarketDataHub within `budget` lines,
+    counting lines other hub users hold; the rest are polled with snapshots
+    every `snapshot_interval` seconds. A snapshot holds a line while it's in
+    flight, so `snapshot_lines` of the budget are kept off streaming whenever
+    some symbols have to be polled, and batches never exceed the free lines. Front-month futures watched by root
+    roll to the next contract `roll_days` before expiry; with a
+    `contract_cache` (core.contract_cache.ContractCache) the front month is
+    only looked up at IB when the cached one is about to expire. An IB "max
+    tickers" error lowers the budget to what the account actually allows.
+    """
+    def __init__(self, hub, budget=100, generic_ticks='', snapshot_interval=10.0, snapshot_batch=50, snapshot_lines=5,
+                 roll_check_interval=3600.0, contract_cache=None):
+        self.hub = hub
+        self.ib = hub.ib
+        self.budget = budget
+        self.generic_ticks = generic_ticks
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_batch = snapshot_batch  # Most snapshot requests in flight at once
+        self.snapshot_lines = snapshot_lines  # Lines reserved for snapshots while not everything streams
+        self.roll_check_interval = roll_check_interval
+        self.contract_cache = contract_cache
+        self.entries = {}  # conId -> _Entry
+        self._task = None
+        self._last_roll_check = 0.0
+        self.ib.errorEvent += self.on_error
+
+    def watch(self, contract, consumer, priority=0, on_roll=None):
+        """Watch a qualified contract; consumer(ticker) on every update, streamed or snapshot."""
+        entry = self.entries.get(contract.conId)
+        if entry is None:
+            entry = self.entries[contract.conId] = _Entry(contract)
+        watch = Watch(self, entry, consumer, priority, on_roll)
+        entry.watches.append(watch)
+        self.rebalance()
+        return watch
+
+    async def watch_front_month(self, root, consumer, priority=0, exchange='CME', roll_days=8, on_roll=None):
+        """Watch the front-month future of `root`, rolling automatically `roll_days` before expiry."""
+        contract = await self._front_month(root, exchange, roll_days)
+        watch = self.watch(contract, consumer, priority, on_roll)
+        watch.entry.roll = (root, exchange, roll_days)
+        return watch
+
+    def unwatch(self, watch):
+        entry = watch.entry
+        if watch not in entry.watches:
+            return
+        entry.watches.remove(watch)
+        if not entry.watches:
+            self._stop_streaming(entry)
+            del self.entries[entry.contract.conId]
+        self.rebalance()
+
+    def set_priority(self, watch, priority):
+        watch.priority = priority
+        self.rebalance()
+
+    def lines_in_use(self):
+        """Streaming lines held through the hub, by anyone."""
+        return sum(1 for key in self.hub.consumers if key[0] in ('mkt_data', 'tick_by_tick'))
+
+    def stats(self):
+        streaming = sum(1 for entry in self.entries.values() if entry.subscription is not None)
+        return {
+            'budget': self.budget,
+            'lines_in_use': self.lines_in_use(),
+            'streaming': streaming,
+            'snapshot': len(self.entries) - streaming,
+        }
+
+    def rebalance(self):
+        """Stream the highest-demand symbols that fit; current streams win ties, so nothing flaps."""
+        own = sum(1 for entry in self.entries.values() if entry.subscription is not None)
+        free = max(0, self.budget - (self.lines_in_use() - own))
+        if len(self.entries) > free:
+            free = max(0, free - self.snapshot_lines)  # Leave room to poll the rest
+        ranked = sorted(self.entries.values(), key=lambda e: (-e.demand(), e.subscription is None, e.contract.conId))
+        for entry in ranked[free:]:
+            self._stop_streaming(entry)  # Demote first, so promotions never overshoot
+        for entry in ranked[:free]:
+            if entry.subscription is None:
+                entry.subscription = self.hub.subscribe_mkt_data(
+                    entry.contract, lambda ticker, entry=entry: self._deliver(entry, ticker), generic_ticks=self.generic_ticks)
+
+    def start(self):
+        """Poll snapshots and check for rolls in the background on the running ib loop."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for entry in self.entries.values():
+            self._stop_streaming(entry)
+
+    def on_error(self, req_id, error_code, error_string, contract):
+        if error_code != MAX_TICKERS_ERROR or contract is None:
+            return
+        entry = self.entries.get(contract.conId)
+        if entry is None or entry.subscription is None:
+            return
+        self._stop_streaming(entry)
+        self.budget = self.lines_in_use()
+        logging.getLogger("HYDRA_logger").warning(f"IB market data line limit reached, budget lowered to {self.budget}")
+        self.rebalance()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            if not self.ib.isConnected():
+                continue
+            try:
+                await self._poll_snapshots()
+                if time.monotonic() - self._last_roll_check >= self.roll_check_interval:
+                    self._last_roll_check = time.monotonic()
+                    await self._check_rolls()
+            except (ConnectionError, asyncio.TimeoutError) as e:
+                logging.getLogger("HYDRA_logger").warning(f"Market data upkeep failed, retrying next interval: {e!r}")
+            except Exception:
+                logging.getLogger("HYDRA_logger").exception("Market data upkeep failed, retrying next interval")
+
+    async def _poll_snapshots(self):
+        entries = [entry for entry in self.entries.values() if entry.subscription is None]
+        while entries:
+            size = min(self.snapshot_batch, self.budget - self.lines_in_use())  # Streams may have changed while we waited
+            if size <= 0:
+                logging.getLogger("HYDRA_logger").debug(f"No market data lines free for {len(entries)} snapshots, next interval")
+                return
+            batch, entries = entries[:size], entries[size:]
+            tickers = await self.ib.reqTickersAsync(*[entry.contract for entry in batch])
+            for entry, ticker in zip(batch, tickers):
+                if entry.subscription is None:  # Promoted to streaming while we waited
+                    self._deliver(entry, ticker)
+
+    async def _check_rolls(self):
+        today = datetime.now()
+        for entry in list(self.entries.values()):
+            if entry.roll is None:
+                continue
+            root, exchange, roll_days = entry.roll
+            expiry = datetime.strptime(entry.contract.lastTradeDateOrContractMonth[:8], '%Y%m%d')
+            if (expiry - today).days > roll_days:
+                continue
+            new_contract = await self._front_month(root, exchange, roll_days)
+            if new_contract.conId != entry.contract.conId:
+                self._roll(entry, new_contract)
+
+    def _roll(self, entry, new_contract):
+        old_contract = entry.contract
+        self._stop_streaming(entry)
+        del self.entries[old_contract.conId]
+        new_entry = self.entries.get(new_contract.conId)
+        if new_entry is None:
+            new_entry = self.entries[new_contract.conId] = _Entry(new_contract)
+        new_entry.roll = entry.roll
+        for watch in entry.watches:
+            watch.entry = new_entry
+            new_entry.watches.append(watch)
+        self.rebalance()
+        logging.getLogger("HYDRA_logger").info(f"Rolled {old_contract.localSymbol} to {new_contract.localSymbol}")
+        for watch in new_entry.watches:
+            if watch.on_roll is not None:
+                watch.on_roll(old_contract, new_contract)
+
+    async def _front_month(self, root, exchange, roll_days):
+        """The `root` future expiring first after `roll_days` from now; the cached one while it still is."""
+        cutoff = (datetime.now() + timedelta(days=roll_days)).strftime('%Y%m%d')
+        key = f"FRONT:{root}:{exchange}"
+        if self.contract_cache is not None:
+            cached = self.contract_cache.get(key)
+            if cached is not None and cached.lastTradeDateOrContractMonth[:8] > cutoff:
+                self.contract_cache.hits += 1
+                return cached
+            self.contract_cache.misses += 1
+        details = await self.ib.reqContractDetailsAsync(Future(symbol=root, exchange=exchange))
+        candidates = sorted((d.contract for d in details if d.contract.lastTradeDateOrContractMonth[:8] > cutoff),
+                            key=lambda c: c.lastTradeDateOrContractMonth)
+        if not candidates:
+            raise LookupError(f"No {root} future on {exchange} expires after {cutoff}")
+        if self.contract_cache is not None:
+            self.contract_cache.put(key, candidates[0])
+            self.contract_cache.save()
+        return candidates[0]
+
+    def _deliver(self, entry, ticker):
+        for watch in list(entry.watches):
+            try:
+                watch.consumer(ticker)
+            except Exception:
+                logging.getLogger("HYDRA_logger").exception(f"Market data consumer {watch.consumer!r} failed on {entry.contract.localSymbol}")
+
+    def _stop_streaming(self, entry):
+        if entry.subscription is not None:
+            entry.subscription.cancel()
+            entry.subscription = None
@@ -1,10 +1,19 @@
+import atexit
+import copy
 import logging
+import multiprocessing
 import os
+import queue
 import sys
+import threading
 from datetime import datetime
-from logging.handlers import SMTPHandler
+from logging.handlers import QueueHandler
 from zoneinfo import ZoneInfo
 
+from core.alerts import AlertDispatcher, AlertHandler
+from core.console_buffer import ConsoleBuffer
+from core.event_manager import event_manager
+
 
 class Logger:
     """Custom HYDRA logger with: system, email, trade, and streaming handlers."""
@@ -39,51 +48,59 @@ class Logger:
         except Exception as e:
             self.print_and_exit(f"Couldn't set formatter: {e}")
 
-        # Setup Handlers
-        self.file_handler = self.setup_file_handler()
+        # Setup Handlers. File, trade and email output happens on a background writer
+        # thread; the event loop only enqueues records (and feeds the in-memory console).
         self.email_handler = self.setup_email_handler()
-        self.trade_handler = self.setup_trade_handler()
+        self.writer = self.setup_writer()
+        self.queue_handler = self.setup_queue_handler()
         self.console_handler = self.setup_console_handler(console_height)
 
         # Add Handlers to Logger
         try:
-            self.logger.addHandler(self.file_handler)
-            self.logger.addHandler(self.email_handler)
-            self.logger.addHandler(self.trade_handler)
+            self.logger.addHandler(self.queue_handler)
             self.logger.addHandler(self.console_handler)
         except Exception as e:
             self.print_and_exit(f"Failed to add handlers to logger: {e}")
+        atexit.register(self.writer.stop)
 
-    def setup_file_handler(self):
-        """Sets up the FileHandler for system logs with a custom emit method."""
+    def setup_writer(self):
+        """Starts the background thread that appends system and trade logs in batches."""
         try:
-            file_handler = logging.FileHandler("./log/hydra.log", encoding="utf-8")
-            file_handler.setLevel(logging.INFO)
-            file_handler.setFormatter(self.formatter)
-            def emit(record):
-                self.file_handler_emit(record)
-            file_handler.emit = emit
-            return file_handler
+            writer = LogWriter(
+                formatter=self.formatter,
+                system_path="./log/hydra.log",
+                max_bytes=int(os.getenv("LOG_MAX_BYTES", 256 * 1024)),
+                email_handler=self.email_handler,
+                on_failure=self.report_to_console,
+            )
+            writer.start()
+            return writer
         except Exception as e:
-            self.print_and_exit(f"Failed to set up file handler: {e}")
+            self.print_and_exit(f"Failed to set up log writer: {e}")
 
-    def file_handler_emit(self, record):
-        """Custom emit method for file_handler to write logs and trim file size."""
+    def setup_queue_handler(self):
+        """Sets up the QueueHandler that hands INFO and above to the writer thread."""
         try:
-            log_entry = self.formatter.format(record)
-            with open("./log/hydra.log", "a", encoding="utf-8") as f:
-                f.write(log_entry + "\n")
-            # Trim the log file to the last 300 lines
-            with open("./log/hydra.log", "r", encoding="utf-8") as f:
-                lines = f.readlines()
-            if len(lines) > 500:
-                with open("./log/hydra.log", "w", encoding="utf-8") as f:
-                    f.writelines(lines[-500:])
+            queue_handler = QueueHandler(self.writer.queue)
+            queue_handler.setLevel(logging.INFO)
+            queue_handler.prepare = self.queue_handler_prepare
+            return queue_handler
         except Exception as e:
-            self.print_and_exit(f"Failed to write to hydra.log: {e}")
+            self.print_and_exit(f"Failed to set up queue handler: {e}")
+
+    def queue_handler_prepare(self, record):
+        """Custom prepare for queue_handler: freeze the message, leave formatting to the writer."""
+        record = copy.copy(record)  # The console handler still gets the original
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self.formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
     def setup_email_handler(self):
-        """Sets up the SMTPHandler for sending error emails."""
+        """Sets up the AlertHandler that batches critical emails on a background dispatcher."""
         try:
             email_host = os.getenv("EMAIL_HOST")
             email_port = os.getenv("EMAIL_PORT")
@@ -96,48 +113,28 @@ class Logger:
             if not all([email_host, email_port, email_from, email_to, email_subject, email_user, email_password]):
                 self.print_and_exit("Missing one or more environment variables for the email handler.")
 
-            email_handler = SMTPHandler(
-                mailhost=(email_host, int(email_port)),
+            self.alert_dispatcher = AlertDispatcher(
+                host=email_host,
+                port=int(email_port),
                 fromaddr=email_from,
                 toaddrs=[email_to],
                 subject=email_subject,
                 credentials=(email_user, email_password),
-                secure=()
+                secure=(),
+                window=float(os.getenv("EMAIL_DIGEST_WINDOW", 60)),
             )
-            email_handler.setLevel(logging.CRITICAL)
+            self.alert_dispatcher.start()
+            atexit.register(self.alert_dispatcher.stop)  # Registered first so it runs after the writer flushes
+            email_handler = AlertHandler(self.alert_dispatcher, level=logging.CRITICAL)
             email_handler.setFormatter(self.formatter)
             return email_handler
         except Exception as e:
             self.print_and_exit(f"Failed to set up email handler: {e}")
 
-    def setup_trade_handler(self):
-        """Sets up the TradeHandler for trade-specific logs with a custom emit method."""
-        try:
-            trade_handler = logging.FileHandler("./log/.gitkeep", encoding="utf-8")
-            trade_handler.setLevel(logging.WARNING)
-            trade_handler.setFormatter(self.formatter)
-            trade_handler.addFilter(self.warning_only_filter)
-            def emit(record):
-                self.trade_handler_emit(record)
-            trade_handler.emit = emit
-            return trade_handler
-        except Exception as e:
-            self.print_and_exit(f"Failed to set up trade handler: {e}")
-
-    def trade_handler_emit(self, record):
-        """Custom emit method for trade_handler to write trade-specific logs."""
-        try:
-            dt = datetime.fromtimestamp(record.created, ZoneInfo("America/New_York"))
-            filename = f"./log/trades{dt.year}.log"
-            with open(filename, "a", encoding="utf-8") as f:
-                f.write(self.formatter.format(record) + "\n")
-        except Exception as e:
-            self.print_and_exit(f"Failed to emit trade message: {e}")
-
     def setup_console_handler(self, console_height):
         """Sets up the ConsoleHandler to capture log messages for TUI with a custom emit method."""
         self.console_height = console_height
-        self.console_messages = []
+        self.console = ConsoleBuffer(self.formatter, capacity=int(os.getenv("CONSOLE_HISTORY", 100_000)))
         try:
             console_handler = logging.StreamHandler()
             console_handler.setLevel(logging.DEBUG)
@@ -151,23 +148,20 @@ class Logger:
             self.print_and_exit(f"Failed to set up console handler: {e}")
 
     def console_handler_emit(self, record):
-        """Custom emit method for console_handler to capture log messages for TUI."""
+        """Custom emit method for console_handler: keep the record for the TUI, formatted only if it's shown."""
         try:
-            log_entry = self.formatter.format(record)
-            if len(self.console_messages) > self.console_height:
-                self.console_messages.pop(0)
-            #self.original_streamhandler_emit(record)
-            self.console_messages.append(log_entry)
+            self.console.append(record)
+            event_manager.publish('state_changed', ('console',))
         except Exception as e:
             self.print_and_exit(f"Failed to capture log message: {e}")
 
-    def get_console_messages(self):
-        """Allow outside app to access self.console_messages."""
-        return self.console_messages
+    def report_to_console(self, level, message):
+        """Show a message in the TUI console only, e.g. the writer's own failures, which must not go back through its queue."""
+        self.console_handler.handle(self.logger.makeRecord(self.logger.name, level, __file__, 0, message, None, None))
 
-    def warning_only_filter(self, record):
-        """Helper ilter to allow ONLY warning level logs."""
-        return record.levelno == logging.WARNING
+    def get_console_messages(self):
+        """The newest console_height console lines, formatted."""
+        return self.console.tail(self.console_height)
 
     def OnIBErrorEvent(self, reqId: int, errorCode: int, errorString: str, Contract):
         self.logger.error(f"(TWS) reqId({reqId}) errorCode({errorCode}) {errorString}. Contract:{Contract}")
@@ -180,5 +174,117 @@ class Logger:
         sys.exit(1)
 
 
-logger = Logger(console_height=7)
+class LogWriter(threading.Thread):
+    """Drain queued log records on a background thread and append them in batches.
+
+    System logs go to a size-bounded file rotated by renaming (never re-read),
+    WARNING records go to the yearly trade file, and CRITICAL records go to the
+    email handler, all off the event loop. File handles stay open between batches.
+    A batch that fails to write is dropped and counted, and the queue keeps
+    draining; `on_failure(level, message)` hears once when writes start
+    failing and once when they recover.
+    """
+    _STOP = object()
+
+    def __init__(self, formatter, system_path, max_bytes, email_handler=None, batch_size=512, on_failure=None):
+        super().__init__(name="hydra-log-writer", daemon=True)
+        self.queue = queue.SimpleQueue()
+        self.formatter = formatter
+        self.system_path = system_path
+        self.max_bytes = max_bytes
+        self.email_handler = email_handler
+        self.batch_size = batch_size
+        self.on_failure = on_failure
+        self.dropped = 0  # Records lost to failed writes
+        self.failing = False
+        self.system_file = open(system_path, "a", encoding="utf-8")
+        self.system_size = self.system_file.tell()
+        self.trade_files = {}  # year -> open file
+
+    def stop(self):
+        """Flush everything queued so far and close the files."""
+        if self.is_alive():
+            self.queue.put(self._STOP)
+            self.join()
+
+    def run(self):
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if self._STOP in batch:
+                running = False
+                batch = [record for record in batch if record is not self._STOP]
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                if not self.failing:
+                    self.failing = True
+                    self._report(logging.ERROR, f"Failed to write logs, dropping them until writes succeed: {e!r}")
+                continue
+            if self.failing:
+                self.failing = False
+                self._report(logging.WARNING, f"Log writes recovered; {self.dropped} records dropped so far")
+        self.system_file.close()
+        for f in self.trade_files.values():
+            f.close()
+
+    def write_batch(self, batch):
+        system_lines = []
+        trade_lines = {}
+        for record in batch:
+            entry = self.formatter.format(record) + "\n"
+            system_lines.append(entry)
+            if record.levelno == logging.WARNING:
+                year = datetime.fromtimestamp(record.created, ZoneInfo("America/New_York")).year
+                trade_lines.setdefault(year, []).append(entry)
+            if self.email_handler and record.levelno >= self.email_handler.level:
+                self.email_handler.handle(record)
+        self.write_system("".join(system_lines))
+        for year, lines in trade_lines.items():
+            f = self.trade_files.get(year)
+            if f is None:
+                f = self.trade_files[year] = open(f"./log/trades{year}.log", "a", encoding="utf-8")
+            f.write("".join(lines))
+            f.flush()
+
+    def write_system(self, text):
+        if self.system_file.closed:  # A rotation failed halfway
+            self.system_file = open(self.system_path, "a", encoding="utf-8")
+            self.system_size = self.system_file.tell()
+        if self.system_size + len(text) > self.max_bytes and self.system_size > 0:
+            self.system_file.close()
+            os.replace(self.system_path, self.system_path + ".1")
+            self.system_file = open(self.system_path, "a", encoding="utf-8")
+            self.system_size = 0
+        self.system_file.write(text)
+        self.system_file.flush()
+        self.system_size += len(text)
+
+    def _report(self, level, message):
+        if self.on_failure is not None:
+            try:
+                self.on_failure(level, message)
+            except Exception:
+                pass  # Nowhere left to report to; keep draining
+
+
+class WorkerLogger:
+    """The logger of a child process (core.bot_runner workers, core.replay pools): no files, console or email of
+    its own, so only the parent writes and rotates ./log and sends alerts. The worker installs a handler that
+    forwards records to the parent.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger("HYDRA_logger")
+        self.logger.setLevel(logging.DEBUG)
+
+    OnIBErrorEvent = Logger.OnIBErrorEvent
+
+
+logger = Logger(console_height=7) if multiprocessing.parent_process() is None else WorkerLogger()
 log = logger.logger
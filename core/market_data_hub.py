@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import time
+
+from ib_async import util
+
+from core.bar_cache import duration_seconds
+from core.bar_store import _epoch
+
+
+class Subscription:
+    """One consumer's interest in a shared IB subscription. cancel() to leave."""
+    def __init__(self, hub, key, consumer, filter, on_reseed=None):
+        self.hub = hub
+        self.key = key
+        self.consumer = consumer
+        self.filter = filter
+        self.on_reseed = on_reseed  # callback(bars) when completed bars were rewritten in place, for BarAggregator
+        self.active = True
+
+    @property
+    def ticker(self):
+        return self.hub.tickers.get(self.key)
+
+    @property
+    def bars(self):
+        return self.hub.bars.get(self.key)
+
+    def cancel(self):
+        self.hub.unsubscribe(self)
+
+
+class MarketDataHub:
+    """Reference-counted market data: one IB subscription per contract, fanned out to every consumer.
+
+    The first subscribe() for a (kind, conId, parameters) key makes the IB
+    request; later ones just join it. Tickers from pendingTickersEvent and
+    bar updates are decoded once and handed to each consumer whose `filter`
+    accepts them. The IB subscription is cancelled when its last consumer
+    leaves. A consumer raising doesn't stop delivery to the others.
+
+    With a `bar_cache` (core.bar_cache.BarCache), bar subscriptions only ask
+    IB for what the cache is missing; with a `scheduler`
+    (core.historical_scheduler.HistoricalScheduler) those requests are paced.
+    """
+    def __init__(self, ib, bar_history=2048, bar_cache=None, scheduler=None):
+        self.ib = ib
+        self.bar_history = bar_history  # Bars kept on shared BarDataLists, for consumers that join late
+        self.bar_cache = bar_cache
+        self.scheduler = scheduler
+        self._loading = {}  # bars key -> Task of a backfill in progress
+        self.tickers = {}  # key -> Ticker
+        self.bars = {}  # key -> BarDataList consumers hold
+        self._requests = {}  # key -> BarDataList IB keeps up to date: the same list until a reconnect reloads it
+        self.consumers = {}  # key -> [Subscription]
+        self._ticker_keys = {}  # conId -> keys with a Ticker
+        self.ib.pendingTickersEvent += self.on_pending_tickers
+
+    def subscribe_mkt_data(self, contract, consumer, filter=None, generic_ticks=''):
+        """consumer(ticker) on every update of reqMktData(contract, generic_ticks)."""
+        key = ('mkt_data', contract.conId, generic_ticks)
+        if key not in self.consumers:
+            self.tickers[key] = self.ib.reqMktData(contract, generic_ticks, False, False, [])
+            self._ticker_keys.setdefault(contract.conId, []).append(key)
+        return self._join(key, consumer, filter)
+
+    def subscribe_tick_by_tick(self, contract, consumer, filter=None, tick_type='Last'):
+        """consumer(ticker) on every update of reqTickByTickData(contract, tick_type)."""
+        key = ('tick_by_tick', contract.conId, tick_type)
+        if key not in self.consumers:
+            self.tickers[key] = self.ib.reqTickByTickData(contract, tick_type)
+            self._ticker_keys.setdefault(contract.conId, []).append(key)
+        return self._join(key, consumer, filter)
+
+    def subscribe_bars(self, contract, consumer, filter=None, bar_size='5 mins', duration='49500 S', what_to_show='TRADES', use_rth=False):
+        """consumer(bars, has_new_bar) on every keepUpToDate update of the shared BarDataList."""
+        key = ('bars', contract.conId, bar_size, what_to_show, use_rth)
+        if key not in self.consumers:
+            if self.bar_cache is None and self.scheduler is None:
+                bars = self.ib.reqHistoricalData(contract, endDateTime='', durationStr=duration, barSizeSetting=bar_size,
+                                                 whatToShow=what_to_show, useRTH=use_rth, formatDate=2, keepUpToDate=True)
+                self._add_bars(key, bars, duration)
+            else:
+                return util.run(self.subscribe_bars_async(contract, consumer, filter, bar_size, duration, what_to_show, use_rth))
+        return self._join(key, consumer, filter)
+
+    async def subscribe_bars_async(self, contract, consumer, filter=None, bar_size='5 mins', duration='49500 S', what_to_show='TRADES', use_rth=False):
+        """subscribe_bars() for coroutines; gather several to backfill them concurrently."""
+        key = ('bars', contract.conId, bar_size, what_to_show, use_rth)
+        if key not in self.bars:
+            if key not in self._loading:
+                self._loading[key] = asyncio.ensure_future(self._load_bars(key, contract, duration))
+            await asyncio.shield(self._loading[key])  # Joiners wait for the same backfill
+        return self._join(key, consumer, filter)
+
+    def unsubscribe(self, subscription):
+        consumers = self.consumers.get(subscription.key)
+        if not subscription.active or consumers is None:
+            return
+        subscription.active = False
+        consumers.remove(subscription)
+        if not consumers:
+            self._release(subscription.key)
+
+    async def resubscribe(self):
+        """Request every held subscription again after a reconnect (the new connection has none).
+
+        Consumers keep their Subscriptions; `subscription.ticker` points at the
+        new Ticker. Bar consumers keep their BarDataList: the bars missed while
+        disconnected are appended to it one at a time, with the usual updates,
+        as if the connection had never dropped. Bars backfill only the gap when cached.
+        """
+        reloads = []
+        for key in list(self.consumers):
+            kind = key[0]
+            if kind == 'mkt_data':
+                self.tickers[key] = self.ib.reqMktData(self.tickers[key].contract, key[2], False, False, [])
+            elif kind == 'tick_by_tick':
+                self.tickers[key] = self.ib.reqTickByTickData(self.tickers[key].contract, key[2])
+            else:
+                reloads.append(self._reload_bars(key))
+        await asyncio.gather(*reloads)
+        return len(self.consumers)
+
+    def subscription_count(self):
+        """IB subscriptions currently held, e.g. to compare against market data lines."""
+        return len(self.consumers)
+
+    def close(self):
+        """Cancel every IB subscription, write cached bars and stop listening."""
+        for key in list(self.consumers):
+            for subscription in self.consumers[key]:
+                subscription.active = False
+            self._release(key)
+        self.ib.pendingTickersEvent -= self.on_pending_tickers
+        if self.bar_cache is not None:
+            self.bar_cache.flush()
+
+    def on_pending_tickers(self, tickers):
+        for ticker in tickers:
+            for key in self._ticker_keys.get(ticker.contract.conId, ()):
+                self._fan_out(key, ticker)
+
+    def on_bar_update(self, key, bars, has_new_bar):
+        shared = self.bars[key]
+        if bars is not shared:  # IB's list since a reconnect: carry the update over to the one consumers hold
+            if has_new_bar and len(bars) >= 2 and shared:
+                shared[-1] = bars[-2]
+            if has_new_bar or not shared:
+                shared.append(bars[-1])
+            else:
+                shared[-1] = bars[-1]
+            if has_new_bar:
+                del bars[:-2]  # ib_async only looks at the last bar
+            bars = shared
+        if has_new_bar and self.bar_cache is not None and len(bars) >= 2:
+            self.bar_cache.store(key[1:], bars[-2:-1])  # The bar before the new one is complete
+        self._fan_out(key, bars, has_new_bar)
+        if has_new_bar and len(bars) > self.bar_history:
+            del bars[:-self.bar_history]  # Consumers keep their own history; this only bounds the shared list
+
+    async def history(self, contract, bar_size='5 mins', duration='49500 S', what_to_show='TRADES', use_rth=False, keep_up_to_date=False):
+        """Bars of the last `duration`, asking IB (paced) only for what the bar cache lacks. The last bar may still be forming."""
+        request = self.scheduler.request if self.scheduler is not None else self.ib.reqHistoricalDataAsync
+        series = (contract.conId, bar_size, what_to_show, use_rth)
+        missing = self.bar_cache.missing_duration(series, duration) if self.bar_cache is not None else duration
+        bars = await request(contract, endDateTime='', durationStr=missing, barSizeSetting=bar_size,
+                             whatToShow=what_to_show, useRTH=use_rth, formatDate=2, keepUpToDate=keep_up_to_date)
+        if self.bar_cache is not None:
+            self.bar_cache.store(series, bars[:-1])  # The last bar is still forming
+            self.bar_cache.flush(series)
+            end = _epoch(bars[0].date) if bars else None
+            bars[:0] = self.bar_cache.bars(series, start=time.time() - duration_seconds(duration), end=end)
+        return bars
+
+    async def _load_bars(self, key, contract, duration):
+        _, con_id, bar_size, what_to_show, use_rth = key
+        try:
+            bars = await self.history(contract, bar_size, duration, what_to_show, use_rth, keep_up_to_date=True)
+            self._add_bars(key, bars, duration)
+        finally:
+            del self._loading[key]
+
+    async def _reload_bars(self, key):
+        request = self._requests[key]
+        request.updateEvent -= request.hub_handler
+        _, con_id, bar_size, what_to_show, use_rth = key
+        bars = await self.history(request.contract, bar_size, request.hub_duration, what_to_show, use_rth, keep_up_to_date=True)
+        if key not in self.consumers:  # Everyone left while we waited
+            self.ib.cancelHistoricalData(bars)
+            return
+        self._add_bars(key, bars, request.hub_duration)
+        self._catch_up(key, bars)
+
+    def _catch_up(self, key, bars):
+        """Bring the consumers' list up to IB's reloaded `bars`, fanning out each bar it gained as a new bar."""
+        shared = self.bars[key]
+        changed = False
+        for bar in bars:
+            if shared and bar.date <= shared[-1].date:
+                if bar.date == shared[-1].date and bar != shared[-1]:
+                    shared[-1] = bar  # The bar that was forming at the disconnect, as IB finished it
+                    changed = True
+                continue
+            shared.append(bar)
+            self.on_bar_update(key, shared, True)
+            changed = False
+        if changed:
+            self.on_bar_update(key, shared, False)
+
+    def _add_bars(self, key, bars, duration):
+        bars.hub_duration = duration
+        bars.hub_handler = lambda bars, has_new_bar, key=key: self.on_bar_update(key, bars, has_new_bar)
+        bars.updateEvent += bars.hub_handler
+        self._requests[key] = bars
+        self.bars.setdefault(key, bars)
+
+    def _join(self, key, consumer, filter):
+        subscription = Subscription(self, key, consumer, filter)
+        self.consumers.setdefault(key, []).append(subscription)
+        return subscription
+
+    def _fan_out(self, key, *payload):
+        for subscription in list(self.consumers.get(key, ())):
+            try:
+                if subscription.filter is None or subscription.filter(*payload):
+                    subscription.consumer(*payload)
+            except Exception:
+                logging.getLogger("HYDRA_logger").exception(f"Market data consumer {subscription.consumer!r} failed on {key}")
+
+    def _release(self, key):
+        del self.consumers[key]
+        kind, con_id = key[0], key[1]
+        if kind == 'bars':
+            if self.bar_cache is not None:
+                self.bar_cache.flush(key[1:])
+            del self.bars[key]
+            bars = self._requests.pop(key)
+            bars.updateEvent -= bars.hub_handler
+            self.ib.cancelHistoricalData(bars)
+            return
+        ticker = self.tickers.pop(key)
+        self._ticker_keys[con_id].remove(key)
+        if not self._ticker_keys[con_id]:
+            del self._ticker_keys[con_id]
+        if kind == 'mkt_data':
+            self.ib.cancelMktData(ticker.contract)
+        else:
+            self.ib.cancelTickByTickData(ticker.contract, key[2])
@@ -0,0 +1,211 @@
+import json
+import os
+import time
+
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS  # Buckets per power of two: ~3% relative precision
+
+
+class Histogram:
+    """HDR-style log-linear histogram of integer values (nanoseconds here).
+
+    Values below 64 get a bucket each; above that, every power of two is split
+    into SUB_BUCKETS buckets, so precision is relative and memory is fixed.
+    Recording is a bit_length, a shift and a list increment.
+    """
+    def __init__(self, max_value=60_000_000_000):
+        self.counts = [0] * (_index(max_value) + 1)
+        self.last_index = len(self.counts) - 1
+        self.count = 0
+        self.total = 0
+        self.min = max_value
+        self.max = 0
+
+    def record(self, value):
+        value = int(value)
+        if value < 2 * SUB_BUCKETS:
+            index = value if value > 0 else 0
+        else:
+            shift = value.bit_length() - SUB_BUCKET_BITS - 1  # Inlined _index()
+            index = (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+            if index > self.last_index:
+                index = self.last_index
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value < self.min:
+            self.min = value
+
+    def percentile(self, p):
+        """Value at percentile `p` (0-100), accurate to the bucket width."""
+        if not self.count:
+            return 0
+        target = max(1, -(-self.count * p // 100))
+        seen = 0
+        for index, n in enumerate(self.counts):
+            seen += n
+            if seen >= target:
+                return min(_midpoint(index), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def buckets(self):
+        """Non-empty (bucket lower bound, count) pairs, for offline analysis."""
+        return [(_lower(index), n) for index, n in enumerate(self.counts) if n]
+
+
+class Metrics:
+    """Per-stage latency histograms for the tick-to-screen hot path.
+
+    Instrumented code does `t0 = metrics.now()` ... `metrics.since(stage, t0)`.
+    While disabled now() returns 0 and since() returns at once, so the cost
+    is two calls and no clock reads. Cross-stage latencies (tick received ->
+    on screen) use wall-clock marks, since ib_async stamps receive time with
+    time.time().
+    """
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.histograms = {}
+        self.marks = {}
+        self._claimed = 0  # ns recorded through since(), so an enclosing stage can leave it out
+        self._lag_handle = None
+
+    def now(self):
+        return time.perf_counter_ns() if self.enabled else 0
+
+    def since(self, stage, t0):
+        if t0:
+            ns = time.perf_counter_ns() - t0
+            self._claimed += ns
+            self.record(stage, ns)
+
+    def record(self, stage, ns):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = Histogram()
+        histogram.record(ns)
+
+    def mark(self, key, wall_time):
+        """Remember when something (e.g. the first unrendered tick) happened, unless already marked."""
+        if self.enabled and key not in self.marks:
+            self.marks[key] = wall_time
+
+    def take(self, key):
+        return self.marks.pop(key, None)
+
+    def record_since(self, stage, wall_time):
+        if wall_time is not None:
+            self.record(stage, (time.time() - wall_time) * 1_000_000_000)
+
+    def reset(self):
+        self.histograms.clear()
+        self.marks.clear()
+
+    def summary(self):
+        return {stage: {'count': h.count, 'min': h.min if h.count else 0, 'mean': h.mean(), 'p50': h.percentile(50), 'p90': h.percentile(90),
+                        'p99': h.percentile(99), 'p999': h.percentile(99.9), 'max': h.max}
+                for stage, h in self.histograms.items()}
+
+    def export(self, path):
+        """Write summaries and bucket counts (values in ns) as JSON."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        data = {'exported_at': time.time(), 'unit': 'ns', 'sub_buckets': SUB_BUCKETS, 'stages': self.summary(),
+                'buckets': {stage: h.buckets() for stage, h in self.histograms.items()}}
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=1)
+        return path
+
+    def instrument_ib(self, ib):
+        """Time ib_async's socket handler as 'socket' (splitting received bytes into messages) and 'decode' (one
+        message into wrapper state). The handlers they run are left to their own stages: pendingTickersEvent's
+        after each read, and those timed with since() inside the decoder (keepUpToDate bars, orders).
+        """
+        client = ib.client
+        original = client._onSocketHasData  # Private, but it's the one place every byte from TWS passes
+        interpret = client.decoder.interpret
+        processed = client._tcpDataProcessed
+        inner = [0]  # ns of the current read spent decoding or in the post-read handlers
+
+        def on_socket_has_data(data):
+            t0 = self.now()
+            if not t0:
+                return original(data)
+            inner[0] = 0
+            original(data)
+            self.record('socket', time.perf_counter_ns() - t0 - inner[0])
+
+        def timed_interpret(fields):
+            t0 = self.now()
+            if not t0:
+                return interpret(fields)
+            claimed = self._claimed
+            interpret(fields)
+            elapsed = time.perf_counter_ns() - t0
+            inner[0] += elapsed
+            self.record('decode', elapsed - (self._claimed - claimed))
+
+        def timed_processed():
+            t0 = self.now()
+            processed()
+            if t0:
+                inner[0] += time.perf_counter_ns() - t0
+
+        client.conn.hasData -= original
+        client.conn.hasData += on_socket_has_data
+        client.decoder.interpret = timed_interpret
+        if processed is not None:
+            client._tcpDataProcessed = timed_processed
+
+    def start_loop_monitor(self, loop, interval=0.1):
+        """Record how late the event loop runs a callback scheduled `interval` ahead ('loop_lag')."""
+        def check(expected):
+            if self.enabled:
+                self.record('loop_lag', max(0.0, loop.time() - expected) * 1_000_000_000)
+            self._lag_handle = loop.call_later(interval, check, loop.time() + interval)
+
+        if self._lag_handle is None:
+            self._lag_handle = loop.call_later(interval, check, loop.time() + interval)
+
+    def stop_loop_monitor(self):
+        if self._lag_handle is not None:
+            self._lag_handle.cancel()
+            self._lag_handle = None
+
+
+def format_ns(ns):
+    if ns >= 1_000_000_000:
+        return f"{ns / 1_000_000_000:.2f}s"
+    if ns >= 1_000_000:
+        return f"{ns / 1_000_000:.2f}ms"
+    return f"{ns / 1_000:.1f}us"
+
+
+def _index(value):
+    if value < 2 * SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS - 1  # value >> shift is in [SUB_BUCKETS, 2 * SUB_BUCKETS)
+    return (shift + 1) * SUB_BUCKETS + (value >> shift) - SUB_BUCKETS
+
+
+def _lower(index):
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return (index % SUB_BUCKETS + SUB_BUCKETS) << shift
+
+
+def _midpoint(index):
+    if index < 2 * SUB_BUCKETS:
+        return index
+    shift = index // SUB_BUCKETS - 1
+    return _lower(index) + ((1 << shift) - 1) // 2
+
+
+metrics = Metrics(enabled=os.getenv('HYDRA_METRICS') == '1')
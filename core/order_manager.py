@@ -0,0 +1,286 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+
+from ib_async import Order, OrderStatus, Trade, TradeLogEntry
+
+from core.metrics import metrics
+
+
+BUY, SELL = 'BUY', 'SELL'
+SIDES = {BUY: 1, SELL: -1}
+
+
+class OrderRejected(Exception):
+    """A pre-trade risk check failed; nothing was sent to IB."""
+
+
+class _Template:
+    """Everything about a contract an order needs, prepared before the market gets fast."""
+    def __init__(self, contract, multiplier, max_position, max_notional, fields):
+        self.contract = contract
+        self.multiplier = multiplier
+        self.max_position = max_position
+        self.max_notional = max_notional
+        self.orders = {}  # (action, orderType) -> Order to copy
+        for action in SIDES:
+            for order_type in ('MKT', 'LMT', 'STP', 'STP LMT'):
+                self.orders[action, order_type] = Order(action=action, orderType=order_type, **fields)
+
+    def order(self, action, order_type, quantity):
+        # A dataclass copy without running Order.__init__'s ~150 field defaults (~3us instead of ~20us).
+        # List fields are shared with the template; ib_async only reads them.
+        order = object.__new__(Order)
+        order.__dict__.update(self.orders[action, order_type].__dict__)
+        order.totalQuantity = quantity
+        return order
+
+
+class _Working:
+    __slots__ = ('con_id', 'side', 'remaining', 'exposure')
+
+    def __init__(self, con_id, side, remaining, exposure):
+        self.con_id = con_id
+        self.side = side
+        self.remaining = remaining
+        self.exposure = exposure  # False for bracket children: they only ever reduce the position
+
+
+class OrderManager:
+    """Order entry for the desk and its bots, with constant-time pre-trade risk checks.
+
+    add_contract() prepares an Order per side and type for a qualified
+    contract, so placing one is a dict copy, a few arithmetic checks against
+    the in-memory book and the placeOrder message (~0.1ms). The book (signed position and
+    working buy/sell quantity per contract) follows ib_async's order status,
+    fill and position events. A check that fails raises OrderRejected.
+
+    Limits, per contract: |position + working same-side quantity + order| <=
+    max_position, and that many contracts at the order's price <= max_notional.
+    Across contracts: at most max_orders_per_second orders in any second.
+
+    Pass `decided=metrics.now()` from the strategy to time decision ->
+    placeOrder as the 'order' stage; otherwise it is timed from the call.
+    """
+    def __init__(self, ib, max_position=10, max_notional=1_000_000.0, max_orders_per_second=10, order_fields=None):
+        self.ib = ib
+        self.max_position = max_position
+        self.max_notional = max_notional
+        self.max_orders_per_second = max_orders_per_second
+        self.order_fields = order_fields or {'tif': 'DAY'}  # Set on every order, e.g. account
+        self.templates = {}  # conId -> _Template
+        self.positions = {}  # conId -> signed position
+        self.working = {}  # conId -> [buy quantity, sell quantity] still working
+        self.orders = {}  # orderId -> _Working
+        self.ref_prices = {}  # orderId -> price the risk check used, the baseline for slippage
+        self.rejected = 0
+        self._sent = deque(maxlen=max_orders_per_second)  # perf_counter() of the latest orders
+        self._oca_groups = 0
+        ib.orderStatusEvent += self.on_order_status
+        ib.execDetailsEvent += self.on_exec_details
+        ib.positionEvent += self.on_position
+
+    def close(self):
+        self.ib.orderStatusEvent -= self.on_order_status
+        self.ib.execDetailsEvent -= self.on_exec_details
+        self.ib.positionEvent -= self.on_position
+
+    def add_contract(self, contract, max_position=None, max_notional=None):
+        """Prepare order templates for a qualified contract; limits default to the manager's."""
+        self.templates[contract.conId] = _Template(
+            contract, float(contract.multiplier or 1),
+            self.max_position if max_position is None else max_position,
+            self.max_notional if max_notional is None else max_notional, self.order_fields)
+        self.positions.setdefault(contract.conId, 0.0)
+        self.working.setdefault(contract.conId, [0.0, 0.0])
+
+    def order(self, contract, action, quantity, limit=None, stop=None, ref_price=None, decided=None, **fields):
+        """Place a market, limit (`limit`), stop (`stop`) or stop-limit order. Market orders need `ref_price` for the notional check."""
+        t0 = decided or metrics.now()
+        template = self._template(contract)
+        order = self._prepare(template, action, quantity, limit, stop, fields)
+        self._check(template, ((order, limit or stop or ref_price),))
+        trade = self._place(template, order, exposure=True, price=limit or stop or ref_price)
+        metrics.since('order', t0)
+        return trade
+
+    def bracket(self, contract, action, quantity, limit, take_profit, stop_loss, decided=None, **fields):
+        """Limit entry with a take-profit limit and a stop-loss, sent as one unit. Returns [entry, take profit, stop loss] trades."""
+        t0 = decided or metrics.now()
+        template = self._template(contract)
+        exit_action = SELL if action == BUY else BUY
+        parent = self._prepare(template, action, quantity, limit, None, fields)
+        take = self._prepare(template, exit_action, quantity, take_profit, None, fields)
+        stop = self._prepare(template, exit_action, quantity, None, stop_loss, fields)
+        self._check(template, ((parent, limit),), count=3)  # The exits only close what the entry opens
+        parent.orderId = self.ib.client.getReqId()
+        parent.transmit = take.transmit = False  # IB holds the legs until the last one arrives
+        take.parentId = stop.parentId = parent.orderId
+        trades = [self._place(template, parent, exposure=True, price=limit),
+                  self._place(template, take, exposure=False, price=take_profit),
+                  self._place(template, stop, exposure=False, price=stop_loss)]
+        metrics.since('order', t0)
+        return trades
+
+    def oco(self, contract, legs, oca_type=1, decided=None):
+        """One-cancels-all: `legs` are dicts of order() arguments (action, quantity, limit, stop, ref_price, fields).
+
+        oca_type 1 cancels the other legs on a fill; 2 and 3 reduce them (see IB's OCA docs).
+        Each leg is checked as if it were the only one working.
+        """
+        t0 = decided or metrics.now()
+        template = self._template(contract)
+        self._oca_groups += 1
+        group = f"oca-{contract.conId}-{time.time_ns()}-{self._oca_groups}"
+        orders = []
+        for leg in legs:
+            leg = dict(leg)
+            action, quantity = leg.pop('action'), leg.pop('quantity')
+            limit, stop, ref_price = leg.pop('limit', None), leg.pop('stop', None), leg.pop('ref_price', None)
+            order = self._prepare(template, action, quantity, limit, stop, leg)
+            order.ocaGroup, order.ocaType = group, oca_type
+            orders.append((order, limit or stop or ref_price))
+        self._check(template, orders, single=True)
+        trades = [self._place(template, order, exposure=True, price=price) for order, price in orders]
+        metrics.since('order', t0)
+        return trades
+
+    def cancel(self, trade):
+        self.ib.cancelOrder(trade.order)
+
+    async def cancel_all(self, contract=None, timeout=5.0):
+        """Cancel every working order (of `contract`, if given) and wait until IB confirms them done."""
+        trades = [trade for trade in self.ib.openTrades()
+                  if contract is None or trade.contract.conId == contract.conId]
+        for trade in trades:
+            self.ib.cancelOrder(trade.order)
+        await asyncio.wait_for(asyncio.gather(*(self.wait(trade) for trade in trades)), timeout)
+
+    async def wait(self, trade):
+        """Until the trade is filled, cancelled or rejected."""
+        while not trade.isDone():
+            await trade.statusEvent
+
+    def expected_price(self, trade):
+        """The price an order placed here was decided at (None for orders placed elsewhere)."""
+        return self.ref_prices.get(trade.order.orderId)
+
+    def position(self, contract):
+        return self.positions.get(contract.conId, 0.0)
+
+    def sync(self, positions, open_trades):
+        """Rebuild the book from IB's snapshots (after a reconnect)."""
+        for con_id in self.positions:
+            self.positions[con_id] = 0.0
+        for position in positions:
+            self.positions[position.contract.conId] = float(position.position)
+        for totals in self.working.values():
+            totals[0] = totals[1] = 0.0
+        self.orders.clear()
+        for trade in open_trades:
+            self.on_order_status(trade)
+
+    def on_order_status(self, trade):
+        status = trade.orderStatus
+        working = self.orders.get(trade.order.orderId)
+        if working is None:
+            if status.status in OrderStatus.DoneStates:
+                return
+            # Placed elsewhere (TWS, another client) or before a resync: it still counts against the limits
+            working = self._track(trade.contract.conId, trade.order, exposure=not trade.order.parentId)
+        remaining = 0.0 if status.status in OrderStatus.DoneStates else float(status.remaining)
+        if working.exposure:
+            self.working[working.con_id][working.side] += remaining - working.remaining
+        working.remaining = remaining
+        if not remaining:
+            del self.orders[trade.order.orderId]
+
+    def on_exec_details(self, trade, fill):
+        shares = float(fill.execution.shares)
+        con_id = fill.contract.conId
+        self.positions[con_id] = self.positions.get(con_id, 0.0) + (shares if fill.execution.side == 'BOT' else -shares)
+
+    def on_position(self, position):
+        self.positions[position.contract.conId] = float(position.position)  # IB's word over our sum of fills
+
+    def _template(self, contract):
+        template = self.templates.get(contract.conId)
+        if template is None:
+            self.add_contract(contract)  # Slow path, once per contract; add_contract() ahead of time avoids it
+            template = self.templates[contract.conId]
+        return template
+
+    def _prepare(self, template, action, quantity, limit, stop, fields):
+        if action not in SIDES or quantity <= 0:
+            raise OrderRejected(f"Bad order: {action} {quantity}")
+        if limit is not None:
+            order = template.order(action, 'STP LMT' if stop is not None else 'LMT', quantity)
+            order.lmtPrice = limit
+        else:
+            order = template.order(action, 'STP' if stop is not None else 'MKT', quantity)
+        if stop is not None:
+            order.auxPrice = stop
+        for name, value in fields.items():
+            setattr(order, name, value)
+        return order
+
+    def _check(self, template, orders, count=None, single=False):
+        """Risk-check (order, price) pairs about to go out together; `count` orders in all if more are sent unchecked."""
+        n = count or len(orders)
+        keep = self.max_orders_per_second - n + 1  # The last second may hold at most max - n orders already
+        if keep < 1 or (len(self._sent) >= keep and time.perf_counter() - self._sent[-keep] < 1.0):
+            self._reject(f"more than {self.max_orders_per_second} orders/s")
+        con_id = template.contract.conId
+        position = self.positions.get(con_id, 0.0)
+        working = self.working[con_id]
+        buys = sells = 0.0
+        for order, price in orders:
+            quantity = order.totalQuantity
+            if order.action == BUY:
+                worst = position + working[0] + buys + quantity
+            else:
+                worst = position - working[1] - sells - quantity
+            if abs(worst) > template.max_position:
+                self._reject(f"{order.action} {quantity} {template.contract.localSymbol}: position could reach {worst:g} (max {template.max_position:g})")
+            if price is None:
+                self._reject(f"{order.action} {quantity} {template.contract.localSymbol}: a market order needs ref_price")
+            notional = abs(worst) * price * template.multiplier
+            if notional > template.max_notional:
+                self._reject(f"{order.action} {quantity} {template.contract.localSymbol}: notional could reach {notional:,.0f} (max {template.max_notional:,.0f})")
+            if not single:
+                if order.action == BUY:
+                    buys += quantity
+                else:
+                    sells += quantity
+
+    def _reject(self, reason):
+        self.rejected += 1
+        logging.getLogger("HYDRA_logger").warning(f"Order rejected: {reason}")
+        raise OrderRejected(reason)
+
+    def _place(self, template, order, exposure, price):
+        # IB.placeOrder() for a new order, minus its info log line: that f-string formats the whole
+        # Trade (every Order field) on each call whatever the log level, about a third of the time here.
+        ib, wrapper = self.ib, self.ib.wrapper
+        self._sent.append(time.perf_counter())
+        order_id = order.orderId or ib.client.getReqId()
+        ib.client.placeOrder(order_id, template.contract, order)
+        order.clientId, order.orderId = wrapper.clientId, order_id
+        trade = Trade(template.contract, order, OrderStatus(orderId=order_id, status=OrderStatus.PendingSubmit), [],
+                      [TradeLogEntry(datetime.now(wrapper.defaultTimezone), OrderStatus.PendingSubmit)])
+        wrapper.trades[wrapper.orderKey(wrapper.clientId, order_id, order.permId)] = trade
+        self._track(template.contract.conId, order, exposure)
+        self.ref_prices[order_id] = price
+        ib.newOrderEvent.emit(trade)
+        return trade
+
+    def _track(self, con_id, order, exposure):
+        side = 0 if order.action == BUY else 1
+        working = self.orders[order.orderId] = _Working(con_id, side, 0.0, exposure)
+        totals = self.working.setdefault(con_id, [0.0, 0.0])
+        working.remaining = float(order.totalQuantity)
+        if exposure:
+            totals[side] += working.remaining
+        return working
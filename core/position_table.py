@@ -0,0 +1,112 @@
+import bisect
+
+
+COLUMNS = ('localSymbol', 'position', 'averageCost', 'marketPrice', 'unrealizedPNL', 'realizedPNL', 'account')
+
+
+class PositionTable:
+    """Position/PnL rows sorted by (localSymbol, account), driven by portfolio events.
+
+    Feed it from ib.updatePortfolioEvent and ib.positionEvent. Every update
+    formats only the affected row and tells listeners what changed as a list
+    of diffs:
+        ('insert', row, None, cells)   new row at index `row`
+        ('remove', row, None, None)    row at index `row` is gone
+        ('set', row, column, text)     one cell changed
+    Watched symbols without a position get a placeholder row.
+    """
+    def __init__(self):
+        self.keys = []  # Sorted (localSymbol, account)
+        self.rows = {}  # (localSymbol, account) -> list of cell texts
+        self.multipliers = {}  # conId -> float, from qualified contracts
+        self.watched = set()  # localSymbols that keep a placeholder row without a position
+        self.listeners = []  # callback(diffs)
+
+    def add_contract(self, contract, watch=True):
+        """Register a qualified contract's multiplier; show a placeholder row if `watch`."""
+        self.multipliers[contract.conId] = float(contract.multiplier or 1)
+        if watch:
+            self.watched.add(contract.localSymbol)
+        if watch and not self._owned(contract.localSymbol):
+            self._apply((contract.localSymbol, ''), self._placeholder(contract.localSymbol))
+
+    def on_portfolio_item(self, item):
+        multiplier = self._multiplier(item.contract)
+        self._own(item.contract.localSymbol, item.account, [
+            item.contract.localSymbol,
+            str(item.position),
+            str(round(item.averageCost / multiplier, 2)),
+            str(round(item.marketPrice, 2)),
+            str(int(round(item.unrealizedPNL, 0))),
+            str(int(round(item.realizedPNL, 0))),
+            item.account,
+        ])
+
+    def on_position(self, position):
+        """Position events carry no prices: only position and average cost are updated."""
+        key = (position.contract.localSymbol, position.account)
+        cells = list(self.rows.get(key) or self._placeholder(key[0], key[1]))
+        cells[1] = str(position.position)
+        cells[2] = str(round(position.avgCost / self._multiplier(position.contract), 2))
+        self._own(key[0], key[1], cells)
+
+    def sync(self, portfolio_items, positions=()):
+        """Apply full snapshots (e.g. after a reconnect) in one pass; rows neither mentions are gone."""
+        seen = set()
+        for item in portfolio_items:
+            self.on_portfolio_item(item)
+            seen.add((item.contract.localSymbol, item.account))
+        for position in positions:
+            if (position.contract.localSymbol, position.account) not in seen:
+                self.on_position(position)
+                seen.add((position.contract.localSymbol, position.account))
+        for key in [key for key in self.keys if key[1] and key not in seen]:
+            self._remove(key)
+            if key[0] in self.watched and not self._owned(key[0]) and (key[0], '') not in self.rows:
+                self._apply((key[0], ''), self._placeholder(key[0]))
+
+    def snapshot(self):
+        """All rows in display order, for a full redraw."""
+        return [self.rows[key] for key in self.keys]
+
+    def _own(self, local_symbol, account, cells):
+        self._apply((local_symbol, account), cells)
+        if (local_symbol, '') in self.rows and account:
+            self._remove((local_symbol, ''))  # A real position replaces the placeholder
+
+    def _apply(self, key, cells):
+        previous = self.rows.get(key)
+        if previous is None:
+            index = bisect.bisect_left(self.keys, key)
+            self.keys.insert(index, key)
+            self.rows[key] = cells
+            self._notify([('insert', index, None, list(cells))])
+            return
+        index = bisect.bisect_left(self.keys, key)
+        diffs = [('set', index, column, text)
+                 for column, (old, text) in enumerate(zip(previous, cells)) if old != text]
+        self.rows[key] = cells
+        if diffs:
+            self._notify(diffs)
+
+    def _remove(self, key):
+        index = bisect.bisect_left(self.keys, key)
+        del self.keys[index]
+        del self.rows[key]
+        self._notify([('remove', index, None, None)])
+
+    def _owned(self, local_symbol):
+        return any(symbol == local_symbol and account for symbol, account in self.keys)
+
+    def _multiplier(self, contract):
+        multiplier = self.multipliers.get(contract.conId)
+        if multiplier is None:
+            multiplier = self.multipliers[contract.conId] = float(contract.multiplier or 1)
+        return multiplier
+
+    def _placeholder(self, local_symbol, account=''):
+        return [local_symbol, '0', '0.00', '-', '0', '0', account]
+
+    def _notify(self, diffs):
+        for callback in self.listeners:
+            callback(diffs)
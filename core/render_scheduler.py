@@ -0,0 +1,60 @@
+import time
+
+from core.metrics import metrics
+
+
+class RenderScheduler:
+    """Coalesce widget redraws into frames capped at `max_fps`.
+
+    State changes call mark_dirty(key). At most one frame is pending at a time,
+    and a frame only runs the render callbacks whose keys are dirty, so nothing
+    is redrawn when nothing changed.
+    """
+    def __init__(self, loop, max_fps=30):
+        self.loop = loop  # urwid MainLoop
+        self.frame_interval = 1.0 / max_fps
+        self.renderers = {}
+        self.dirty = set()
+        self.paused = False
+        self._alarm = None
+        self._last_frame = 0.0
+
+    def register(self, key, render):
+        """Redraw with `render()` whenever `key` is marked dirty."""
+        self.renderers[key] = render
+        self.mark_dirty(key)
+
+    def mark_dirty(self, *keys):
+        self.dirty.update(keys)
+        self._schedule()
+
+    def mark_all_dirty(self):
+        self.mark_dirty(*self.renderers)
+
+    def pause(self):
+        self.paused = True
+        if self._alarm is not None:
+            self.loop.remove_alarm(self._alarm)
+            self._alarm = None
+
+    def resume(self):
+        self.paused = False
+        self.mark_all_dirty()
+
+    def _schedule(self):
+        if self.paused or self._alarm is not None or not self.dirty:
+            return
+        delay = max(0.0, self._last_frame + self.frame_interval - time.monotonic())
+        self._alarm = self.loop.set_alarm_in(delay, self._frame)
+
+    def _frame(self, loop=None, user_data=None):
+        self._alarm = None
+        self._last_frame = time.monotonic()
+        dirty, self.dirty = self.dirty, set()
+        t0 = metrics.now()
+        for key in dirty:
+            render = self.renderers.get(key)
+            if render is not None:
+                render()
+        metrics.since('render', t0)
+        self._schedule()  # Anything marked dirty while rendering goes in the next frame
@@ -0,0 +1,243 @@
+"""Replay recorded ticks through the same ib_async interfaces a live Bot uses.
+
+ReplayIB stands in for IB(): Bot subscribes with reqTickByTickData /
+reqHistoricalData(keepUpToDate=True) and gets pendingTickersEvent and bar
+updateEvent callbacks, driven by a simulated clock instead of TWS.
+
+    python core/replay.py ./ticks MESM5=495512552 --processes 4 --speed 0
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from functools import partial
+
+import numpy as np
+from eventkit import Event
+from ib_async import BarData, BarDataList, Contract, Ticker, TickAttribLast, TickByTickAllLast, TickData
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)  # Runnable as a script, and from any directory
+
+from core.bar_cache import bar_seconds
+from core.tick_recorder import TICK_BY_TICK, TICK_BY_TICK_ASK, TICK_BY_TICK_BID, TickReader
+
+
+LAST_TICK_TYPES = (4, 48, 68, TICK_BY_TICK + 1, TICK_BY_TICK + 2)  # Trades: LAST, RT volume, delayed last, tick-by-tick Last/AllLast
+
+
+class ReplayIB:
+    """Enough of ib_async.IB for Bot, fed from a TickReader on a simulated clock.
+
+    `speed` is a multiple of real time; 0 or None replays as fast as possible.
+    `symbols` maps localSymbol/symbol to the conId recorded in the segments.
+    """
+    CHUNK = 65536
+
+    def __init__(self, directory, symbols, start_ns=None, end_ns=None, speed=None):
+        self.directory = directory
+        self.symbols = symbols
+        self.start_ns = start_ns
+        self.end_ns = end_ns
+        self.speed = speed
+        self.now_ns = 0
+        self.ticks_replayed = 0
+        self.pendingTickersEvent = Event('pendingTickersEvent')
+        self.errorEvent = Event('errorEvent')
+        self._tickers = {}  # conId -> Ticker
+        self._bars = {}  # conId -> [BarDataList]
+
+    # ib_async.IB interface used by Bot
+    def connect(self, *args, **kwargs):
+        return self
+
+    def disconnect(self):
+        pass
+
+    def isConnected(self):
+        return True
+
+    def sleep(self, secs=0.02):
+        return True
+
+    def reqCurrentTime(self):
+        return datetime.fromtimestamp(self.now_ns / 1e9, timezone.utc)
+
+    def qualifyContracts(self, *contracts):
+        for c in contracts:
+            c.conId = self.symbols.get(c.localSymbol) or self.symbols[c.symbol]
+            c.localSymbol = c.localSymbol or c.symbol
+            c.symbol = c.symbol or c.localSymbol
+        return list(contracts)
+
+    def ticker(self, contract):
+        return self._ticker(contract)
+
+    def reqMktData(self, contract, *args, **kwargs):
+        return self._ticker(contract)
+
+    def reqTickByTickData(self, contract, tickType='Last', *args, **kwargs):
+        return self._ticker(contract)
+
+    def cancelMktData(self, contract):
+        pass
+
+    def cancelTickByTickData(self, contract, tickType='Last'):
+        pass
+
+    def reqHistoricalData(self, contract, endDateTime='', durationStr='', barSizeSetting='5 mins',
+                          whatToShow='TRADES', useRTH=False, formatDate=2, keepUpToDate=False, *args, **kwargs):
+        """Backfill is aggregated from the ticks before start_ns; updates follow the replay."""
+        bars = BarDataList()
+        bars.reqId = len(self._bars) + 1
+        bars.contract = contract
+        bars.barSizeSetting = barSizeSetting
+        bars.whatToShow = whatToShow
+        bars.keepUpToDate = keepUpToDate
+        bars.bar_seconds = bar_seconds(barSizeSetting)
+        if self.start_ns is not None:
+            with_warmup = TickReader(self.directory)
+            for ticks in with_warmup.between(0, self.start_ns):
+                for recv_ns, price, size in self._trades(ticks, contract.conId):
+                    self._update_bar(bars, recv_ns, price, size, emit=False)
+            with_warmup.close()
+        self._bars.setdefault(contract.conId, []).append(bars)
+        return bars
+
+    def cancelHistoricalData(self, bars):
+        subscribers = self._bars.get(bars.contract.conId, [])
+        if bars in subscribers:
+            subscribers.remove(bars)
+
+    # Replay
+    def run(self):
+        """Replay every selected tick; returns the number replayed."""
+        reader = TickReader(self.directory)
+        wall_start = time.perf_counter()
+        sim_start = None
+        start_ns = self.start_ns or 0
+        end_ns = self.end_ns or np.iinfo(np.int64).max
+        for ticks in reader.between(start_ns, end_ns):
+            wanted = ticks[np.isin(ticks['con_id'], list(self._tickers))]
+            for chunk in range(0, len(wanted), self.CHUNK):  # Bounded Python-object batches
+                for recv_ns, exch_ns, price, size, con_id, tick_type in wanted[chunk:chunk + self.CHUNK].tolist():
+                    if self.speed:
+                        sim_start = recv_ns if sim_start is None else sim_start
+                        delay = wall_start + (recv_ns - sim_start) / 1e9 / self.speed - time.perf_counter()
+                        if delay > 0:
+                            time.sleep(delay)
+                    self.now_ns = recv_ns
+                    self._replay_tick(con_id, tick_type, price, size, exch_ns or recv_ns)
+        reader.close()
+        return self.ticks_replayed
+
+    def _replay_tick(self, con_id, tick_type, price, size, ts_ns):
+        ticker = self._tickers[con_id]
+        when = datetime.fromtimestamp(ts_ns / 1e9, timezone.utc)
+        ticker.time = when
+        if tick_type in (TICK_BY_TICK + TICK_BY_TICK_BID, TICK_BY_TICK + TICK_BY_TICK_ASK):
+            bid = tick_type == TICK_BY_TICK + TICK_BY_TICK_BID
+            if bid:
+                ticker.bid, ticker.bidSize = price, size
+            else:
+                ticker.ask, ticker.askSize = price, size
+            ticker.ticks = [TickData(when, 1 if bid else 2, price, size)]  # IB's BID / ASK tick types
+            ticker.tickByTicks = []
+        elif tick_type >= TICK_BY_TICK:
+            ticker.tickByTicks = [TickByTickAllLast(tick_type - TICK_BY_TICK, when, price, size, TickAttribLast(), '', '')]
+            ticker.ticks = []
+        else:
+            ticker.ticks = [TickData(when, tick_type, price, size)]
+            ticker.tickByTicks = []
+        if tick_type in LAST_TICK_TYPES:
+            ticker.last = price
+            ticker.lastSize = size
+            for bars in self._bars.get(con_id, ()):
+                self._update_bar(bars, self.now_ns, price, size, emit=bars.keepUpToDate)
+        self.ticks_replayed += 1
+        self.pendingTickersEvent.emit({ticker})
+
+    def _update_bar(self, bars, recv_ns, price, size, emit):
+        start = datetime.fromtimestamp(recv_ns // 1_000_000_000 // bars.bar_seconds * bars.bar_seconds, timezone.utc)
+        has_new_bar = not bars or bars[-1].date != start
+        if has_new_bar:
+            bars.append(BarData(date=start, open=price, high=price, low=price, close=price, volume=0, average=price, barCount=0))
+        bar = bars[-1]
+        bar.high = max(bar.high, price)
+        bar.low = min(bar.low, price)
+        bar.close = price
+        if size > 0:
+            bar.average = (bar.average * bar.volume + price * size) / (bar.volume + size)
+        bar.volume += size
+        bar.barCount += 1
+        if emit:
+            bars.updateEvent.emit(bars, has_new_bar)
+
+    def _trades(self, ticks, con_id):
+        trades = ticks[(ticks['con_id'] == con_id) & np.isin(ticks['tick_type'], LAST_TICK_TYPES)]
+        return zip(trades['recv_ns'].tolist(), trades['price'].tolist(), trades['size'].tolist())
+
+    def _ticker(self, contract):
+        ticker = self._tickers.get(contract.conId)
+        if ticker is None:
+            ticker = self._tickers[contract.conId] = Ticker(contract=contract)
+        return ticker
+
+
+def replay_bot(directory, symbols, symbol, start_ns=None, end_ns=None, speed=None):
+    """Run one Bot on `symbol` over a recording; returns throughput stats. Picklable for process pools."""
+    from bots import Bot  # Imported here so workers only load it when they run a replay
+
+    ib = ReplayIB(directory, symbols, start_ns, end_ns, speed)
+    bot = Bot(f'replay-{symbol}', lambda *args: None, ib=ib)
+    contract = ib.qualifyContracts(Contract(localSymbol=symbol))[0]  # Any recorded symbol, not just Bot.qualify's roots
+    bot.start_ticker(contract)
+    bot.start_bars(contract)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    ticks = ib.run()
+    cpu = time.process_time() - cpu_start
+    return {
+        'symbol': symbol,
+        'ticks': ticks,
+        'wall': time.perf_counter() - wall_start,
+        'cpu': cpu,
+        'ticks_per_cpu_second': ticks / cpu if cpu else 0.0,
+    }
+
+
+def run_replays(jobs, processes=None):
+    """Run replay jobs (callables returning replay_bot stats) across a process pool."""
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        return list(pool.map(_call, jobs))
+
+
+def _call(job):
+    return job()
+
+
+def main():
+    from dotenv import load_dotenv; load_dotenv()
+    parser = argparse.ArgumentParser(description="Replay recorded ticks through Bot.")
+    parser.add_argument('directory', help="TICK_RECORD_DIR of the recording")
+    parser.add_argument('symbols', nargs='+', help="SYMBOL=conId pairs to replay, one bot each")
+    parser.add_argument('--speed', type=float, default=0, help="Multiple of real time; 0 = as fast as possible")
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    parser.add_argument('--copies', type=int, default=1, help="Replays per symbol, e.g. for parameter sweeps")
+    args = parser.parse_args()
+
+    symbols = dict((pair.split('=')[0], int(pair.split('=')[1])) for pair in args.symbols)
+    jobs = [partial(replay_bot, args.directory, symbols, symbol, speed=args.speed or None)
+            for symbol in symbols for _ in range(args.copies)]
+    results = run_replays(jobs, args.processes)
+    for r in results:
+        print(f"{r['symbol']:<10} {r['ticks']:>10} ticks  {r['wall']:8.2f}s wall  {r['ticks_per_cpu_second']:>12,.0f} ticks/s/core")
+    total_ticks = sum(r['ticks'] for r in results)
+    total_cpu = sum(r['cpu'] for r in results)
+    print(f"total      {total_ticks:>10} ticks  {total_ticks / total_cpu if total_cpu else 0:>12,.0f} ticks/s/core")
+
+
+if __name__ == '__main__':
+    main()
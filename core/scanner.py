@@ -0,0 +1,266 @@
+import asyncio
+import logging
+from collections import namedtuple
+
+import numpy as np
+
+from core.bar_store import _epoch
+from core.metrics import metrics
+
+
+# One crossover on the latest close. direction is 1 (bullish) or -1; score is the move in ATRs, for ranking.
+Signal = namedtuple('Signal', 'symbol con_id kind direction score close rsi atr time')
+
+
+class _Smoothed:
+    """Exponential smoothing of one value per row, seeded with the SMA of each row's first `period` inputs.
+
+    k = 2 / (period + 1) is talib's EMA, k = 1 / period Wilder's average (ATR, RSI).
+    Rows where `valid` is False are left as they are.
+    """
+    def __init__(self, period, k, rows):
+        self.period = period
+        self.k = k
+        self.value = np.full(rows, np.nan)
+        self.count = np.zeros(rows, dtype=np.int64)
+        self.seed = np.zeros(rows)
+
+    def grow(self, rows):
+        self.value = _grown(self.value, rows, np.nan)
+        self.count = _grown(self.count, rows, 0)
+        self.seed = _grown(self.seed, rows, 0.0)
+
+    def update(self, rows, x, valid):
+        count, value = self.count[rows], self.value[rows]
+        seeding = valid & (count < self.period)
+        seed = np.where(seeding, self.seed[rows] + x, self.seed[rows])
+        value = np.where(seeding & (count + 1 == self.period), seed / self.period, value)
+        running = valid & (count >= self.period)
+        value = np.where(running, value + self.k * (x - value), value)
+        self.seed[rows] = seed
+        self.value[rows] = value
+        self.count[rows] = count + valid
+        return value
+
+
+class Scanner:
+    """EMA/MACD/ATR/RSI crossovers for every watched contract in one NumPy pass per bar close.
+
+    Bars come from the MarketDataHub's keepUpToDate bars, shared with any
+    bot on the same contract and costing neither a market data line nor a
+    tick-by-tick stream, into a symbols x time block (`window()`). IB
+    reports each contract's close with its next bar's first update, so the
+    closes of one boundary are batched for `settle` seconds (or until a
+    later boundary's close arrives) and scanned together. Indicators are kept as streaming state per row, so a scan is
+    a few dozen vector operations however long the history, and seeding a
+    contract's backfill runs the same code over its history. Each scan
+    ranks the crossovers by their move in ATRs and calls listeners with the
+    top N:
+        'macd'  MACD line crosses its signal line
+        'ema'   fast EMA crosses slow EMA (the MACD line crosses zero)
+        'rsi'   RSI leaves oversold (up) or overbought (down)
+    """
+    def __init__(self, hub, bar_size='5 mins', duration='49500 S', capacity=512, fast=12, slow=26, signal=9,
+                 atr_period=14, rsi_period=14, rsi_low=30.0, rsi_high=70.0, top_n=10, settle=6.0):
+        self.hub = hub
+        self.bar_size = bar_size  # An IB bar size
+        self.duration = duration  # IB history to seed each contract with, e.g. '2 D'
+        self.settle = settle  # Seconds to wait for the other contracts' closes of a boundary
+        self.capacity = capacity
+        self.rsi_low = rsi_low
+        self.rsi_high = rsi_high
+        self.top_n = top_n
+        self.symbols = []  # Row -> localSymbol
+        self.contracts = []  # Row -> Contract
+        self.rows = {}  # conId -> row
+        self.subscriptions = {}  # conId -> hub Subscription
+        self.listeners = []  # callback(signals), after every scan
+        self.signals = []  # Top signals of the latest scan
+        self.scans = 0
+        self.time = 0  # Epoch second the latest scanned bars started at
+        self._averages = {
+            'fast': _Smoothed(fast, 2.0 / (fast + 1), 0), 'slow': _Smoothed(slow, 2.0 / (slow + 1), 0),
+            'signal': _Smoothed(signal, 2.0 / (signal + 1), 0), 'atr': _Smoothed(atr_period, 1.0 / atr_period, 0),
+            'gain': _Smoothed(rsi_period, 1.0 / rsi_period, 0), 'loss': _Smoothed(rsi_period, 1.0 / rsi_period, 0),
+        }
+        self.block = {name: np.full((0, 2 * capacity), np.nan) for name in ('open', 'high', 'low', 'close')}  # Each column written twice, like BarStore
+        self._last = capacity - 1  # Block column of the latest bar
+        self.state = {name: np.full(0, np.nan) for name in ('prev_close', 'macd', 'hist', 'rsi')}
+        self.active = np.zeros(0, dtype=bool)
+        self._pending = np.zeros(0, dtype=bool)  # Rows with a bar closed since the last scan
+        self._bars = np.full((0, 4), np.nan)  # Their open, high, low, close
+        self._scheduled = None  # TimerHandle of the pending batch's scan
+
+    def __len__(self):
+        return len(self.symbols)
+
+    async def add_async(self, contracts):
+        """Scan `contracts` too: subscribe their bars concurrently, then seed them all in one pass."""
+        contracts = [c for c in contracts if c.conId not in self.rows]
+        subscriptions = await asyncio.gather(*(self.hub.subscribe_bars_async(
+            contract, self.on_bars, filter=_closed, bar_size=self.bar_size, duration=self.duration) for contract in contracts))
+        first = len(self.symbols)
+        self._grow(first + len(contracts))
+        for row, (contract, subscription) in enumerate(zip(contracts, subscriptions), first):
+            self.symbols.append(contract.localSymbol)
+            self.contracts.append(contract)
+            self.rows[contract.conId] = row
+            self.subscriptions[contract.conId] = subscription
+            self.active[row] = True
+        self._seed(slice(first, len(self.symbols)), [subscription.bars[:-1] for subscription in subscriptions])
+
+    def remove(self, contract):
+        row = self.rows.get(contract.conId)
+        if row is None or not self.active[row]:
+            return
+        self.active[row] = False  # The row stays, so no other row moves
+        self._pending[row] = False
+        self.subscriptions.pop(contract.conId).cancel()
+
+    def close(self):
+        for subscription in self.subscriptions.values():
+            subscription.cancel()
+        self.subscriptions.clear()
+        if self._scheduled is not None:
+            self._scheduled.cancel()
+            self._scheduled = None
+        self.active[:] = False
+
+    def window(self, n=None):
+        """Zero-copy (rows x n) views of the newest `n` bars of every row, oldest first; NaN before a row's history."""
+        n = self.capacity if n is None else min(n, self.capacity)
+        end = self._last + self.capacity + 1
+        return {name: block[:, end - n:end] for name, block in self.block.items()}
+
+    def on_bars(self, bars, has_new_bar):
+        row = self.rows.get(bars.contract.conId)
+        if row is None or len(bars) < 2:
+            return
+        bar = bars[-2]
+        start = _epoch(bar.date)
+        if self._scheduled is not None and start > self.time:
+            self.scan()  # A later boundary: the batch is complete
+        self._bars[row] = (bar.open, bar.high, bar.low, bar.close)
+        self._pending[row] = True
+        self.time = start
+        if self._scheduled is None:
+            self._scheduled = asyncio.get_event_loop().call_later(self.settle, self.scan)
+
+    def scan(self):
+        """Apply the batched closes, then rank and publish the crossovers."""
+        t0 = metrics.now()
+        if self._scheduled is not None:
+            self._scheduled.cancel()  # When a later boundary's close scans early
+            self._scheduled = None
+        valid = self._pending & self.active
+        previous = {name: values.copy() for name, values in self.state.items()}
+        self._advance(valid)
+        self._step(slice(None), self._bars[:, 0], self._bars[:, 1], self._bars[:, 2], self._bars[:, 3], valid)
+        self._pending[:] = False
+        self.signals = self._rank(valid, previous)
+        self.scans += 1
+        metrics.since('scan', t0)
+        for listener in self.listeners:
+            listener(self.signals)
+
+    def _rank(self, valid, previous):
+        atr = self._averages['atr'].value
+        close, rsi = self._bars[:, 3], self.state['rsi']
+        macd, hist = self.state['macd'], self.state['hist']
+        move = close - previous['prev_close']
+        with np.errstate(invalid='ignore', divide='ignore'):
+            candidates = [
+                ('macd', valid & (np.sign(previous['hist']) * np.sign(hist) < 0), np.sign(hist), hist / atr),
+                ('ema', valid & (np.sign(previous['macd']) * np.sign(macd) < 0), np.sign(macd), macd / atr),
+                ('rsi', valid & (previous['rsi'] < self.rsi_low) & (rsi >= self.rsi_low), 1.0, move / atr),
+                ('rsi', valid & (previous['rsi'] > self.rsi_high) & (rsi <= self.rsi_high), -1.0, move / atr),
+            ]
+            rows, kinds, directions, scores = [], [], [], []
+            for kind, crossed, direction, score in candidates:
+                crossed &= np.isfinite(score)
+                hit = np.flatnonzero(crossed)
+                rows.append(hit)
+                kinds += [kind] * len(hit)
+                directions.append(np.broadcast_to(direction, crossed.shape)[hit])
+                scores.append(score[hit])
+        rows, directions, scores = np.concatenate(rows), np.concatenate(directions), np.concatenate(scores)
+        if len(rows) > self.top_n:
+            top = np.argpartition(-np.abs(scores), self.top_n - 1)[:self.top_n]
+        else:
+            top = np.arange(len(rows))
+        top = top[np.argsort(-np.abs(scores[top]), kind='stable')]
+        return [Signal(self.symbols[rows[i]], self.contracts[rows[i]].conId, kinds[i], int(directions[i]), float(scores[i]),
+                       float(close[rows[i]]), float(rsi[rows[i]]), float(atr[rows[i]]), self.time) for i in top]
+
+    def _step(self, rows, open_, high, low, close, valid):
+        """Advance every indicator of `rows` by one bar; rows not `valid` keep their state."""
+        averages, state = self._averages, self.state
+        prev_close = state['prev_close'][rows]
+        has_prev = valid & ~np.isnan(prev_close)
+        macd = averages['fast'].update(rows, close, valid) - averages['slow'].update(rows, close, valid)
+        signal = averages['signal'].update(rows, macd, valid & ~np.isnan(macd))
+        true_range = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(low - prev_close)))
+        averages['atr'].update(rows, true_range, has_prev)
+        change = close - prev_close
+        gain = averages['gain'].update(rows, np.fmax(change, 0.0), has_prev)
+        loss = averages['loss'].update(rows, np.fmax(-change, 0.0), has_prev)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rsi = np.where(gain + loss > 0, 100.0 * gain / (gain + loss), 50.0)
+        rsi = np.where(np.isnan(gain), np.nan, rsi)
+        state['prev_close'][rows] = np.where(valid, close, prev_close)
+        state['macd'][rows] = np.where(valid, macd, state['macd'][rows])
+        state['hist'][rows] = np.where(valid, macd - signal, state['hist'][rows])
+        state['rsi'][rows] = np.where(valid, rsi, state['rsi'][rows])
+
+    def _advance(self, valid):
+        """Open the next block column: this boundary's bars, flat at the last close for rows without one."""
+        self._last = (self._last + 1) % self.capacity
+        previous = self._last - 1 + self.capacity
+        for i, name in enumerate(('open', 'high', 'low', 'close')):
+            block = self.block[name]
+            column = np.where(valid, self._bars[:, i], self.block['close'][:, previous])
+            block[:, self._last] = column
+            block[:, self._last + self.capacity] = column
+
+    def _seed(self, rows, histories):
+        """Load each row's completed bars into the block and run the indicators over them, all rows together."""
+        length = max((len(bars) for bars in histories), default=0)
+        if not length:
+            return
+        values = np.full((4, len(histories), length), np.nan)
+        for i, bars in enumerate(histories):
+            if bars:
+                values[:, i, length - len(bars):] = np.array([(bar.open, bar.high, bar.low, bar.close) for bar in bars]).T
+        for t in range(length):
+            self._step(rows, values[0, :, t], values[1, :, t], values[2, :, t], values[3, :, t], ~np.isnan(values[3, :, t]))
+        kept = min(length, self.capacity)
+        columns = (self._last - kept + 1 + np.arange(kept)) % self.capacity
+        for i, name in enumerate(('open', 'high', 'low', 'close')):
+            block = self.block[name]
+            block[rows, columns] = values[i, :, length - kept:]
+            block[rows, columns + self.capacity] = values[i, :, length - kept:]
+        logging.getLogger("HYDRA_logger").debug(f"Scanner seeded {len(histories)} contracts with {length} bars")
+
+    def _grow(self, rows):
+        if rows <= len(self.active):
+            return
+        rows = max(rows, 2 * len(self.active), 16)
+        for average in self._averages.values():
+            average.grow(rows)
+        for name in self.block:
+            self.block[name] = _grown(self.block[name], rows, np.nan)
+        for name in self.state:
+            self.state[name] = _grown(self.state[name], rows, np.nan)
+        self.active = _grown(self.active, rows, False)
+        self._pending = _grown(self._pending, rows, False)
+        self._bars = _grown(self._bars, rows, np.nan)
+
+
+def _grown(array, rows, fill):
+    grown = np.full((rows,) + array.shape[1:], fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _closed(bars, has_new_bar):
+    return has_new_bar
@@ -0,0 +1,73 @@
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+HEADER_BYTES = 64  # write sequence, capacity; padded to a cache line
+
+
+class ShmRing:
+    """Single-writer, many-reader ring of fixed-width records in shared memory.
+
+    The writer never waits for readers. Each reader keeps its own cursor (the
+    sequence number it has read up to); one that falls more than `capacity`
+    records behind skips ahead and is told how many it lost. Pass `name` to
+    attach to a ring created by another process.
+    """
+    def __init__(self, dtype, capacity=1 << 16, name=None):
+        self.dtype = np.dtype(dtype)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=HEADER_BYTES + capacity * self.dtype.itemsize)
+        else:
+            self.shm = _attach(name)
+        self.header = np.ndarray((2,), '<u8', self.shm.buf)
+        if self.owner:
+            self.header[:] = (0, capacity)
+        self.capacity = int(self.header[1])
+        self.records = np.ndarray((self.capacity,), self.dtype, self.shm.buf, offset=HEADER_BYTES)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def cursor(self):
+        """Sequence number of the next record, for readers that only want what comes after now."""
+        return int(self.header[0])
+
+    def append(self, record):
+        seq = int(self.header[0])
+        self.records[seq % self.capacity] = record
+        self.header[0] = seq + 1  # Publish only after the record is complete
+
+    def read(self, cursor):
+        """(records after `cursor` as a copy, new cursor, records lost to overrun)."""
+        end = int(self.header[0])
+        lost = max(0, end - cursor - self.capacity)
+        start = cursor + lost
+        if start == end:
+            return self.records[:0].copy(), end, lost
+        lo, hi = start % self.capacity, end % self.capacity
+        if lo < hi:
+            records = self.records[lo:hi].copy()
+        else:
+            records = np.concatenate((self.records[lo:], self.records[:hi]))
+        overwritten = int(self.header[0]) - self.capacity - start  # The writer lapped us while we copied
+        if overwritten > 0:
+            records = records[overwritten:]
+            lost += overwritten
+        return records, end, lost
+
+    def close(self):
+        self.header = self.records = None  # Release our buffer exports before closing the mapping
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # multiprocessing children share the creator's resource tracker, so this doesn't add an owner
+        return shared_memory.SharedMemory(name=name)
@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import os
+import time
+
+from core.wire import read_frame
+
+
+class StateClient:
+    """Local mirror of a StateServer's view.
+
+        client = StateClient(path='./hydra.sock')
+        await client.connect()
+        async for keys in client.updates():
+            ...  # client.view[key] is current for every key in `keys`
+    """
+    def __init__(self, path=None, host='127.0.0.1', port=None):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.view = {}  # key -> {field: value}
+        self.seq = None
+        self._reader = self._writer = None
+
+    async def connect(self):
+        if self.path is not None:
+            self._reader, self._writer = await asyncio.open_unix_connection(self.path)
+        else:
+            self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+
+    async def updates(self):
+        """Apply frames as they arrive, yielding the keys each one changed; ends when the server goes away."""
+        while True:
+            try:
+                message = await read_frame(self._reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                return
+            yield self.apply(message)
+
+    def apply(self, message):
+        self.seq = message['seq']
+        if message['type'] == 'snapshot':
+            self.view = message['state']
+            return set(self.view)
+        for key, fields in message['set'].items():
+            self.view.setdefault(key, {}).update(fields)
+        for key, fields in message['del'].items():
+            for field in fields:
+                self.view.get(key, {}).pop(field, None)
+        return set(message['set']) | set(message['del'])
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def render(view):
+    """Plain-text desk view for terminals."""
+    tickers = view.get('tickers', {})
+    connection = view.get('connection', {})
+    net_liquidation = next((value for field, value in view.get('account', {}).items()
+                            if field.endswith('|NetLiquidationByCurrency|BASE')), '-')
+    lines = [f"{time.strftime('%H:%M:%S')}  IB {connection.get('status', '?')}  "
+             + "  ".join(f"{symbol} {price}" for symbol, price in sorted(tickers.items()))
+             + f"  NetLiq {net_liquidation}", ""]
+    lines += ["  ".join(f"{cell:>12}" for cell in row) for _, row in sorted(view.get('positions', {}).items())]
+    lines += [""] + view.get('console', {}).get('lines', [])
+    return "\n".join(lines)
+
+
+async def watch(client, refresh=0.25):
+    await client.connect()
+    drawn = 0.0
+    async for _ in client.updates():
+        if time.monotonic() - drawn >= refresh:
+            drawn = time.monotonic()
+            print("\033[H\033[J" + render(client.view), flush=True)
+    print("Server closed the stream.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a running HYDRA core (headless.py, or the TUI with HYDRA_STATE_SOCKET set).")
+    parser.add_argument('--socket', default=os.getenv('HYDRA_STATE_SOCKET', './hydra.sock'))
+    parser.add_argument('--port', type=int, default=os.getenv('HYDRA_STATE_PORT'), help="localhost TCP port instead of the socket")
+    args = parser.parse_args()
+    client = StateClient(path=None if args.port else args.socket, port=args.port)
+    try:
+        asyncio.run(watch(client))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+
+from core.event_manager import event_manager
+from core.wire import frame
+
+
+class _Viewer:
+    def __init__(self, writer):
+        self.writer = writer
+        self.sent = {}  # key -> the view dict this viewer was last sent
+        self.dirty = set()  # keys changed since the last frame
+        self.wake = asyncio.Event()
+        self.seq = 0
+        self.sender = None
+
+
+class StateServer:
+    """Streams desk state to any number of local viewers over a Unix socket (or localhost TCP).
+
+    `sources` maps state keys (the ones mark_dirty() publishes) to callables
+    returning a flat dict of encodable values. A viewer first gets
+        {'type': 'snapshot', 'seq': 0, 'state': {key: {field: value}}}
+    then only what changed since its previous frame:
+        {'type': 'delta', 'seq': n, 'set': {key: {field: value}}, 'del': {key: [field]}}
+    as length-prefixed MessagePack frames (core.wire). Viewers share the
+    core's IB connection and add no IB load. Each has its own sender task that
+    diffs against what it was last sent, so a slow viewer just gets fewer,
+    bigger deltas: the core only marks keys dirty and never waits on a
+    socket. A viewer that can't take a frame for `stall_timeout` seconds is
+    dropped.
+    """
+    def __init__(self, sources, path=None, host='127.0.0.1', port=None, max_rate=30.0, stall_timeout=30.0):
+        self.sources = sources
+        self.path = path
+        self.host = host
+        self.port = port
+        self.min_interval = 1.0 / max_rate  # Per viewer: changes inside this window go out as one delta
+        self.stall_timeout = stall_timeout
+        self.viewers = set()
+        self.frames_sent = 0
+        self._view = {}  # key -> latest view dict
+        self._stale = set(sources)  # keys to recompute before the next frame that needs them
+        self._server = None
+
+    async def start(self):
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.unlink(self.path)  # Left behind by a process that didn't shut down cleanly
+            self._server = await asyncio.start_unix_server(self._serve, path=self.path)
+            where = self.path
+        else:
+            self._server = await asyncio.start_server(self._serve, self.host, self.port)
+            self.port = self._server.sockets[0].getsockname()[1]
+            where = f"{self.host}:{self.port}"
+        event_manager.subscribe('state_changed', self.on_state_changed)
+        logging.getLogger("HYDRA_logger").info(f"Streaming state to viewers on {where}")
+
+    def close(self):
+        event_manager.unsubscribe('state_changed', self.on_state_changed)
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for viewer in list(self.viewers):
+            viewer.sender.cancel()
+            viewer.writer.close()
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def on_state_changed(self, keys):
+        changed = [key for key in keys if key in self.sources]
+        if not changed:
+            return
+        self._stale.update(changed)
+        for viewer in self.viewers:
+            viewer.dirty.update(changed)
+            viewer.wake.set()
+
+    def current(self, key):
+        """Latest view of `key`, computed at most once per change however many viewers ask."""
+        if key in self._stale:
+            self._stale.discard(key)
+            self._view[key] = self.sources[key]()
+        return self._view[key]
+
+    async def _serve(self, reader, writer):
+        viewer = _Viewer(writer)
+        self.viewers.add(viewer)
+        viewer.sender = asyncio.ensure_future(self._send_loop(viewer))
+        try:
+            while await reader.read(4096):
+                pass  # Viewers have nothing to say; EOF means they left
+        except ConnectionError:
+            pass
+        finally:
+            self.viewers.discard(viewer)
+            viewer.sender.cancel()
+            writer.close()
+
+    async def _send_loop(self, viewer):
+        try:
+            snapshot = {key: self.current(key) for key in self.sources}
+            viewer.sent = dict(snapshot)
+            await self._send(viewer, {'type': 'snapshot', 'seq': 0, 'state': snapshot})
+            while True:
+                await viewer.wake.wait()
+                viewer.wake.clear()
+                keys, viewer.dirty = viewer.dirty, set()
+                changes, removed = {}, {}
+                for key in keys:
+                    new, old = self.current(key), viewer.sent.get(key, {})
+                    fields = {field: value for field, value in new.items() if field not in old or not _same(old[field], value)}
+                    if fields:
+                        changes[key] = fields
+                    gone = [field for field in old if field not in new]
+                    if gone:
+                        removed[key] = gone
+                    viewer.sent[key] = new
+                if changes or removed:
+                    viewer.seq += 1
+                    await self._send(viewer, {'type': 'delta', 'seq': viewer.seq, 'set': changes, 'del': removed})
+                await asyncio.sleep(self.min_interval)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            logging.getLogger("HYDRA_logger").warning(f"Dropping state viewer: {e!r}")
+            viewer.writer.close()
+
+    async def _send(self, viewer, message):
+        viewer.writer.write(frame(message))
+        await asyncio.wait_for(viewer.writer.drain(), self.stall_timeout)  # Returns at once unless its buffer is full
+        self.frames_sent += 1
+
+
+def server_from_env(sources):
+    """A StateServer on HYDRA_STATE_PORT (localhost TCP) if set, else on the HYDRA_STATE_SOCKET Unix socket."""
+    port = os.getenv('HYDRA_STATE_PORT')
+    return StateServer(sources, path=None if port else os.getenv('HYDRA_STATE_SOCKET', './hydra.sock'),
+                       port=int(port) if port else None, max_rate=float(os.getenv('HYDRA_STATE_MAX_RATE', 30)))
+
+
+def view_sources(state, console=None):
+    """StateServer sources for core.ib_client.state; `console` returns the console lines to mirror."""
+    def tickers():
+        return {'MES': state['mes_last'], 'MNQ': state['mnq_last']}
+
+    def account():
+        return {f"{account}|{tag}|{currency}": value.value for (account, tag, currency), value in state['accounts'].values.items()}
+
+    def positions():
+        table = state['positions']
+        return {f"{symbol}|{account}": table.rows[(symbol, account)] for symbol, account in table.keys}
+
+    def connection():
+        supervisor = state['connection']
+        return {'status': supervisor.status, 'attempts': supervisor.attempts, 'last_recovery': supervisor.last_recovery}
+
+    def journal():
+        session = state['journal'].session
+        return {'fills': session.fills, 'shares': session.shares, 'realized_pnl': session.realized_pnl,
+                'commission': session.commission, 'slippage': session.slippage}
+
+    def scanner():
+        return {str(rank): [signal.symbol, signal.kind, signal.direction, signal.score, signal.close]
+                for rank, signal in enumerate(state['scanner'].signals, 1)}
+
+    sources = {'tickers': tickers, 'account': account, 'positions': positions, 'connection': connection, 'journal': journal,
+               'scanner': scanner}
+    if console is not None:
+        sources['console'] = lambda: {'lines': list(console())}
+    return sources
+
+
+def _same(a, b):
+    return a is b or a == b or (a != a and b != b)  # NaN prices count as unchanged
@@ -0,0 +1,182 @@
+import glob
+import mmap
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+
+# One fixed-width record per tick. Times are epoch nanoseconds (UTC).
+TICK_DTYPE = np.dtype([
+    ('recv_ns', '<i8'),  # When we received it; never decreases within a recording
+    ('exch_ns', '<i8'),  # Exchange/TWS timestamp, 0 if none
+    ('price', '<f8'),
+    ('size', '<f8'),
+    ('con_id', '<i4'),
+    ('tick_type', '<i4'),  # IB tick type id; tick-by-tick ticks are TICK_BY_TICK + their tickType
+])
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'),
+    ('version', '<u4'),
+    ('record_size', '<u4'),
+    ('capacity', '<u8'),
+    ('count', '<u8'),
+    ('index_stride', '<u8'),
+    ('created_ns', '<i8'),
+    ('reserved', 'V16'),
+])
+MAGIC = b'HYDRATK1'
+TICK_BY_TICK = 1000
+TICK_BY_TICK_MIDPOINT = 4  # MidPoint ticks carry no tickType of their own
+TICK_BY_TICK_BID = 3  # BidAsk ticks neither: each is recorded as a bid and an ask
+TICK_BY_TICK_ASK = 5
+
+
+class TickSegment:
+    """One memory-mapped segment file: header, fixed-capacity records, time index.
+
+    The index holds the recv_ns of every `index_stride`-th record, so seeking
+    by time touches a handful of pages instead of bisecting the whole file.
+    """
+    def __init__(self, path, capacity=None, index_stride=4096, writable=False):
+        self.path = path
+        if capacity is not None:
+            size = _segment_size(capacity, index_stride)
+            with open(path, 'wb') as f:
+                f.truncate(size)
+        with open(path, 'r+b' if writable else 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self.header = np.frombuffer(self._mmap, HEADER_DTYPE, count=1)
+        if capacity is not None:
+            self.header[0] = (MAGIC, 1, TICK_DTYPE.itemsize, capacity, 0, index_stride, time.time_ns(), b'')
+        elif self.header['magic'][0] != MAGIC:
+            raise ValueError(f"{path} is not a tick segment")
+        self.capacity = int(self.header['capacity'][0])
+        self.index_stride = int(self.header['index_stride'][0])
+        self.records = np.frombuffer(self._mmap, TICK_DTYPE, count=self.capacity, offset=HEADER_DTYPE.itemsize)
+        self.index = np.frombuffer(self._mmap, '<i8', count=-(-self.capacity // self.index_stride),
+                                   offset=HEADER_DTYPE.itemsize + self.capacity * TICK_DTYPE.itemsize)
+
+    def __len__(self):
+        return int(self.header['count'][0])
+
+    def ticks(self):
+        """Zero-copy view of every record written so far."""
+        return self.records[:len(self)]
+
+    def search(self, ts_ns):
+        """Index of the first record with recv_ns >= ts_ns."""
+        count = len(self)
+        blocks = self.index[:-(-count // self.index_stride)]
+        block = max(0, int(np.searchsorted(blocks, ts_ns, 'right')) - 1)
+        lo = block * self.index_stride
+        hi = min(lo + self.index_stride, count)
+        return lo + int(np.searchsorted(self.records['recv_ns'][lo:hi], ts_ns, 'left'))
+
+    def between(self, start_ns, end_ns):
+        """Zero-copy view of the records with start_ns <= recv_ns < end_ns."""
+        return self.records[self.search(start_ns):self.search(end_ns)]
+
+    def flush(self):
+        self._mmap.flush()
+
+    def close(self):
+        self.header = self.records = self.index = None  # Release our own buffer exports first
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass  # A caller still holds a view; the mapping is released together with it
+
+
+class TickRecorder:
+    """Append every tick to fixed-width, memory-mapped segment files.
+
+    Appends write straight into the mapped file: no Python objects are kept
+    per tick, so memory stays flat and the GC has nothing to scan however long
+    the session. A full segment is flushed and a new one started.
+    """
+    def __init__(self, directory, segment_records=1 << 20, index_stride=4096):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.index_stride = index_stride
+        self.segment = None
+        self._count = 0
+        self._last_ns = 0
+        self._sequence = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, con_id, tick_type, price, size, exch_time=None):
+        if self.segment is None or self._count == self.segment.capacity:
+            self._roll()
+        recv_ns = max(time.time_ns(), self._last_ns)
+        self._last_ns = recv_ns
+        i = self._count
+        self.segment.records[i] = (recv_ns, _to_ns(exch_time), price, size, con_id, tick_type)
+        if i % self.index_stride == 0:
+            self.segment.index[i // self.index_stride] = recv_ns
+        self._count = i + 1
+        self.segment.header['count'] = self._count  # Publish only after the record is complete
+
+    def record_ticker(self, ticker):
+        """Record everything new on an ib_async Ticker from the current pendingTickersEvent."""
+        con_id = ticker.contract.conId
+        for tick in ticker.ticks:
+            self.append(con_id, tick.tickType, tick.price, tick.size, tick.time)
+        for tick in ticker.tickByTicks:
+            if hasattr(tick, 'price'):  # Last / AllLast
+                self.append(con_id, TICK_BY_TICK + tick.tickType, tick.price, tick.size, tick.time)
+            elif hasattr(tick, 'midPoint'):
+                self.append(con_id, TICK_BY_TICK + TICK_BY_TICK_MIDPOINT, tick.midPoint, 0.0, tick.time)
+            elif hasattr(tick, 'bidPrice'):
+                self.append(con_id, TICK_BY_TICK + TICK_BY_TICK_BID, tick.bidPrice, tick.bidSize, tick.time)
+                self.append(con_id, TICK_BY_TICK + TICK_BY_TICK_ASK, tick.askPrice, tick.askSize, tick.time)
+
+    def flush(self):
+        if self.segment is not None:
+            self.segment.flush()
+
+    def close(self):
+        if self.segment is not None:
+            self.segment.flush()
+            self.segment.close()
+            self.segment = None
+
+    def _roll(self):
+        self.close()
+        self._sequence += 1
+        name = f"ticks-{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._sequence:04d}.seg"
+        self.segment = TickSegment(os.path.join(self.directory, name), self.segment_records,
+                                   self.index_stride, writable=True)
+        self._count = 0
+
+
+class TickReader:
+    """Read-only access to all segments in a directory, oldest first."""
+    def __init__(self, directory):
+        self.segments = [TickSegment(path) for path in sorted(glob.glob(os.path.join(directory, '*.seg')))]
+
+    def __iter__(self):
+        """Zero-copy record views, one per segment."""
+        for segment in self.segments:
+            yield segment.ticks()
+
+    def between(self, start_ns, end_ns):
+        for segment in self.segments:
+            ticks = segment.ticks()
+            if len(ticks) and ticks['recv_ns'][0] < end_ns and ticks['recv_ns'][-1] >= start_ns:
+                yield segment.between(start_ns, end_ns)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+
+def _segment_size(capacity, index_stride):
+    return HEADER_DTYPE.itemsize + capacity * TICK_DTYPE.itemsize + -(-capacity // index_stride) * 8
+
+
+def _to_ns(t):
+    if t is None:
+        return 0
+    return int(t.timestamp() * 1_000_000_000)
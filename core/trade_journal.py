@@ -0,0 +1,292 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from ib_async.util import UNSET_DOUBLE
+
+
+NY = ZoneInfo("America/New_York")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fills (
+    exec_id TEXT PRIMARY KEY,
+    time REAL NOT NULL,           -- epoch seconds
+    day TEXT NOT NULL,            -- New York trading date, YYYY-MM-DD
+    account TEXT NOT NULL,
+    symbol TEXT NOT NULL,         -- localSymbol
+    con_id INTEGER NOT NULL,
+    side INTEGER NOT NULL,        -- 1 bought, -1 sold
+    shares REAL NOT NULL,
+    price REAL NOT NULL,
+    multiplier REAL NOT NULL,
+    expected_price REAL,          -- limit/stop/reference price, for slippage
+    order_id INTEGER,
+    perm_id INTEGER,
+    order_ref TEXT,
+    bot TEXT NOT NULL,            -- codename, from an orderRef of '<codename>-<n>'
+    commission REAL NOT NULL DEFAULT 0,
+    realized_pnl REAL NOT NULL DEFAULT 0,
+    reported INTEGER NOT NULL DEFAULT 0   -- commission report applied
+);
+CREATE INDEX IF NOT EXISTS fills_time ON fills (time);
+CREATE INDEX IF NOT EXISTS fills_symbol ON fills (symbol, time);
+CREATE INDEX IF NOT EXISTS fills_account ON fills (account, time);
+CREATE INDEX IF NOT EXISTS fills_bot ON fills (bot, time);
+-- One row per day/account/symbol/bot, kept in step with fills, so reports over years read a few thousand rows
+CREATE TABLE IF NOT EXISTS daily (
+    day TEXT NOT NULL,
+    account TEXT NOT NULL,
+    symbol TEXT NOT NULL,
+    bot TEXT NOT NULL,
+    fills INTEGER NOT NULL DEFAULT 0,
+    shares REAL NOT NULL DEFAULT 0,
+    notional REAL NOT NULL DEFAULT 0,
+    slippage REAL NOT NULL DEFAULT 0,   -- currency; positive is worse than expected
+    commission REAL NOT NULL DEFAULT 0,
+    realized_pnl REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, account, symbol, bot)
+);
+"""
+
+_INSERT_FILL = """INSERT OR IGNORE INTO fills (exec_id, time, day, account, symbol, con_id, side, shares, price, multiplier,
+                                               expected_price, order_id, perm_id, order_ref, bot)
+                  VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
+_ADD_DAILY = """INSERT INTO daily (day, account, symbol, bot, fills, shares, notional, slippage, commission, realized_pnl)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (day, account, symbol, bot) DO UPDATE SET
+                    fills = fills + excluded.fills, shares = shares + excluded.shares, notional = notional + excluded.notional,
+                    slippage = slippage + excluded.slippage, commission = commission + excluded.commission,
+                    realized_pnl = realized_pnl + excluded.realized_pnl"""
+
+
+class SessionStats:
+    """Running totals of the fills journaled since start (today's earlier ones included: IB replays them on connect)."""
+    def __init__(self):
+        self.fills = 0
+        self.shares = 0.0
+        self.commission = 0.0
+        self.realized_pnl = 0.0
+        self.slippage = 0.0
+
+    @property
+    def net(self):
+        return self.realized_pnl - self.commission
+
+
+class TradeJournal:
+    """Fills and commissions in SQLite (WAL), indexed by time, symbol, account and bot.
+
+    Nothing touches the disk until open() (or the first report). Feed it
+    ib.execDetailsEvent and ib.commissionReportEvent. Rows are queued
+    and written by a background thread in one transaction per batch (group
+    commit), so the event loop never waits on the disk. A fill seen twice (live
+    and again in backfill() after a reconnect) is journaled once, by exec_id.
+
+    Reports read the `daily` rollup, which every write keeps in step:
+        journal.pnl('day', start=date(2024, 1, 1), bot='ss_live')
+    """
+    _STOP = object()
+
+    def __init__(self, path, expected_price=None, batch_size=512):
+        self.path = path
+        self.expected_price = expected_price  # callable(trade) -> price the order was decided at, or None
+        self.session = SessionStats()
+        self.listeners = []  # callback(journal), after each fill or commission report
+        self.queue = queue.SimpleQueue()
+        self.batch_size = batch_size
+        self.batches = 0
+        self._seen = set()  # exec_ids recorded this session
+        self._fills = {}  # exec_id -> (day, account, symbol, bot) of this session's fills, for their commission reports
+        self._reader = None
+        self._reader_thread = None
+        self._writer = None
+
+    def open(self):
+        """Create the database if needed and start the writer; rows queued before now are written too."""
+        if self._writer is not None:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        connection = self._connect()
+        connection.executescript(SCHEMA)
+        connection.close()
+        self._writer = threading.Thread(target=self._run, name="hydra-trade-journal", daemon=True)
+        self._writer.start()
+
+    def close(self):
+        """Write everything queued so far and stop the writer."""
+        if self._writer is not None and self._writer.is_alive():
+            self.queue.put(self._STOP)
+            self._writer.join()
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+
+    def on_exec_details(self, trade, fill):
+        execution = fill.execution
+        if execution.execId in self._seen:
+            return
+        self._seen.add(execution.execId)
+        contract = fill.contract
+        side = 1 if execution.side == 'BOT' else -1
+        multiplier = float(contract.multiplier or 1)
+        expected = _expected_price(trade, self.expected_price)
+        slippage = side * (execution.price - expected) * execution.shares * multiplier if expected else 0.0
+        order_ref = execution.orderRef or (trade.order.orderRef if trade is not None else '')
+        bot = order_ref.rsplit('-', 1)[0] if '-' in order_ref else order_ref
+        day = execution.time.astimezone(NY).date().isoformat()
+        key = (day, execution.acctNumber, contract.localSymbol, bot)
+        self._fills[execution.execId] = key
+        self.queue.put(('fill', (execution.execId, execution.time.timestamp(), day, execution.acctNumber, contract.localSymbol,
+                                 contract.conId, side, execution.shares, execution.price, multiplier, expected,
+                                 execution.orderId, execution.permId, order_ref, bot),
+                        key + (1, execution.shares, execution.shares * execution.price * multiplier, slippage, 0.0, 0.0)))
+        self.session.fills += 1
+        self.session.shares += execution.shares
+        self.session.slippage += slippage
+        if fill.commissionReport.execId:  # Replayed fills arrive with their report attached
+            self.on_commission_report(trade, fill, fill.commissionReport)
+        else:
+            self._changed()
+
+    def backfill(self, fills, trades=()):
+        """Journal ib.fills(): the executions ib_async requests on every (re)connect emit no events."""
+        by_perm_id = {trade.order.permId: trade for trade in trades}
+        for fill in fills:
+            self.on_exec_details(by_perm_id.get(fill.execution.permId), fill)
+
+    def on_commission_report(self, trade, fill, report):
+        key = self._fills.get(report.execId)
+        if key is None:
+            return  # A fill from before this session: already in the journal with its commission
+        del self._fills[report.execId]
+        realized = 0.0 if report.realizedPNL == UNSET_DOUBLE else report.realizedPNL  # Unset on opening fills
+        self.queue.put(('commission', (report.commission, realized, report.execId),
+                        key + (0, 0.0, 0.0, 0.0, report.commission, realized)))
+        self.session.commission += report.commission
+        self.session.realized_pnl += realized
+        self._changed()
+
+    def pnl(self, period='day', start=None, end=None, account=None, symbol=None, bot=None):
+        """[(period start, fills, shares, realized PnL, commission, net, slippage)], oldest first; `period` is 'day' or 'week'.
+
+        Dates are New York trading days, `end` inclusive. Fills still queued are not included.
+        """
+        where, args = _filters(start, end, account, symbol, bot)
+        bucket = "day" if period == 'day' else "date(day, '-' || ((strftime('%w', day) + 6) % 7) || ' days')"  # Monday
+        rows = self._query(f"""SELECT {bucket} AS period, SUM(fills), SUM(shares), SUM(realized_pnl), SUM(commission),
+                                      SUM(realized_pnl) - SUM(commission), SUM(slippage)
+                               FROM daily {where} GROUP BY period ORDER BY period""", args)
+        return rows
+
+    def by(self, column, start=None, end=None, account=None, symbol=None, bot=None):
+        """Totals per 'symbol', 'account' or 'bot': [(name, fills, shares, realized PnL, commission, net, slippage)]."""
+        if column not in ('symbol', 'account', 'bot'):
+            raise ValueError(f"Can't group by {column!r}")
+        where, args = _filters(start, end, account, symbol, bot)
+        return self._query(f"""SELECT {column}, SUM(fills), SUM(shares), SUM(realized_pnl), SUM(commission),
+                                      SUM(realized_pnl) - SUM(commission), SUM(slippage)
+                               FROM daily {where} GROUP BY {column} ORDER BY {column}""", args)
+
+    def fills(self, start=None, end=None, account=None, symbol=None, bot=None, limit=1000):
+        """Individual fills, newest first."""
+        where, args = _filters(start, end, account, symbol, bot, time_column=True)
+        return self._query(f"""SELECT time, account, symbol, side, shares, price, expected_price, commission, realized_pnl, bot, exec_id
+                               FROM fills {where} ORDER BY time DESC LIMIT ?""", args + [limit])
+
+    def _query(self, sql, args):
+        self.open()
+        if self._reader is None or self._reader_thread is not threading.current_thread():
+            self._reader = self._connect()  # Readers never block the writer in WAL mode
+            self._reader_thread = threading.current_thread()
+        return self._reader.execute(sql, args).fetchall()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.path)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=FULL")  # One fsync per batch, so FULL is cheap and a commit survives power loss
+        return connection
+
+    def _changed(self):
+        for listener in self.listeners:
+            listener(self)
+
+    def _run(self):
+        connection = self._connect()
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if self._STOP in batch:
+                running = False
+                batch = [item for item in batch if item is not self._STOP]
+            try:
+                self._write(connection, batch)
+            except sqlite3.Error as e:
+                logging.getLogger("HYDRA_logger").error(f"Trade journal write failed, {len(batch)} records lost: {e!r}")
+        connection.close()
+
+    def _write(self, connection, batch):
+        with connection:  # One transaction (and one fsync) for the whole batch
+            for kind, row, daily in batch:
+                if kind == 'fill':
+                    if connection.execute(_INSERT_FILL, row).rowcount:
+                        connection.execute(_ADD_DAILY, daily)
+                elif connection.execute("UPDATE fills SET commission = ?, realized_pnl = ?, reported = 1 WHERE exec_id = ? AND NOT reported", row).rowcount:
+                    connection.execute(_ADD_DAILY, daily)
+        self.batches += 1
+
+
+def _expected_price(trade, expected_price):
+    if trade is None:
+        return None
+    if expected_price is not None:
+        price = expected_price(trade)
+        if price is not None:
+            return price
+    order = trade.order
+    if order.orderType in ('LMT', 'STP LMT'):
+        return order.lmtPrice
+    if order.orderType == 'STP':
+        return order.auxPrice
+    return None
+
+
+def _filters(start, end, account, symbol, bot, time_column=False):
+    clauses, args = [], []
+    if start is not None:
+        if time_column:
+            clauses.append("time >= ?")
+            args.append(datetime.combine(_day(start), datetime.min.time(), NY).timestamp())
+        else:
+            clauses.append("day >= ?")
+            args.append(_day(start).isoformat())
+    if end is not None:
+        if time_column:
+            clauses.append("time < ?")
+            args.append(datetime.combine(_day(end) + timedelta(days=1), datetime.min.time(), NY).timestamp())
+        else:
+            clauses.append("day <= ?")
+            args.append(_day(end).isoformat())
+    for column, value in (('account', account), ('symbol', symbol), ('bot', bot)):
+        if value is not None:
+            clauses.append(f"{column} = ?")
+            args.append(value)
+    return ("WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+
+def _day(value):
+    if isinstance(value, datetime):
+        return value.astimezone(NY).date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
@@ -0,0 +1,142 @@
+"""Length-prefixed MessagePack frames for the state stream.
+
+Only the subset the stream needs (nil, bool, int, float64, str, bin, array,
+map) is implemented, but it is standard MessagePack: script clients in any
+language can decode frames with their usual msgpack library after reading
+the 4-byte big-endian length.
+"""
+import struct
+
+
+_PREFIX = struct.Struct('>I')
+
+
+def pack(obj):
+    out = bytearray()
+    _pack(obj, out)
+    return bytes(out)
+
+
+def frame(obj):
+    payload = pack(obj)
+    return _PREFIX.pack(len(payload)) + payload
+
+
+async def read_frame(reader):
+    """Next decoded frame from an asyncio StreamReader; raises IncompleteReadError at EOF."""
+    size, = _PREFIX.unpack(await reader.readexactly(4))
+    return unpack(await reader.readexactly(size))
+
+
+def unpack(data):
+    obj, end = _unpack(memoryview(data), 0)
+    if end != len(data):
+        raise ValueError(f"{len(data) - end} trailing bytes")
+    return obj
+
+
+def _pack(obj, out):
+    if obj is None:
+        out.append(0xc0)
+    elif obj is True:
+        out.append(0xc3)
+    elif obj is False:
+        out.append(0xc2)
+    elif isinstance(obj, int):
+        if 0 <= obj < 0x80:
+            out.append(obj)
+        elif -32 <= obj < 0:
+            out.append(obj & 0xff)
+        elif obj >= 0:
+            out += struct.pack('>BQ', 0xcf, obj)
+        else:
+            out += struct.pack('>Bq', 0xd3, obj)
+    elif isinstance(obj, float):
+        out += struct.pack('>Bd', 0xcb, obj)
+    elif isinstance(obj, str):
+        data = obj.encode()
+        _header(out, len(data), 0xa0, 32, 0xd9, 0xda, 0xdb)
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        _header(out, len(obj), None, 0, 0xc4, 0xc5, 0xc6)
+        out += obj
+    elif isinstance(obj, (list, tuple)):
+        _header(out, len(obj), 0x90, 16, None, 0xdc, 0xdd)
+        for item in obj:
+            _pack(item, out)
+    elif isinstance(obj, dict):
+        _header(out, len(obj), 0x80, 16, None, 0xde, 0xdf)
+        for key, value in obj.items():
+            _pack(key, out)
+            _pack(value, out)
+    else:
+        raise TypeError(f"Can't encode {type(obj).__name__}")
+
+
+def _header(out, n, fix, fix_limit, tag8, tag16, tag32):
+    if fix is not None and n < fix_limit:
+        out.append(fix | n)
+    elif tag8 is not None and n < 0x100:
+        out += struct.pack('>BB', tag8, n)
+    elif n < 0x10000:
+        out += struct.pack('>BH', tag16, n)
+    else:
+        out += struct.pack('>BI', tag32, n)
+
+
+_SIZED = {  # tag -> (struct format of the length, kind)
+    0xd9: ('>B', 'str'), 0xda: ('>H', 'str'), 0xdb: ('>I', 'str'),
+    0xc4: ('>B', 'bin'), 0xc5: ('>H', 'bin'), 0xc6: ('>I', 'bin'),
+    0xdc: ('>H', 'array'), 0xdd: ('>I', 'array'),
+    0xde: ('>H', 'map'), 0xdf: ('>I', 'map'),
+}
+_SCALARS = {  # tag -> struct format
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+    0xca: '>f', 0xcb: '>d',
+}
+
+
+def _unpack(data, i):
+    tag = data[i]
+    i += 1
+    if tag < 0x80:
+        return tag, i
+    if tag >= 0xe0:
+        return tag - 0x100, i
+    if 0xa0 <= tag <= 0xbf:
+        return _sized(data, i, tag & 0x1f, 'str')
+    if 0x90 <= tag <= 0x9f:
+        return _sized(data, i, tag & 0x0f, 'array')
+    if 0x80 <= tag <= 0x8f:
+        return _sized(data, i, tag & 0x0f, 'map')
+    if tag == 0xc0:
+        return None, i
+    if tag in (0xc2, 0xc3):
+        return tag == 0xc3, i
+    if tag in _SCALARS:
+        fmt = _SCALARS[tag]
+        return struct.unpack_from(fmt, data, i)[0], i + struct.calcsize(fmt)
+    if tag in _SIZED:
+        fmt, kind = _SIZED[tag]
+        n = struct.unpack_from(fmt, data, i)[0]
+        return _sized(data, i + struct.calcsize(fmt), n, kind)
+    raise ValueError(f"Unsupported MessagePack tag 0x{tag:02x}")
+
+
+def _sized(data, i, n, kind):
+    if kind == 'str':
+        return str(data[i:i + n], 'utf-8'), i + n
+    if kind == 'bin':
+        return bytes(data[i:i + n]), i + n
+    if kind == 'array':
+        items = []
+        for _ in range(n):
+            item, i = _unpack(data, i)
+            items.append(item)
+        return items, i
+    result = {}
+    for _ in range(n):
+        key, i = _unpack(data, i)
+        result[key], i = _unpack(data, i)
+    return result, i
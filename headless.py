@@ -0,0 +1,38 @@
+import asyncio
+import signal
+
+from dotenv import load_dotenv; load_dotenv()
+
+from core.ib_client import graceful_shutdown, start_session, state, util
+from core.logger import logger, log
+from core.state_server import server_from_env, view_sources
+
+
+def on_session_started(task):
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        log.error(f"IB session failed to start: {task.exception()!r}")
+    else:
+        log.info(f"IB session ready in {task.result():.2f}s")
+
+
+def main():
+    """Run the IB core without the TUI; watch it with `python -m core.state_client`."""
+    loop = util.getLoop()
+    server = server_from_env(view_sources(state, logger.get_console_messages))
+    loop.run_until_complete(server.start())
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    session = asyncio.ensure_future(start_session())
+    session.add_done_callback(on_session_started)
+    loop.run_until_complete(stop.wait())
+    log.info("HYDRA headless shutting down.")
+    session.cancel()
+    server.close()
+    graceful_shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
+import asyncio
+import logging
 import os
 import sys
 from zoneinfo import ZoneInfo
@@ -5,18 +7,132 @@ from zoneinfo import ZoneInfo
 import urwid
 from dotenv import load_dotenv; load_dotenv()
 
-#from core.event_manager import event_manager
-from core.ib_client import ib, util, state, update_state, graceful_shutdown
+from core.event_manager import event_manager
+from core.ib_client import ib, util, state, graceful_shutdown, start_session
 from core.logger import logger, log
+from core.metrics import format_ns, metrics
+from core.position_table import COLUMNS as POSITION_COLUMNS
+from core.render_scheduler import RenderScheduler
+from core.state_server import server_from_env, view_sources
+
+
+POSITION_CELL_WIDTH = 13  # The longest header, 'unrealizedPNL'
+
+
+class ConsoleWalker(urwid.ListWalker):
+    """Virtual list over logger.console: the ListBox asks only for the rows it shows, so a frame costs the same
+    however much history is held. Positions are the buffer's sequence numbers; with `focus` None the view
+    follows the newest record, otherwise it stays where it was scrolled to.
+    """
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.focus = None  # Sequence number of the focused record; None follows the newest
+        self.level = 0  # Minimum level shown
+        self.source = ''  # Source filter as typed
+        self.sources = None  # Source ids shown, None for all
+        self._widgets = {}  # seq -> Text of rows shown lately
+
+    @property
+    def following(self):
+        return self.focus is None
+
+    def get_focus(self):
+        seq = self.focus_position()
+        return (None, None) if seq is None else (self._widget(seq), seq)
+
+    def set_focus(self, seq):
+        self.focus = None if seq == self._newest() else seq  # Scrolling back to the end resumes following
+        self._modified()
+
+    def get_next(self, seq):
+        return self._at(self.buffer.find(seq + 1, 1, self.level, self.sources))
+
+    def get_prev(self, seq):
+        return self._at(self.buffer.find(seq - 1, -1, self.level, self.sources)) if seq > 0 else (None, None)
+
+    def focus_position(self):
+        if self.focus is None:
+            return self._newest()
+        if self.focus < self.buffer.start:  # Scrolled so far back that it was overwritten
+            self.focus = self.buffer.find(self.buffer.start, 1, self.level, self.sources)
+        return self.focus
+
+    def move(self, records):
+        """Scroll `records` shown records towards the newest (positive) or the oldest."""
+        seq = self.focus_position()
+        step = 1 if records > 0 else -1
+        for _ in range(abs(records)):
+            next_seq = self.buffer.find(seq + step, step, self.level, self.sources) if seq is not None and seq + step >= 0 else None
+            if next_seq is None:
+                break
+            seq = next_seq
+        if seq is not None:
+            self.set_focus(seq)
+
+    def home(self):
+        seq = self.buffer.find(self.buffer.start, 1, self.level, self.sources)
+        if seq is not None:
+            self.set_focus(seq)
+
+    def end(self):
+        self.focus = None
+        self._modified()
+
+    def search(self, text, step=-1, start=None):
+        """Focus the nearest record containing `text` from `start` (default: the focused one) towards `step`; False if none."""
+        if start is None:
+            start = self.focus_position()
+        if start is None:
+            return False
+        seq = self.buffer.search(text, start, step, self.level, self.sources)
+        if seq is None:
+            return False
+        self.set_focus(seq)
+        return True
+
+    def set_filter(self, level=None, source=None):
+        """Show records at `level` and above, from sources whose filename contains `source` ('' for all)."""
+        if level is not None:
+            self.level = level
+        if source is not None:
+            self.source = source
+            self.sources = self.buffer.sources_matching(source) if source else None
+        if self.focus is not None:  # Stay near the same place in the history
+            focus = self.buffer.find(self.focus, -1, self.level, self.sources)
+            self.focus = focus if focus is not None else self.buffer.find(self.focus, 1, self.level, self.sources)
+        self._widgets.clear()
+        self._modified()
+
+    def refresh(self):
+        """New records arrived."""
+        if len(self._widgets) > 512:
+            self._widgets.clear()
+        self._modified()
+
+    def _newest(self):
+        return self.buffer.find(self.buffer.end - 1, -1, self.level, self.sources)
+
+    def _at(self, seq):
+        return (None, None) if seq is None else (self._widget(seq), seq)
+
+    def _widget(self, seq):
+        widget = self._widgets.get(seq)
+        if widget is None:
+            widget = self._widgets[seq] = urwid.Text(self.buffer.format(seq), wrap='clip')
+        return widget
 
 
 class TUI:
     def __init__(self):
+        event_manager.bind(util.getLoop())  # ib_async's loop, run on this thread by bind_async_loop
         ib.errorEvent += logger.OnIBErrorEvent  # Catch IB TWS errors
         log.info("HYDRA started.")
         self.paused = False
-        self.console_messages = []
+        self.console_prompt = None  # ('search' | 'source', text typed so far) while the console takes keys
+        self.console_search = ''
         self.bots = []
+        self.show_metrics = metrics.enabled
+        self.rendered_tick_at = None  # Receive time of the oldest tick rendered but not yet drawn
 
     def draw_initial_layout(self):
         """Draw the initial boxes and text fields for the frame."""
@@ -31,11 +147,14 @@ class TUI:
         self.top_mes = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
         self.top_mnq = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
         self.top_net_liquidation = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
+        self.top_connection = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
 
-        self.pos_local_symbol = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
-        self.pos_position = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
-        self.pos_average_cost = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
-        self.pos_cost = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
+        # Position table: a Pile of rows, header first, each row one Text so a cell diff re-renders one row
+        self.pos_table = urwid.Pile([urwid.Text(self.position_row(POSITION_COLUMNS), wrap='clip')])
+        self.pos_cells = []  # Row -> cell texts, for re-rendering a row when one cell changes
+        self.pending_position_diffs = []
+        for row, cells in enumerate(state['positions'].snapshot()):
+            self.apply_position_diff(('insert', row, None, cells))
         #
         self.dropdown = ['0', '1', '2']
         self.dropdown_btns = []
@@ -55,14 +174,16 @@ class TUI:
                                                                 ('weight', 4, self.top_mes),
                                                                 ('weight', 4, self.top_mnq),
                                                                 ('weight', 4, self.top_net_liquidation),
+                                                                ('weight', 5, self.top_connection),
                                                                 ('weight', 1, self.top_dropdown)
-                                                            ], box_columns=[4])))
+                                                            ], box_columns=[5])))
 
         self.middle_left_input = urwid.AttrMap(urwid.Edit("Input: ", wrap='clip'), None, 'focus')
         self.middle_left_ticker = urwid.AttrMap(urwid.Text("ML", wrap='clip'), None, 'focus')
         self.debug = urwid.AttrMap(urwid.Text(""), 'normal', 'focus')
         self.debug2 = urwid.AttrMap(urwid.Text(""), 'normal', 'focus')
-        self.middle_left_pile = urwid.Pile([self.middle_left_input, self.middle_left_ticker, self.debug, self.debug2])
+        self.middle_left_session = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
+        self.middle_left_pile = urwid.Pile([self.middle_left_input, self.middle_left_ticker, self.pos_table, self.middle_left_session, self.debug, self.debug2])
         self.middle_left = urwid.LineBox(self.middle_left_pile)
 
         self.middle_right_text = urwid.AttrMap(urwid.Text("MR", wrap='clip'), None, 'focus')
@@ -74,8 +195,10 @@ class TUI:
                                                 ]),
                                     valign="top")
 
-        self.bottom_text = urwid.AttrMap(urwid.Text("", wrap='clip'), None, 'focus')
-        self.bottom = urwid.LineBox(urwid.ListBox(urwid.SimpleListWalker([self.bottom_text])))
+        # Console: a window onto logger.console's history, keys in console_key
+        self.console_walker = ConsoleWalker(logger.console)
+        self.console_list = urwid.ListBox(self.console_walker)
+        self.bottom = urwid.LineBox(self.console_list, title="console", title_align='left')
 
         self.frame = urwid.Pile([
             (3, self.top),              # Fixed height for the top section
@@ -83,8 +206,8 @@ class TUI:
             (9, self.bottom),           # Fixed height for the bottom section
         ])
 
-    def bind_async_loop(self):
-        """Link ib_async event loop to urwid's MainLoop."""
+    def bind_async_loop(self, screen=None):
+        """Link ib_async event loop to urwid's MainLoop. `screen` defaults to the terminal."""
         # ib_async's built-in asyncio event loop
         self.ib_loop = util.getLoop()
         # Tell urwid the ib loop is an asyncio loop
@@ -95,35 +218,189 @@ class TUI:
         self.loop = urwid.MainLoop(
             self.frame,
             palette=self.palette,
+            screen=screen,
             unhandled_input=self.handle_input,
+            input_filter=self.filter_input,
             event_loop=self.my_asyncio_loop
         )
-        # Schedule the first refresh when loop runs
-        self.loop.set_alarm_in(0, self.refresh_display)
+        # Redraw only what changed, at most TUI_MAX_FPS times a second
+        self.scheduler = RenderScheduler(self.loop, max_fps=float(os.getenv('TUI_MAX_FPS', 30)))
+        self.scheduler.register('clock', self.render_clock)
+        self.scheduler.register('tickers', self.render_tickers)
+        self.scheduler.register('account', self.render_account)
+        self.scheduler.register('positions', self.render_positions)
+        self.scheduler.register('console', self.render_console)
+        self.scheduler.register('metrics', self.render_metrics)
+        self.scheduler.register('connection', self.render_connection)
+        self.scheduler.register('journal', self.render_journal)
+        self.scheduler.register('scanner', self.render_scanner)
+        draw_screen = self.loop.draw_screen
+        def timed_draw_screen():
+            t0 = metrics.now()
+            draw_screen()
+            metrics.since('draw', t0)
+            metrics.record_since('tick_to_screen', self.rendered_tick_at)
+            self.rendered_tick_at = None
+        self.loop.draw_screen = timed_draw_screen
+        metrics.start_loop_monitor(self.ib_loop)
+        event_manager.subscribe('state_changed', self.on_state_changed)
+        event_manager.subscribe('positions_diff', self.pending_position_diffs.extend)
+        # The clock is the only widget that changes on its own
+        self.loop.set_alarm_in(0, self.tick_clock)
+        # Let other terminals watch this desk (python -m core.state_client) without their own IB session
+        self.state_server = None
+        if os.getenv('HYDRA_STATE_SOCKET') or os.getenv('HYDRA_STATE_PORT'):
+            self.state_server = server_from_env(view_sources(state, logger.get_console_messages))
+            self.ib_loop.run_until_complete(self.state_server.start())
+        # Connect once the loop is running, so the first frame never waits on IB
+        self.loop.set_alarm_in(0, self.connect)
 
     def start(self):
         self.loop.run()
 
-    def refresh_display(self, loop, user_data=None):
-        if not self.paused:
-            update_state()
+    def connect(self, loop=None, user_data=None):
+        log.info("Connecting to IB...")
+        self.session = asyncio.ensure_future(start_session())
+        self.session.add_done_callback(self.on_session_started)
+
+    def on_session_started(self, task):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            log.error(f"IB session failed to start: {task.exception()!r}")
+        else:
+            log.info(f"IB session ready in {task.result():.2f}s")
+
+    def on_state_changed(self, keys):
+        self.scheduler.mark_dirty(*keys)
+
+    def tick_clock(self, loop, user_data=None):
+        """Mark the clock dirty once per second, on the second."""
+        self.scheduler.mark_dirty('clock')
+        if self.show_metrics:
+            self.scheduler.mark_dirty('metrics')
+        now = state['clock'].now()
+        loop.set_alarm_in(1 - now.microsecond / 1_000_000, self.tick_clock)
+
+    def render_clock(self):
+        ib_time = state['clock'].now(ZoneInfo("America/New_York")).strftime("%Y-%m-%d %H:%M:%S") + "  (New York)"
+        self.top_time.base_widget.set_text(ib_time)
+
+    def render_tickers(self):
+        self.top_mes.base_widget.set_text(str(state['mes_last']))
+        self.top_mnq.base_widget.set_text(str(state['mnq_last']))
+        received_at = metrics.take('tickers')
+        if self.rendered_tick_at is None:
+            self.rendered_tick_at = received_at
 
-            self.console_messages = logger.get_console_messages()
-            self.bottom_text.base_widget.set_text("\n".join(self.console_messages))
+    def render_connection(self):
+        supervisor = state['connection']
+        text = f"IB {supervisor.status}"
+        if supervisor.status in ('connecting', 'reconnecting') and supervisor.attempts > 1:
+            text += f" (attempt {supervisor.attempts})"
+        elif supervisor.status == 'connected' and supervisor.last_recovery is not None:
+            text += f", recovered in {supervisor.last_recovery:.1f}s"
+        self.top_connection.base_widget.set_text(text)
 
-            ib_time = str(state['system_time'].now(ZoneInfo("America/New_York"))) + "  (New York)"
-            self.top_time.base_widget.set_text(ib_time)
+    def render_journal(self):
+        session = state['journal'].session
+        self.middle_left_session.base_widget.set_text(
+            f"Session: {session.fills} fills, {session.shares:g} contracts  realized {session.realized_pnl:,.2f}  "
+            f"commission {session.commission:,.2f}  net {session.net:,.2f}  slippage {session.slippage:,.2f}")
 
-            self.top_mes.base_widget.set_text(str(state['mes_last']))
-            self.top_mnq.base_widget.set_text(str(state['mnq_last']))
+    def render_account(self):
+        net_liquidity = state['accounts'].value('All', 'NetLiquidationByCurrency', 'BASE')
+        net_liquidity_value = 'n/a' if net_liquidity is None else '{:,}'.format(int(net_liquidity))
+        self.top_net_liquidation.base_widget.set_text('NetLiquidationByCurrency: ' + net_liquidity_value)
 
-            net_liquidity_header = str(state['account_summary'][88].tag + ': ')
-            net_liquidity_value = str('{:,}'.format(int(state['account_summary'][88].value.split('.')[0])))
-            self.top_net_liquidation.base_widget.set_text(net_liquidity_header + net_liquidity_value)
+    def render_positions(self):
+        """Apply queued cell diffs; untouched cells keep their cached canvases."""
+        diffs = self.pending_position_diffs[:]
+        self.pending_position_diffs.clear()
+        for diff in diffs:
+            self.apply_position_diff(diff)
 
-            self.debug.base_widget.set_text(str(state['debug']))
+    def apply_position_diff(self, diff):
+        kind, row, column, value = diff
+        rows = self.pos_table.contents
+        if kind == 'set':
+            self.pos_cells[row][column] = value
+            rows[row + 1][0].set_text(self.position_row(self.pos_cells[row]))
+        elif kind == 'insert':
+            self.pos_cells.insert(row, list(value))
+            rows.insert(row + 1, (urwid.Text(self.position_row(value), wrap='clip'), self.pos_table.options()))
+        elif kind == 'remove':
+            del self.pos_cells[row]
+            del rows[row + 1]
 
-            loop.set_alarm_in(0, self.refresh_display)
+    @staticmethod
+    def position_row(cells):
+        """Cells padded to fixed-width columns: one Text per row is far cheaper to lay out than a Columns."""
+        return " ".join(f"{text:<{POSITION_CELL_WIDTH}.{POSITION_CELL_WIDTH}}" for text in cells)
+
+    def render_console(self):
+        walker = self.console_walker
+        walker.refresh()
+        seq = walker.focus_position()
+        title = ["console", "following" if walker.following or seq is None else f"scrolled, {logger.console.end - 1 - seq} back"]
+        if walker.level:
+            title.append(f"{logging.getLevelName(walker.level)}+")
+        if walker.source:
+            title.append(f"source: {walker.source}")
+        if self.console_prompt is not None:
+            kind, text = self.console_prompt
+            title.append(f"{'/' if kind == 'search' else 'source: '}{text}_")
+        elif self.console_search:
+            title.append(f"/{self.console_search} (n/N)")
+        self.bottom.set_title(" | ".join(title))
+
+    def console_input(self, key):
+        """Keys while a console prompt is open; True if consumed."""
+        kind, text = self.console_prompt
+        if key == 'esc':
+            self.console_prompt = None
+        elif key == 'enter':
+            self.console_prompt = None
+            if kind == 'search':
+                self.console_search = text
+            else:
+                self.console_walker.set_filter(source=text)
+        elif key == 'backspace':
+            self.console_prompt = (kind, text[:-1])
+        elif len(key) == 1 and key.isprintable():
+            text += key
+            self.console_prompt = (kind, text)
+            if kind == 'search':
+                self.console_walker.search(text)  # Incremental: from the focused record back
+        else:
+            return False
+        self.scheduler.mark_dirty('console')
+        return True
+
+    def render_metrics(self):
+        if not self.show_metrics:
+            self.render_scanner()  # The scanner has the panel while metrics are hidden
+            return
+        lines = [f"{'stage':<15} {'count':>8} {'p50':>9} {'p99':>9} {'max':>9}"]
+        for stage, s in sorted(metrics.summary().items()):
+            lines.append(f"{stage:<15} {s['count']:>8} {format_ns(s['p50']):>9} {format_ns(s['p99']):>9} {format_ns(s['max']):>9}")
+        self.middle_right_text.base_widget.set_text("\n".join(lines))
+
+    def render_scanner(self):
+        if self.show_metrics:
+            return
+        scanner = state['scanner']
+        lines = [f"{'symbol':<10} {'signal':<6} {'ATRs':>6} {'close':>10} {'RSI':>5}"]
+        for signal in scanner.signals:
+            kind = f"{signal.kind}{'+' if signal.direction > 0 else '-'}"
+            lines.append(f"{signal.symbol:<10} {kind:<6} {signal.score:>6.2f} {signal.close:>10.2f} {signal.rsi:>5.1f}")
+        if not scanner.signals:
+            lines.append(f"no crossovers ({len(scanner)} scanned)" if scanner.scans else f"scanning {len(scanner)} contracts")
+        self.middle_right_text.base_widget.set_text("\n".join(lines))
+
+    def export_metrics(self):
+        path = os.getenv('HYDRA_METRICS_EXPORT') or os.path.join('log', f"metrics-{state['clock'].now().strftime('%Y%m%d-%H%M%S')}.json")
+        log.info(f"Metrics written to {metrics.export(path)}")
 
     def initialize_bots(self):
         """Initialize the bots in a dict."""
@@ -157,7 +434,42 @@ class TUI:
         """Return integer key number of self.bots given a codename. Return 0 if none found."""
         return next((key for key, bot in self.bots.items() if codename == bot.codename), 0)
 
+    def filter_input(self, keys, raw):
+        """While a console prompt is open it takes every key, before any widget sees it."""
+        if self.console_prompt is None:
+            return keys
+        return [key for key in keys if not (isinstance(key, str) and self.console_prompt is not None and self.console_input(key))]
+
+    def console_key(self, key):
+        """pgup/pgdn/home/end scroll ('end' follows again), '/' searches back as you type, 'n'/'N' jump to the
+        previous/next match, 'l' cycles the minimum level, 'f' filters by source file. Only keys the widgets
+        declined get here, so typing in the input box is left alone. True if consumed."""
+        walker = self.console_walker
+        if key in ("page up", "page down"):
+            walker.move(logger.console_height if key == "page down" else -logger.console_height)  # One screen
+        elif key == "home":
+            walker.home()
+        elif key == "end":
+            walker.end()
+        elif key == "/":
+            self.console_prompt = ('search', '')
+        elif key == "f":
+            self.console_prompt = ('source', '')
+        elif key in ("n", "N") and self.console_search:
+            start = walker.focus_position()
+            if start is not None:
+                walker.search(self.console_search, -1 if key == "n" else 1, start - 1 if key == "n" else start + 1)
+        elif key == "l":
+            levels = [0, logging.INFO, logging.WARNING, logging.ERROR]
+            walker.set_filter(level=levels[(levels.index(walker.level) + 1) % len(levels)])
+        else:
+            return False
+        self.scheduler.mark_dirty('console')
+        return True
+
     def handle_input(self, key):
+        if isinstance(key, str) and (self.console_input(key) if self.console_prompt is not None else self.console_key(key)):
+            return  # A prompt opened earlier in this batch of keys, after filter_input ran
         if isinstance(key, str):
             input_text = self.middle_left_input.base_widget.get_edit_text()
             #if true:  # fixme: only when edit widget is focused
@@ -169,19 +481,30 @@ class TUI:
             #        self.bots[self.current_bot].start_bars(contract_obj)
             if key.lower() == "q":
                 self.paused = True
+                self.scheduler.pause()
+                if os.getenv('HYDRA_METRICS_EXPORT') and metrics.histograms:
+                    self.export_metrics()
+                if self.state_server is not None:
+                    self.state_server.close()
                 graceful_shutdown()
                 raise urwid.ExitMainLoop()
             if key.lower() == "esc":
                 self.loop.screen.clear()
                 self.loop.draw_screen()
+            elif key.lower() == "m":
+                self.show_metrics = metrics.enabled = not self.show_metrics  # Recording costs nothing while hidden
+                self.scheduler.mark_dirty('metrics')
+            elif key.lower() == "x":
+                self.export_metrics()
             elif key.lower() == "p":
                 if self.paused:
                     self.paused = False
+                    self.scheduler.resume()
                     log.debug("refresh unpaused")
-                    self.loop.set_alarm_in(0, self.refresh_display)
                 else:
                     log.debug("refresh paused")
                     self.paused = True
+                    self.scheduler.pause()
 
 
 if __name__ == "__main__":
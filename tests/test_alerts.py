@@ -0,0 +1,112 @@
+"""AlertDispatcher against a local aiosmtpd server: deduplication, digest batching and reconnects.
+
+    python -m pytest tests
+"""
+import os
+import socket
+import sys
+import time
+from email import message_from_bytes
+
+import pytest
+
+aiosmtpd_controller = pytest.importorskip("aiosmtpd.controller")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.alerts import AlertDispatcher
+
+
+class Inbox:
+    """aiosmtpd handler keeping every message it accepts."""
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(message_from_bytes(envelope.content))
+        return '250 OK'
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.02)
+
+
+@pytest.fixture
+def smtp():
+    inbox = Inbox()
+    controller = aiosmtpd_controller.Controller(inbox, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    yield controller, inbox
+    controller.stop()
+
+
+def dispatcher(port, **kwargs):
+    alerts = AlertDispatcher('127.0.0.1', port, 'hydra@localhost', 'desk@localhost', 'HYDRA alert', **kwargs)
+    alerts.start()
+    return alerts
+
+
+def test_first_alert_goes_out_at_once_then_duplicates_are_counted_in_one_digest(smtp):
+    controller, inbox = smtp
+    alerts = dispatcher(controller.port, window=1.0)
+    alerts.submit('disconnected', 'IB disconnected')
+    wait_for(lambda: len(inbox.messages) == 1, timeout=0.9)  # Before the window closes
+    for _ in range(3):
+        alerts.submit('margin', 'Margin call')
+    alerts.submit('rejected', 'Order rejected')
+    wait_for(lambda: len(inbox.messages) == 2)
+    alerts.stop()
+
+    first, digest = inbox.messages
+    assert first['Subject'] == 'HYDRA alert'
+    assert first.get_payload().strip() == 'IB disconnected'
+    assert digest['Subject'] == 'HYDRA alert (4 alerts)'
+    assert digest.get_payload().strip().splitlines() == ['[x3] Margin call', 'Order rejected']
+    assert alerts.stats['deduplicated'] == 2
+    assert alerts.stats['digests'] == alerts.stats['sent'] == 2
+
+
+def test_reuses_the_connection_and_reconnects_after_the_server_restarts():
+    inbox, port = Inbox(), free_port()
+    controller = aiosmtpd_controller.Controller(inbox, hostname='127.0.0.1', port=port)
+    controller.start()
+    alerts = dispatcher(port, window=0.0, backoff=0.2, max_backoff=0.5, max_retries=10)
+    try:
+        alerts.submit('a', 'first')
+        wait_for(lambda: len(inbox.messages) == 1)
+        connection = alerts._smtp
+        alerts.submit('b', 'second')
+        wait_for(lambda: len(inbox.messages) == 2)
+        assert alerts._smtp is connection
+
+        controller.stop()
+        alerts.submit('c', 'while the server is down')
+        wait_for(lambda: alerts.stats['retries'] >= 1)
+        controller = aiosmtpd_controller.Controller(inbox, hostname='127.0.0.1', port=port)
+        controller.start()
+        wait_for(lambda: len(inbox.messages) == 3)
+    finally:
+        alerts.stop()
+        controller.stop()
+
+    assert inbox.messages[2].get_payload().strip() == 'while the server is down'
+    assert alerts.stats['sent'] == 3
+    assert alerts.stats['failed'] == 0
+
+
+def test_full_queue_drops_instead_of_blocking(smtp):
+    controller, inbox = smtp
+    alerts = AlertDispatcher('127.0.0.1', controller.port, 'hydra@localhost', 'desk@localhost', 'HYDRA alert', max_queue=2)
+    assert alerts.submit('a', 'a') and alerts.submit('b', 'b')  # Not started, so nothing drains
+    assert not alerts.submit('c', 'c')
+    assert alerts.stats['dropped'] == 1
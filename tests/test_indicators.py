@@ -0,0 +1,96 @@
+"""StreamingEMA/StreamingMACD and IndicatorEngine against talib on a fixed series: seeded values and forming-bar updates.
+
+bots.py used to compute MACD as talib.EMA(close, 12) - talib.EMA(close, 26), signal talib.EMA(macd, 9);
+that is the reference here (talib.MACD seeds its fast EMA later, so its first values differ).
+
+    python -m pytest tests
+"""
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+talib = pytest.importorskip("talib")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ib_async import BarData
+
+from core.bar_store import BarStore
+from core.indicators import IndicatorEngine, StreamingEMA, StreamingMACD
+
+TOLERANCE = 1e-9
+
+
+def closes(n=300):
+    """A fixed random walk around MES prices."""
+    return 5000 + np.cumsum(np.random.default_rng(7).normal(0, 2.5, n))
+
+
+def talib_macd(close):
+    macd = talib.EMA(close, timeperiod=12) - talib.EMA(close, timeperiod=26)
+    signal = talib.EMA(macd, timeperiod=9)
+    return macd, signal, macd - signal
+
+
+def assert_close(actual, expected):
+    np.testing.assert_allclose(np.asarray(actual, dtype=float), expected, rtol=0, atol=TOLERANCE, equal_nan=True)
+
+
+def test_ema_matches_talib():
+    close = closes()
+    for period in (9, 12, 26):
+        ema = StreamingEMA(period)
+        assert_close([ema.push(x) for x in close], talib.EMA(close, timeperiod=period))
+
+
+def test_ema_peek_matches_talib_on_forming_sample():
+    close = closes()
+    ema = StreamingEMA(12)
+    for i, x in enumerate(close):
+        forming = x + 0.75  # Where the sample stood before it finished
+        expected = talib.EMA(np.append(close[:i], forming), timeperiod=12)[-1]
+        assert_close(ema.peek(forming), expected)
+        ema.push(x)
+
+
+def test_macd_matches_talib():
+    close = closes()
+    macd = StreamingMACD(12, 26, 9)
+    assert_close([macd.update(x, final=True) for x in close], np.column_stack(talib_macd(close)))
+
+
+def test_macd_forming_update_matches_talib():
+    close = closes()
+    macd = StreamingMACD(12, 26, 9)
+    for i, x in enumerate(close):
+        forming = x - 1.25
+        expected = [column[-1] for column in talib_macd(np.append(close[:i], forming))]
+        assert_close(macd.update(forming), expected)
+        macd.update(x, final=True)
+
+
+def test_engine_seed_and_updates_match_talib():
+    close = closes()
+    start = datetime(2026, 1, 5, 14, 30, tzinfo=timezone.utc)
+    bars = [BarData(date=start + timedelta(minutes=5 * i), open=x, high=x, low=x, close=x) for i, x in enumerate(close)]
+    seeded = 200
+    engine = IndicatorEngine(12, 26, 9)
+    store = BarStore(1024, extra_columns=IndicatorEngine.COLUMNS)
+    engine.seed(1, store, bars[:seeded])
+    expected = np.column_stack(talib_macd(close[:seeded]))
+    assert_close(np.column_stack([store.tail(name) for name in IndicatorEngine.COLUMNS]), expected)
+
+    held = bars[:seeded]
+    for i in range(seeded, len(bars)):
+        held[-1] = BarData(date=held[-1].date, close=close[i - 1] + 0.5)  # The forming bar ticks
+        engine.on_bar_update(1, store, held, False)
+        assert_close([store.last(name) for name in IndicatorEngine.COLUMNS],
+                     [column[-1] for column in talib_macd(np.append(close[:i - 1], close[i - 1] + 0.5))])
+        held[-1] = bars[i - 1]  # It finishes, and the next one opens
+        held.append(bars[i])
+        engine.on_bar_update(1, store, held, True)
+    expected = np.column_stack(talib_macd(close))
+    assert_close(np.column_stack([store.tail(name) for name in IndicatorEngine.COLUMNS]), expected)